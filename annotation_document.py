@@ -0,0 +1,149 @@
+import json
+import os
+import zipfile
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice
+from PyQt5.QtGui import QColor, QFont, QImage, QPixmap
+
+from annotations import KINDS, KIND_CODES, AnnotationStore, StyleTable
+from annotation_renderer import render_annotations
+
+DOCUMENT_EXT = ".shotdoc"
+DOCUMENT_FORMAT = "screenshot-annotations"
+DOCUMENT_VERSION = 1
+INDEX_NAME = "index.json"
+BASE_NAME = "base.png"
+
+
+def encode_png(image):
+    """把QImage编码为PNG字节，可以在工作线程中调用"""
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    if not image.save(buffer, "PNG"):
+        raise OSError("编码失败")
+    return buffer.data().data()
+
+
+def document_index(store, width, height):
+    """把标注存储转换为可以写入JSON的索引
+
+    坐标保存为原始图像坐标；只写入被标注用到的样式，样式编号按首次出现的顺序重新分配
+    """
+    style_ids = {}
+    styles = []
+    shapes = []
+    for record in store.records():
+        kind, x1, y1, x2, y2, style, param, text, _ = record
+        if style not in style_ids:
+            style_ids[style] = len(styles)
+            s = store.styles[style]
+            styles.append({
+                "color": s.color.name(QColor.HexArgb),
+                "width": s.width,
+                "font": s.font.toString() if s.font is not None else None,
+                "kernel": s.kernel,
+            })
+        shapes.append([KINDS[kind], x1, y1, x2, y2, style_ids[style], param, text])
+    return {
+        "format": DOCUMENT_FORMAT,
+        "version": DOCUMENT_VERSION,
+        "width": width,
+        "height": height,
+        "base": BASE_NAME,
+        "styles": styles,
+        "shapes": shapes,
+    }
+
+
+def write_document(path, index, image=None, base_data=None):
+    """写入标注文档
+
+    文档是一个zip文件：index.json保存标注和效果参数，base.png是原始图像。已有PNG字节时传入
+    base_data直接写入，不重新编码；否则编码image。先写临时文件再替换，打开中的旧文档不会被写坏
+    """
+    if base_data is None:
+        base_data = encode_png(image)
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    temp_path = path + ".tmp"
+    # 索引放在最前面并压缩；PNG本身已经压缩，直接存储
+    with zipfile.ZipFile(temp_path, "w") as archive:
+        archive.writestr(INDEX_NAME, json.dumps(index, ensure_ascii=False, separators=(",", ":")),
+                         zipfile.ZIP_DEFLATED)
+        archive.writestr(BASE_NAME, base_data, zipfile.ZIP_STORED)
+    os.replace(temp_path, path)
+
+
+class AnnotationDocument:
+    """打开的标注文档，延迟加载
+
+    open只读取标注索引，原始图像的像素在第一次调用image或pixmap时才解码
+    """
+
+    def __init__(self, path, index):
+        self.path = path
+        self.index = index
+        self._image = None
+
+    @classmethod
+    def open(cls, path):
+        with zipfile.ZipFile(path) as archive:
+            index = json.loads(archive.read(INDEX_NAME).decode("utf-8"))
+        if index.get("format") != DOCUMENT_FORMAT:
+            raise ValueError(f"不是标注文档: {path}")
+        if index.get("version", 0) > DOCUMENT_VERSION:
+            raise ValueError(f"不支持的标注文档版本: {index.get('version')}")
+        return cls(path, index)
+
+    @property
+    def width(self):
+        return self.index["width"]
+
+    @property
+    def height(self):
+        return self.index["height"]
+
+    def __len__(self):
+        return len(self.index["shapes"])
+
+    def base_data(self):
+        """返回原始图像的PNG字节，不解码"""
+        with zipfile.ZipFile(self.path) as archive:
+            return archive.read(self.index["base"])
+
+    def write(self, path, index):
+        """用新的标注索引写入文档，原始图像的PNG直接复制"""
+        write_document(path, index, base_data=self.base_data())
+
+    def image(self):
+        """解码并缓存原始图像"""
+        if self._image is None:
+            image = QImage.fromData(QByteArray(self.base_data()), "PNG")
+            if image.isNull():
+                raise ValueError(f"无法解码原始图像: {self.path}")
+            self._image = image
+        return self._image
+
+    def pixmap(self):
+        return QPixmap.fromImage(self.image())
+
+    def store(self, styles=None):
+        """创建包含文档中全部标注的存储"""
+        store = AnnotationStore(styles if styles is not None else StyleTable())
+        style_ids = []
+        for s in self.index["styles"]:
+            font = None
+            if s["font"] is not None:
+                font = QFont()
+                font.fromString(s["font"])
+            style_ids.append(store.styles.intern(QColor(s["color"]), s["width"], font, s["kernel"]))
+        records = []
+        for uid, (kind, x1, y1, x2, y2, style, param, text) in enumerate(self.index["shapes"]):
+            records.append((KIND_CODES[kind], x1, y1, x2, y2, style_ids[style], param, text, uid))
+        store.restore(records)
+        return store
+
+    def render(self, scale=1.0):
+        """不打开编辑器，渲染带标注的图像，用于批量导出"""
+        return render_annotations(self.image(), self.store(), scale)
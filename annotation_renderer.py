@@ -0,0 +1,177 @@
+import math
+
+from PyQt5.QtCore import QPoint, QRect, QSize, Qt
+from PyQt5.QtGui import QBrush, QImage, QPainter
+
+from image_effects import EffectLayer, blur_effect, mosaic_effect
+
+
+def draw_arrow(painter, start, end, color, width):
+    """绘制箭头"""
+    # 绘制线段
+    painter.drawLine(start, end)
+
+    # 计算箭头
+    arrow_size = max(15, width * 5)  # 箭头大小与线条粗细成比例
+    angle = 20  # 更尖锐的箭头角度（度）
+
+    # 计算线段角度
+    line_length = ((end.x() - start.x())**2 + (end.y() - start.y())**2)**0.5
+    if line_length == 0:
+        return
+
+    # 计算单位向量
+    dx = (end.x() - start.x()) / line_length
+    dy = (end.y() - start.y()) / line_length
+
+    # 计算箭头两边的点（使用正确的三角函数）
+    angle_rad = angle * 3.14159 / 180.0  # 转换为弧度
+
+    # 计算箭头两翼的点
+    x1 = end.x() - arrow_size * (dx * math.cos(angle_rad) + dy * math.sin(angle_rad))
+    y1 = end.y() - arrow_size * (dy * math.cos(angle_rad) - dx * math.sin(angle_rad))
+
+    x2 = end.x() - arrow_size * (dx * math.cos(angle_rad) - dy * math.sin(angle_rad))
+    y2 = end.y() - arrow_size * (dy * math.cos(angle_rad) + dx * math.sin(angle_rad))
+
+    # 创建填充的箭头
+    points = [end, QPoint(int(x1), int(y1)), QPoint(int(x2), int(y2))]
+
+    # 保存当前画笔和画刷
+    old_pen = painter.pen()
+    old_brush = painter.brush()
+
+    # 设置填充色与线条颜色相同
+    painter.setBrush(QBrush(color))
+
+    # 绘制填充的箭头
+    painter.drawPolygon(points)
+
+    # 恢复原来的画笔和画刷
+    painter.setPen(old_pen)
+    painter.setBrush(old_brush)
+
+
+def draw_annotation(painter, kind, x1, y1, x2, y2, style, text=None):
+    """根据形状类型绘制对应图形，马赛克和模糊由draw_effects统一绘制"""
+    if kind in ["rectangle", "circle", "arrow"]:
+        painter.setPen(style.pen)
+
+        # 使用NoBrush确保矩形和圆形只绘制边框
+        painter.setBrush(Qt.NoBrush)
+
+        if kind == "rectangle":
+            painter.drawRect(QRect(QPoint(x1, y1), QPoint(x2, y2)).normalized())
+
+        elif kind == "circle":
+            painter.drawEllipse(QRect(QPoint(x1, y1), QPoint(x2, y2)).normalized())
+
+        elif kind == "arrow":
+            draw_arrow(painter, QPoint(x1, y1), QPoint(x2, y2), style.color, style.width)
+
+    elif kind == "text" and text:
+        painter.setPen(style.pen)
+        painter.setFont(style.font)
+        painter.drawText(x1, y1, text)
+
+
+def draw_shape(painter, store, index):
+    """绘制store中的第index个标注"""
+    x1, y1, x2, y2 = store.points(index)
+    draw_annotation(painter, store.kind(index), x1, y1, x2, y2, store.style(index), store.text(index))
+
+
+def effect_list(store):
+    """返回store中所有马赛克和模糊效果，坐标为原始图像坐标"""
+    effects = []
+    for i in range(len(store)):
+        kind = store.kind(i)
+        if kind not in ["mosaic", "blur"]:
+            continue
+        rect = store.rect(i)
+        if kind == "mosaic":
+            # 马赛克不包括right()和bottom()所在的行列，网格从选区左上角开始
+            rect = QRect(rect.left(), rect.top(), rect.width() - 1, rect.height() - 1)
+            effects.append(mosaic_effect(rect, store.param(i)))
+        else:
+            effects.append(blur_effect(rect, store.param(i), store.style(i).kernel or "box"))
+    return effects
+
+
+class AnnotationRenderer:
+    """不依赖编辑器窗口的标注渲染器
+
+    绘制时painter的坐标系是原始图像坐标，与标注存储中的坐标相同；
+    目标中的偏移和缩放由painter的变换决定。马赛克和模糊从原始像素渲染，结果缓存在
+    effect_layer中。只需要QGuiApplication（字体），不需要窗口
+    """
+
+    def __init__(self, source=None, cache=None):
+        self.source = None
+        self.effect_layer = EffectLayer(cache)
+        if source is not None:
+            self.set_source(source)
+
+    def set_source(self, image):
+        """设置原始图像，之前缓存的效果全部失效"""
+        self.source = image
+        self.effect_layer.set_source(image)
+
+    def effect_patches(self, store):
+        """渲染所有效果，返回 [(范围, 图像块)]，未改动的部分直接取自缓存"""
+        return self.effect_layer.patches(effect_list(store))
+
+    def draw_effects(self, painter, store):
+        """把马赛克和模糊绘制到painter上"""
+        patches = self.effect_patches(store)
+        if not patches:
+            return
+        painter.save()
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for rect, image in patches:
+            painter.drawImage(rect.topLeft(), image)
+        painter.restore()
+
+    def draw_shapes(self, painter, store, exclude=-1):
+        """按顺序绘制除exclude外的所有标注"""
+        for i in range(len(store)):
+            if i != exclude:
+                draw_shape(painter, store, i)
+
+    def draw(self, painter, store, exclude=-1):
+        """先绘制马赛克和模糊，再绘制标注"""
+        self.draw_effects(painter, store)
+        self.draw_shapes(painter, store, exclude)
+
+    def render(self, store, scale=1.0, offset=None, size=None):
+        """把原始图像、效果和标注渲染到新的QImage上
+
+        原始图像缩放scale倍后左上角位于offset处，size为输出大小，默认刚好容纳缩放后的图像；
+        不缩放也不偏移时直接在原始图像的副本上绘制
+        """
+        source = self.source
+        if scale == 1 and offset is None and size is None:
+            image = QImage(source)
+            painter = QPainter(image)
+            painter.setRenderHint(QPainter.Antialiasing)
+        else:
+            offset = offset if offset is not None else QPoint(0, 0)
+            if size is None:
+                size = QSize(offset.x() + math.ceil(source.width() * scale),
+                             offset.y() + math.ceil(source.height() * scale))
+            image = QImage(size, QImage.Format_ARGB32_Premultiplied)
+            image.fill(Qt.transparent)
+            painter = QPainter(image)
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.translate(offset)
+            painter.scale(scale, scale)
+            painter.drawImage(0, 0, source)
+        self.draw(painter, store)
+        painter.end()
+        return image
+
+
+def render_annotations(image, store, scale=1.0):
+    """在image上渲染store中的标注，返回新的QImage，用于批量导出"""
+    return AnnotationRenderer(image).render(store, scale)
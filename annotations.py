@@ -0,0 +1,175 @@
+from array import array
+
+from PyQt5.QtCore import QPoint, QRect
+from PyQt5.QtGui import QColor, QFont, QFontMetrics, QPen
+
+# 标注类型，存储中保存的是下标
+KINDS = ("rectangle", "circle", "arrow", "text", "mosaic", "blur")
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+EFFECT_KINDS = ("mosaic", "blur")
+
+
+class Style:
+    """一组共享的绘制样式，相同的样式只创建一次Qt对象"""
+
+    __slots__ = ("color", "width", "font", "kernel", "pen", "metrics")
+
+    def __init__(self, color, width, font, kernel):
+        self.color = color
+        self.width = width
+        self.font = font
+        self.kernel = kernel
+        self.pen = QPen(color, width) if width else QPen(color)
+        self.metrics = QFontMetrics(font) if font is not None else None
+
+
+class StyleTable:
+    """样式驻留表：按 (颜色, 线宽, 字体, 模糊类型) 去重，标注只保存样式编号"""
+
+    def __init__(self):
+        self.styles = []
+        self._ids = {}
+        self.intern()  # 编号0是默认样式，马赛克等不需要样式的标注使用它
+
+    def intern(self, color=None, width=0, font=None, kernel=None):
+        color = QColor(color) if color is not None else QColor(255, 0, 0)
+        key = (color.rgba(), width, font.toString() if font is not None else None, kernel)
+        style_id = self._ids.get(key)
+        if style_id is None:
+            # 复制字体，之后修改编辑器当前字体不会影响已有标注
+            style_id = self._ids[key] = len(self.styles)
+            self.styles.append(Style(color, width, QFont(font) if font is not None else None, kernel))
+        return style_id
+
+    def __getitem__(self, style_id):
+        return self.styles[style_id]
+
+
+class AnnotationStore:
+    """紧凑的标注存储
+
+    坐标保存在连续的int数组中（每个标注4个：起点x、y，终点x、y），类型、样式编号和参数
+    （马赛克块大小或模糊半径）各是一个数组，文本单独保存；每个标注有一个不变的uid。
+    记录（record）是一个标注全部字段的元组，用于撤销历史和序列化
+    """
+
+    def __init__(self, styles=None):
+        self.styles = styles if styles is not None else StyleTable()
+        self.kinds = array("B")
+        self.coords = array("i")
+        self.style_ids = array("i")
+        self.params = array("i")
+        self.uids = array("q")
+        self.texts = []
+        self._next_uid = 0
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def append(self, kind, start, end, style=0, param=0, text=None):
+        """添加一个标注，start和end为QPoint，返回下标"""
+        self.insert(len(self.kinds),
+                    (KIND_CODES[kind], start.x(), start.y(), end.x(), end.y(), style, param, text, self._next_uid))
+        self._next_uid += 1
+        return len(self.kinds) - 1
+
+    def record(self, index):
+        c = 4 * index
+        return (self.kinds[index], self.coords[c], self.coords[c + 1], self.coords[c + 2], self.coords[c + 3],
+                self.style_ids[index], self.params[index], self.texts[index], self.uids[index])
+
+    def insert(self, index, record):
+        kind, x1, y1, x2, y2, style, param, text, uid = record
+        self.kinds.insert(index, kind)
+        self.coords[4 * index:4 * index] = array("i", (x1, y1, x2, y2))
+        self.style_ids.insert(index, style)
+        self.params.insert(index, param)
+        self.texts.insert(index, text)
+        self.uids.insert(index, uid)
+        self._next_uid = max(self._next_uid, uid + 1)
+
+    def pop(self, index=-1):
+        if index < 0:
+            index += len(self.kinds)
+        record = self.record(index)
+        del self.kinds[index]
+        del self.coords[4 * index:4 * index + 4]
+        del self.style_ids[index]
+        del self.params[index]
+        del self.texts[index]
+        del self.uids[index]
+        return record
+
+    def records(self):
+        return [self.record(i) for i in range(len(self.kinds))]
+
+    def restore(self, records):
+        """用记录列表替换全部标注"""
+        self.clear()
+        for record in records:
+            self.insert(len(self.kinds), record)
+
+    def clear(self):
+        del self.kinds[:]
+        del self.coords[:]
+        del self.style_ids[:]
+        del self.params[:]
+        del self.uids[:]
+        self.texts.clear()
+
+    def kind(self, index):
+        return KINDS[self.kinds[index]]
+
+    def is_effect(self, index):
+        return KINDS[self.kinds[index]] in EFFECT_KINDS
+
+    def style(self, index):
+        return self.styles[self.style_ids[index]]
+
+    def param(self, index):
+        return self.params[index]
+
+    def text(self, index):
+        return self.texts[index]
+
+    def uid(self, index):
+        return self.uids[index]
+
+    def points(self, index):
+        """返回 (x1, y1, x2, y2)"""
+        c = 4 * index
+        return tuple(self.coords[c:c + 4])
+
+    def start(self, index):
+        c = 4 * index
+        return QPoint(self.coords[c], self.coords[c + 1])
+
+    def end(self, index):
+        c = 4 * index
+        return QPoint(self.coords[c + 2], self.coords[c + 3])
+
+    def rect(self, index):
+        """起点和终点确定的规范化矩形，与QRect(start, end).normalized()相同"""
+        c = 4 * index
+        coords = self.coords
+        x1, y1, x2, y2 = coords[c], coords[c + 1], coords[c + 2], coords[c + 3]
+        # 与QRect.normalized()一致：宽或高为0（x2 == x1 - 1）时不交换
+        if x2 < x1 - 1:
+            x1, x2 = x2, x1
+        if y2 < y1 - 1:
+            y1, y2 = y2, y1
+        return QRect(x1, y1, x2 - x1 + 1, y2 - y1 + 1)
+
+    def set_points(self, index, x1, y1, x2, y2):
+        c = 4 * index
+        coords = self.coords
+        coords[c], coords[c + 1], coords[c + 2], coords[c + 3] = x1, y1, x2, y2
+
+    def translate(self, index, dx, dy):
+        """原地移动一个标注，不创建新对象"""
+        c = 4 * index
+        coords = self.coords
+        coords[c] += dx
+        coords[c + 1] += dy
+        coords[c + 2] += dx
+        coords[c + 3] += dy
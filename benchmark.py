@@ -0,0 +1,459 @@
+"""截图工具热点路径的基准测试
+
+在离屏Qt下运行，使用合成图像，不需要显示器；结果输出为JSON，可以保存为基线供以后比较
+
+用法:
+    python benchmark.py                                   # 运行全部基准测试
+    python benchmark.py --sizes 800x600,1920x1080         # 只测试指定尺寸
+    python benchmark.py --filter mosaic                   # 只运行名称包含mosaic的测试
+    python benchmark.py --output baseline.json            # 保存结果
+    python benchmark.py --baseline baseline.json          # 与基线比较，变慢超过阈值时返回1
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+
+from capture_service import CaptureService, SyntheticBackend
+from annotations import AnnotationStore
+from screenshot_editor import ScreenshotEditor
+from image_effects import MosaicPreview, BlurPreview, blur_array
+from annotation_renderer import render_annotations
+
+DEFAULT_SIZES = ((800, 600), (1920, 1080), (3840, 2160), (7680, 2160))
+SHAPE_COUNTS = (10, 100, 1000)  # 重绘测试的标注数量
+BLUR_RADII = (4, 64)  # 模糊测试的半径
+PREVIEW_STEPS = 60  # 拖动预览测试中一次拖动的鼠标移动次数
+HITTEST_SHAPES = 10000  # 点击检测测试的标注数量
+HITTEST_QUERIES = 1000  # 每次点击检测测试的鼠标位置数量
+HITTEST_SIZE = 200  # 点击检测测试中标注的最大边长
+MOUSE_RATE = 1000  # 高回报率鼠标拖动测试的鼠标事件频率（Hz）
+MOUSE_EVENTS = 200  # 高回报率鼠标拖动测试中一次拖动的移动事件数
+VIEW_SIZE = (1920, 1080)  # 编辑器测试的视口大小，图像更大时只绘制视口内的部分
+PAN_STEP = 40  # 平移测试每帧移动的像素
+
+
+def measure(fn, setup=None, min_time=1.0, max_runs=20):
+    """重复运行fn，累计超过min_time秒或达到max_runs次后停止，setup不计时
+
+    第一次运行作为预热不计入结果；如果第一次就超过min_time，则只运行这一次并计入结果
+    """
+    samples = []
+    total = 0.0
+    for run in range(max_runs + 1):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if run == 0 and elapsed < min_time:
+            continue
+        samples.append(elapsed * 1000)
+        total += elapsed
+        if total >= min_time:
+            break
+    return {
+        "runs": len(samples),
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.fmean(samples),
+        "max_ms": max(samples),
+    }
+
+
+def make_shapes(count, width, height, seed=0, max_size=None, shapes=None):
+    """生成count个矩形、圆形、箭头和文字标注，返回AnnotationStore
+
+    max_size限制每个标注的宽高，模拟分布在长截图各处的小标注
+    """
+    rng = np.random.default_rng(seed)
+    shapes = shapes if shapes is not None else AnnotationStore()
+    line_style = shapes.styles.intern(QColor(255, 0, 0), 2)
+    text_style = shapes.styles.intern(QColor(255, 0, 0), font=QFont("SimSun", 12))
+    kinds = ("rectangle", "circle", "arrow", "text")
+    for i in range(count):
+        if max_size is None:
+            x1, x2 = sorted(int(v) for v in rng.integers(0, width, 2))
+            y1, y2 = sorted(int(v) for v in rng.integers(0, height, 2))
+        else:
+            x1, y1 = int(rng.integers(0, width)), int(rng.integers(0, height))
+            x2 = min(x1 + int(rng.integers(1, max_size)), width - 1)
+            y2 = min(y1 + int(rng.integers(1, max_size)), height - 1)
+        kind = kinds[i % len(kinds)]
+        start, end = QPoint(x1, y1), QPoint(x2, y2)
+        if kind == "text":
+            shapes.append(kind, start, end, text_style, text=f"标注 {i}")
+        else:
+            shapes.append(kind, start, end, line_style)
+    return shapes
+
+
+def add_mosaic(shapes, left, top, width, height, size=10):
+    """添加一块马赛克，返回它的下标"""
+    return shapes.append("mosaic", QPoint(left, top), QPoint(left + width, top + height), param=size)
+
+
+def run_size(width, height, selected, min_time, max_runs):
+    """运行一个图像尺寸下的所有基准测试，返回 {名称: 统计}"""
+    results = {}
+    tag = f"{width}x{height}"
+
+    def bench(name, fn, setup=None):
+        full_name = f"{name}.{tag}"
+        if not selected(full_name):
+            return
+        results[full_name] = measure(fn, setup, min_time, max_runs)
+        stats = results[full_name]
+        print(f"{full_name:<40}{stats['median_ms']:>12.2f} ms  (x{stats['runs']})", flush=True)
+        return stats
+
+    # 截图路径：抓取、包装为独立的QImage、PNG编码
+    service = CaptureService(SyntheticBackend(((width, height),)))
+    frame = service.grab(0, 0, width, height)
+    image = frame.to_qimage().copy()
+    pixmap = QPixmap.fromImage(image)
+
+    out = np.empty((height, width, 4), dtype=np.uint8)
+    bench("capture.grab", lambda: service.grab_into(0, 0, width, height, out))
+    bench("capture.to_qimage", lambda: frame.to_qimage().copy())
+
+    def encode_png():
+        buffer = QBuffer()
+        buffer.open(QIODevice.WriteOnly)
+        image.save(buffer, "PNG")
+    bench("encode.png", encode_png)
+
+    # 打开编辑器：从载入截图到编辑器显示并完成第一次绘制，每次新建编辑器与复用预热的编辑器对比
+    app = QApplication.instance()
+    opened = []
+
+    def close_opened():
+        while opened:
+            opened.pop().deleteLater()
+        app.sendPostedEvents(None, QEvent.DeferredDelete)
+
+    def open_new():
+        opened.append(ScreenshotEditor(pixmap, QPoint(0, 0)))
+        app.processEvents()
+    bench("editor.open.new", open_new, close_opened)
+    close_opened()
+
+    warm_editor = ScreenshotEditor()
+
+    def open_reuse():
+        warm_editor.load(pixmap, QPoint(0, 0))
+        app.processEvents()
+    bench("editor.open.reuse", open_reuse, warm_editor.hide)
+    warm_editor.deleteLater()
+
+    # 编辑器路径：视口固定为VIEW_SIZE，原始大小显示，测量结果与运行机器的屏幕无关
+    editor = ScreenshotEditor(pixmap)
+    view = editor.canvas
+    view.set_view_size(QSize(min(width, VIEW_SIZE[0]), min(height, VIEW_SIZE[1])))
+    view.set_zoom(1.0)
+    editor.resize(max(view.width(), editor.minimumWidth()), view.height() + editor.toolbar_height + 10)
+    app.processEvents()
+
+    # 效果渲染：每次清空缓存，测量完整计算的耗时
+    def render_effects(shapes):
+        def setup():
+            editor.shapes = shapes
+            editor.invalidateComposite()
+            editor.renderer.effect_layer.cache.clear()
+        return setup
+    mosaic_shapes = AnnotationStore()
+    add_mosaic(mosaic_shapes, 0, 0, width, height)
+    bench("editor.mosaic", editor.effectPatches, render_effects(mosaic_shapes))
+
+    # 滑块最小值（半径1）的高斯模糊也必须改变像素，否则打码看似生效，内容却没有被遮住
+    noise = np.random.default_rng(0).integers(0, 256, (32, 32, 4), dtype=np.uint8)
+    blurred = noise.copy()
+    blur_array(blurred, 0, 0, 32, 32, 1, "gaussian")
+    assert (blurred[..., :3] != noise[..., :3]).any(), "半径为1的高斯模糊没有改变像素"
+
+    # 模糊的耗时应该与半径无关
+    for kernel in ("box", "gaussian"):
+        for radius in BLUR_RADII:
+            blur_shapes = AnnotationStore()
+            blur_shapes.append("blur", QPoint(0, 0), QPoint(width, height),
+                               blur_shapes.styles.intern(kernel=kernel), param=radius)
+            bench(f"editor.blur.{kernel}.r{radius}", editor.effectPatches, render_effects(blur_shapes))
+
+    # 调整马赛克大小：从右下角拖大一点，只有边缘的瓦片需要重新计算，与同样大小的马赛克完整计算对比
+    resize = 7
+
+    def resize_mosaic():
+        editor.shapes = AnnotationStore()
+        index = add_mosaic(editor.shapes, 0, 0, width // 2, height // 2)
+        editor.invalidateComposite()
+        cache = editor.renderer.effect_layer.cache
+        cache.clear()
+        editor.effectPatches()
+        cache.hits = cache.misses = 0
+        x1, y1, x2, y2 = editor.shapes.points(index)
+        editor.shapes.set_points(index, x1, y1, x2 + resize, y2 + resize)
+    stats = bench("editor.mosaic.resize", editor.effectPatches, resize_mosaic)
+    if stats is not None:
+        cache = editor.renderer.effect_layer.cache
+        assert cache.hits > 0, "调整马赛克大小后内部的瓦片应该命中缓存"
+        stats.update(hits=cache.hits, misses=cache.misses)
+        print(f"{'':<40}{cache.hits:>9} 块命中缓存, 重新计算 {cache.misses} 块", flush=True)
+
+    resized_shapes = AnnotationStore()
+    add_mosaic(resized_shapes, 0, 0, width // 2 + resize, height // 2 + resize)
+    bench("editor.mosaic.resize.cold", editor.effectPatches, render_effects(resized_shapes))
+
+    # 拖动预览：从左上角向右下角拖过整张图，每次移动的耗时，应低于16ms
+    canvas = QImage(image.size(), QImage.Format_RGB32)
+    for name, make_preview in (("mosaic", lambda: MosaicPreview(source, 10)),
+                               ("blur.gaussian", lambda: BlurPreview(source, 10, "gaussian"))):
+        source = image
+        drag = {"step": 0, "preview": None}
+
+        def next_move(make_preview=make_preview, drag=drag):
+            if drag["step"] % PREVIEW_STEPS == 0:
+                drag["preview"] = make_preview()
+            drag["step"] += 1
+
+        def paint_move(drag=drag):
+            fraction = ((drag["step"] - 1) % PREVIEW_STEPS + 1) / PREVIEW_STEPS
+            painter = QPainter(canvas)
+            drag["preview"].paint(painter, 0, 0, max(int(width * fraction), 1), max(int(height * fraction), 1))
+            painter.end()
+        bench(f"editor.preview.{name}", paint_move, next_move)
+
+    for count in SHAPE_COUNTS:
+        shapes = make_shapes(count, width, height)
+
+        def set_shapes(shapes=shapes):
+            editor.shapes = shapes
+            editor.invalidateComposite()
+        bench(f"editor.redraw.n{count}", view.repaint, set_shapes)
+
+        # 拖动中的一帧：已提交的形状来自缓存的图块，只绘制正在拖动的矩形
+        def start_drag(shapes=shapes):
+            if editor.shapes is not shapes:
+                set_shapes(shapes)
+            editor.current_tool = "rectangle"
+            editor.is_drawing = True
+            editor.start_point = QPoint(width // 4, height // 4)
+        def drag_frame():
+            editor.drawing(QPoint(width // 2, height // 2))
+            view.repaint()
+        bench(f"editor.drag.n{count}", drag_frame, start_drag)
+        editor.is_drawing = False
+        editor.current_tool = None
+
+    # 高回报率鼠标拖动一个矩形：移动事件按MOUSE_RATE到达，重绘按显示帧合并，记录一次拖动的总耗时和帧数
+    drag_shapes = make_shapes(100, width, height)
+
+    def mouse_event(kind, pos):
+        """图像坐标pos处的鼠标事件，事件坐标在画布中"""
+        buttons = Qt.NoButton if kind == QEvent.MouseButtonRelease else Qt.LeftButton
+        return QMouseEvent(kind, QPointF(view.map_from_image(pos)), Qt.LeftButton, buttons, Qt.NoModifier)
+
+    def start_fast_drag():
+        editor.shapes = drag_shapes
+        editor.invalidateComposite()
+        editor.current_tool = "rectangle"
+        editor.render_scheduler.reset_stats()
+        editor.eventFilter(view, mouse_event(QEvent.MouseButtonPress, QPoint(0, 0)))
+
+    def fast_drag():
+        next_event = time.perf_counter()
+        for step in range(1, MOUSE_EVENTS + 1):
+            while time.perf_counter() < next_event:
+                pass
+            next_event += 1.0 / MOUSE_RATE
+            pos = QPoint(width * step // (MOUSE_EVENTS + 1), height * step // (MOUSE_EVENTS + 1))
+            editor.eventFilter(view, mouse_event(QEvent.MouseMove, pos))
+            app.processEvents()
+        editor.render_scheduler.flush()
+        fast_drag.stats = editor.render_scheduler.stats()
+        editor.is_drawing = False
+
+    stats = bench(f"editor.drag.{MOUSE_RATE}hz", fast_drag, start_fast_drag)
+    if stats is not None:
+        # 最后一次运行的重绘统计
+        stats.update(fast_drag.stats)
+        print(f"{'':<40}{fast_drag.stats['frames']:>9} 帧, 合并 {fast_drag.stats['coalesced']} 次移动", flush=True)
+    editor.current_tool = None
+
+    # 平移和缩放：100个标注，平移时只绘制新露出的图块，缩放后重新绘制视口内的所有图块
+    def start_view():
+        editor.shapes = drag_shapes
+        editor.invalidateComposite()
+        view.set_zoom(1.0)
+        view.scroll_x = view.scroll_y = 0
+        view.repaint()
+
+    def pan():
+        view.scroll_by(PAN_STEP, PAN_STEP)
+        view.repaint()
+    bench("editor.pan", pan, start_view)
+
+    def zoom():
+        view.set_zoom(0.5 if view.zoom == 1 else 1.0)
+        view.repaint()
+    bench("editor.zoom", zoom, start_view)
+    start_view()
+
+    # 文本输入：光标闪烁和输入法按键只重绘文本所在的一行，包括窗口实际重绘的耗时
+    def start_text_input():
+        editor.shapes = drag_shapes
+        editor.invalidateComposite()
+        editor.current_tool = "text_input"
+        editor.startDrawing(QPoint(width // 4, height // 4))
+        editor.current_text = "标注文本"
+        app.processEvents()
+
+    def caret_blink():
+        editor.toggleTextCursor()
+        app.processEvents()
+    bench("editor.text.caret", caret_blink, start_text_input)
+
+    def ime_keystroke():
+        editor.inputMethodEvent(QInputMethodEvent("biao zhu", []))
+        app.processEvents()
+    bench("editor.text.ime", ime_keystroke, start_text_input)
+    if editor.text_cursor_timer is not None:
+        editor.text_cursor_timer.stop()
+    editor.is_text_input = False
+    editor.current_text = ""
+    editor.preedit_text = ""
+    editor.current_tool = None
+
+    # 点击检测：鼠标移动时检测控制点和形状，与标注数量基本无关
+    hit_shapes = make_shapes(HITTEST_SHAPES, width, height, max_size=HITTEST_SIZE)
+    rng = np.random.default_rng(1)
+    positions = [QPoint(int(x), int(y))
+                 for x, y in zip(rng.integers(0, width, HITTEST_QUERIES), rng.integers(0, height, HITTEST_QUERIES))]
+
+    def set_hit_shapes():
+        editor.shapes = hit_shapes
+        editor.shape_index.clear()
+    bench(f"editor.index_build.n{HITTEST_SHAPES}", editor.rebuildShapeIndex, set_hit_shapes)
+
+    def hit_test():
+        for pos in positions:
+            editor.getHandleAtPosition(pos)
+            editor.getShapeAtPosition(pos)
+
+    def use_hit_shapes():
+        if editor.shapes is not hit_shapes:
+            editor.shapes = hit_shapes
+            editor.rebuildShapeIndex()
+    bench(f"editor.hittest.n{HITTEST_SHAPES}.q{HITTEST_QUERIES}", hit_test, use_hit_shapes)
+
+    # 导出：100个标注加一块占四分之一面积的马赛克，与保存和复制到剪贴板的渲染相同
+    export_shapes = make_shapes(100, width, height)
+    add_mosaic(export_shapes, width // 4, height // 4, width // 2, height // 2)
+
+    def set_export_shapes():
+        editor.shapes = export_shapes
+        editor.invalidateComposite()
+    bench("editor.export", editor.renderEditedPixmap, set_export_shapes)
+
+    # 不创建编辑器的离屏渲染，与批量导出相同：每张图像使用新的渲染器，效果没有缓存
+    bench("render.headless", lambda: render_annotations(image, export_shapes))
+    bench("render.headless.x0.25", lambda: render_annotations(image, export_shapes, scale=0.25))
+
+    editor.shapes = AnnotationStore()
+    editor.close()
+    editor.deleteLater()
+    service.close()
+    return results
+
+
+def environment():
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "qt": QT_VERSION_STR,
+        "pyqt": PYQT_VERSION_STR,
+        "numpy": np.__version__,
+        "qpa": QGuiApplication.platformName(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """按中位数与基线比较，返回变慢超过阈值的测试名称列表"""
+    regressions = []
+    print(f"\n{'基准测试':<40}{'基线':>12}{'当前':>12}{'比例':>9}")
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<40}{'-':>12}{stats['median_ms']:>12.2f}{'新增':>9}")
+            continue
+        ratio = stats["median_ms"] / max(base["median_ms"], 1e-9)
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  变慢"
+            regressions.append(name)
+        elif ratio < 1 / (1 + threshold):
+            flag = "  变快"
+        print(f"{name:<40}{base['median_ms']:>12.2f}{stats['median_ms']:>12.2f}{ratio:>8.2f}x{flag}")
+    return regressions
+
+
+def parse_sizes(text):
+    return tuple(tuple(int(v) for v in part.lower().split("x")) for part in text.split(","))
+
+
+_app = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="截图工具基准测试")
+    parser.add_argument("--sizes", type=parse_sizes, default=DEFAULT_SIZES, help="图像尺寸，如 800x600,1920x1080")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的测试")
+    parser.add_argument("--min-time", type=float, default=1.0, help="每个测试至少运行的秒数")
+    parser.add_argument("--max-runs", type=int, default=20, help="每个测试最多运行的次数")
+    parser.add_argument("--output", help="把结果保存为JSON文件")
+    parser.add_argument("--baseline", help="与之比较的基线JSON文件")
+    parser.add_argument("--threshold", type=float, default=0.2, help="中位数变慢超过该比例视为退化")
+    args = parser.parse_args(argv)
+
+    # 保存在模块级变量中，避免QApplication被回收；run_size中用QApplication.instance()获取
+    global _app
+    _app = QApplication.instance() or QApplication(sys.argv)
+
+    def selected(name):
+        return args.filter in name
+
+    results = {}
+    for width, height in args.sizes:
+        results.update(run_size(width, height, selected, args.min_time, args.max_runs))
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存到 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} 个测试比基线慢 {args.threshold:.0%} 以上: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
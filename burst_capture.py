@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5.QtGui import QImage
+
+
+class FrameRingBuffer:
+    """固定容量的帧环形缓冲区，所有槽位预先分配，写满后覆盖最旧的帧
+
+    帧ID单调递增且全局唯一，与槽位无关；被覆盖时尚未写盘的帧计为丢弃
+    """
+
+    def __init__(self, capacity, width, height):
+        self.capacity = capacity
+        self.width = width
+        self.height = height
+        self._frames = np.zeros((capacity, height, width, 4), dtype=np.uint8)
+        self._ids = [-1] * capacity  # 每个槽位当前保存的帧ID，-1表示空或正在写入
+        self._timestamps = [0.0] * capacity
+        self._lock = threading.Lock()
+        self.next_id = 0  # 下一帧的ID
+        self.flushed_id = -1  # 已经交给写盘的最大帧ID
+        self.overwritten = 0  # 写盘前被覆盖的帧数
+
+    def begin_write(self):
+        """占用下一个槽位，返回 (帧ID, 槽位数组)，写入完成后调用end_write"""
+        with self._lock:
+            frame_id = self.next_id
+            self.next_id += 1
+            slot = frame_id % self.capacity
+            old_id = self._ids[slot]
+            if old_id > self.flushed_id:
+                # 旧帧还没来得及写盘就被覆盖
+                self.overwritten += 1
+                self.flushed_id = old_id
+            self._ids[slot] = -1
+        return frame_id, self._frames[slot]
+
+    def end_write(self, frame_id, timestamp):
+        """标记帧写入完成"""
+        with self._lock:
+            slot = frame_id % self.capacity
+            self._ids[slot] = frame_id
+            self._timestamps[slot] = timestamp
+
+    def cancel_write(self, frame_id):
+        """放弃begin_write占用的槽位（抓取失败），这一帧不会写盘"""
+        with self._lock:
+            if frame_id == self.next_id - 1:
+                # 归还帧ID，保证已写盘的帧ID连续
+                self.next_id -= 1
+            elif frame_id > self.flushed_id:
+                # 之后已经有新帧占用槽位，跳过这一帧
+                self.flushed_id = frame_id
+
+    def take_next(self):
+        """按顺序取出下一帧未写盘的帧，返回 (帧ID, 时间戳, 像素副本)，没有时返回None"""
+        with self._lock:
+            frame_id = self.flushed_id + 1
+            if frame_id >= self.next_id:
+                return None
+            slot = frame_id % self.capacity
+            if self._ids[slot] != frame_id:
+                # 该帧仍在写入中
+                return None
+            self.flushed_id = frame_id
+            # 在锁内复制，避免与抓取线程覆盖同一槽位冲突
+            pixels = self._frames[slot].copy()
+            return frame_id, self._timestamps[slot], pixels
+
+    def unflushed(self):
+        """返回尚未写盘的帧数"""
+        with self._lock:
+            return self.next_id - 1 - self.flushed_id
+
+
+class BurstCapture(QObject):
+    """按目标帧率连续抓取选定区域，帧写入环形缓冲区并异步写盘
+
+    抓取在独立线程上按单调时钟定时，错过的帧计为丢弃；写盘由GUI线程的定时器
+    从环形缓冲区取帧交给保存队列，保存队列满时先留在环形缓冲区里
+    """
+
+    finished = pyqtSignal(dict)  # 全部帧写盘后发出统计信息
+
+    def __init__(self, capture_service, save_queue, left, top, width, height,
+                 fps=10, capacity=64, max_bytes=512 * 1024 * 1024, directory="output", parent=None):
+        super().__init__(parent)
+        self.capture_service = capture_service
+        self.save_queue = save_queue
+        self.region = (left, top, width, height)
+        self.fps = fps
+        self.directory = directory
+        # 大区域时按内存上限减少槽位数，至少保留两个槽位
+        capacity = max(2, min(capacity, max_bytes // (width * height * 4)))
+        self.ring = FrameRingBuffer(capacity, width, height)
+
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._flush_timer = QTimer(self)
+        self._flush_timer.timeout.connect(self.flush)
+
+        # 帧率统计
+        self.captured = 0
+        self.missed_deadlines = 0
+        self.flushed = 0
+        self.grab_ms_total = 0.0
+        self.start_time = 0.0
+        self.stop_time = 0.0
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """开始连拍"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.start_time = time.perf_counter()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="burst-capture", daemon=True)
+        self._thread.start()
+        self._flush_timer.start(50)
+
+    def stop(self):
+        """停止抓取，剩余的帧继续异步写盘，写完后发出finished信号"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stop_time = time.perf_counter()
+
+    def _run(self):
+        """抓取线程：按固定间隔抓取，落后超过一帧时跳过错过的帧"""
+        left, top, width, height = self.region
+        interval = 1.0 / self.fps
+        deadline = time.perf_counter()
+        while not self._stop_event.is_set():
+            now = time.perf_counter()
+            if now < deadline:
+                self._stop_event.wait(deadline - now)
+                continue
+            if now - deadline >= interval:
+                # 抓取太慢，跳过已经错过的帧
+                missed = int((now - deadline) / interval)
+                self.missed_deadlines += missed
+                deadline += missed * interval
+
+            frame_id, slot = self.ring.begin_write()
+            grab_start = time.perf_counter()
+            try:
+                self.capture_service.grab_into(left, top, width, height, slot)
+            except Exception as e:
+                # 释放占用的槽位，否则写盘会一直等待这一帧，finished信号不会发出
+                self.ring.cancel_write(frame_id)
+                print(f"连拍抓取失败: {e}")
+                self._stop_event.set()
+                break
+            grabbed = time.perf_counter()
+            self.ring.end_write(frame_id, grabbed)
+            self.grab_ms_total += (grabbed - grab_start) * 1000
+            self.captured += 1
+            deadline += interval
+
+    def flush(self):
+        """把环形缓冲区中未写盘的帧交给保存队列，队列满时留到下一次"""
+        while self.save_queue.pending() < self.save_queue.max_pending:
+            item = self.ring.take_next()
+            if item is None:
+                break
+            frame_id, timestamp, pixels = item
+            height, width = pixels.shape[:2]
+            # QImage.copy()让图像独立持有像素，与numpy数组的生命周期无关
+            image = QImage(pixels.data, width, height, width * 4, QImage.Format_RGB32).copy()
+            filename = os.path.join(self.directory, f"frame_{frame_id:06d}.png")
+            self.save_queue.submit(image, filename)
+            self.flushed += 1
+
+        if not self.is_running() and self.ring.unflushed() <= 0 and self._flush_timer.isActive():
+            self._flush_timer.stop()
+            self.finished.emit(self.stats())
+
+    def stats(self):
+        """返回帧率统计：实际帧率、丢弃帧数（错过的定时和写盘前被覆盖的帧）等"""
+        end = self.stop_time if self.stop_time else time.perf_counter()
+        elapsed = max(end - self.start_time, 1e-6)
+        return {
+            "target_fps": self.fps,
+            "achieved_fps": self.captured / elapsed,
+            "captured": self.captured,
+            "flushed": self.flushed,
+            "missed_deadlines": self.missed_deadlines,
+            "overwritten": self.ring.overwritten,
+            "dropped": self.missed_deadlines + self.ring.overwritten,
+            "avg_grab_ms": self.grab_ms_total / self.captured if self.captured else 0.0,
+            "elapsed_s": elapsed,
+        }
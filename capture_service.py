@@ -0,0 +1,394 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import mss
+import numpy as np
+from PyQt5.QtGui import QImage
+from capture_trace import default_tracer
+
+
+class CaptureFrame:
+    """一帧截图数据，像素按BGRA逐行存储，行间距为stride字节"""
+    __slots__ = ("data", "left", "top", "width", "height", "stride")
+
+    def __init__(self, data, left, top, width, height, stride=None):
+        self.data = data
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.stride = stride if stride is not None else width * 4
+
+    def to_qimage(self):
+        """将BGRA缓冲区直接包装为QImage，不复制像素
+
+        QImage与帧共享缓冲区，需要在帧失效后继续使用时应调用copy()
+        """
+        # BGRA在小端机器上与Format_RGB32(0xAARRGGBB)内存布局一致
+        # QImage会持有对缓冲区的引用
+        return QImage(self.data, self.width, self.height, self.stride, QImage.Format_RGB32)
+
+    def crop(self, left, top, width, height):
+        """按全局坐标裁剪，返回与本帧共享缓冲区的子帧，不复制像素
+
+        区域会被限制在帧范围内，完全不相交时返回None
+        """
+        x0 = max(left, self.left)
+        y0 = max(top, self.top)
+        x1 = min(left + width, self.left + self.width)
+        y1 = min(top + height, self.top + self.height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        start = (y0 - self.top) * self.stride + (x0 - self.left) * 4
+        end = start + (y1 - y0 - 1) * self.stride + (x1 - x0) * 4
+        return CaptureFrame(memoryview(self.data)[start:end], x0, y0, x1 - x0, y1 - y0, self.stride)
+
+
+class CaptureBackend:
+    """截图后端接口，grab返回BGRA逐行连续排列的一维字节缓冲区"""
+    name = ""
+
+    def monitors(self):
+        """返回各个显示器的 {"left", "top", "width", "height"} 列表"""
+        raise NotImplementedError
+
+    def grab(self, left, top, width, height):
+        """抓取全局坐标下的区域，返回长度为 width*height*4 的bytearray或memoryview"""
+        raise NotImplementedError
+
+    def grab_into(self, left, top, width, height, out):
+        """抓取区域并写入形状为 (height, width, 4) 的uint8数组视图
+
+        会被多个工作线程同时调用，各线程写入的区域互不重叠
+        """
+        raw = self.grab(left, top, width, height)
+        out[...] = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4)
+
+    def reset(self):
+        """屏幕拓扑变化后重新初始化"""
+        pass
+
+    def close(self):
+        """释放后端持有的资源"""
+        pass
+
+
+class MssBackend(CaptureBackend):
+    """基于mss的真实屏幕截图后端，句柄在两次reset之间保持打开
+
+    mss对象内部带锁，同一个对象上的抓取会被串行化，因此每个线程各自持有一个mss对象
+    """
+    name = "mss"
+
+    def __init__(self):
+        self._local = threading.local()
+        self._instances = []  # 所有线程创建的mss对象，用于统一关闭
+        self._instances_lock = threading.Lock()
+        self._generation = 0  # reset后递增，使各线程重新打开mss对象
+
+    def _sct(self):
+        """返回当前线程的mss对象，首次使用或reset之后重新创建"""
+        if getattr(self._local, "generation", -1) != self._generation:
+            self._local.sct = mss.mss()
+            self._local.generation = self._generation
+            with self._instances_lock:
+                self._instances.append(self._local.sct)
+        return self._local.sct
+
+    def monitors(self):
+        # monitors[0]是整个虚拟桌面，之后才是各个显示器
+        return [dict(m) for m in self._sct().monitors[1:]]
+
+    def grab(self, left, top, width, height):
+        screenshot = self._sct().grab({"left": left, "top": top, "width": width, "height": height})
+        return screenshot.raw
+
+    def reset(self):
+        # mss只在创建时枚举一次显示器，拓扑变化后需要重新打开
+        self.close()
+
+    def close(self):
+        with self._instances_lock:
+            instances, self._instances = self._instances, []
+            self._generation += 1
+        for sct in instances:
+            sct.close()
+
+
+class SyntheticBackend(CaptureBackend):
+    """生成确定性桌面画面的内存后端，用于无显示器环境下的基准测试"""
+    name = "synthetic"
+
+    def __init__(self, layout=((1920, 1080),), seed=0):
+        # layout中的每一项为 (宽, 高) 或 (左, 上, 宽, 高)，只给出尺寸时从左到右依次排列
+        self._monitors = []
+        x = 0
+        for item in layout:
+            if len(item) == 2:
+                width, height = item
+                self._monitors.append({"left": x, "top": 0, "width": width, "height": height})
+            else:
+                left, top, width, height = item
+                self._monitors.append({"left": left, "top": top, "width": width, "height": height})
+            x = self._monitors[-1]["left"] + self._monitors[-1]["width"]
+        self.seed = seed
+        self._desktop = self._render_desktop()
+
+    @classmethod
+    def from_spec(cls, spec, seed=0):
+        """从 "1920x1080,2560x1440" 形式的字符串创建"""
+        layout = []
+        for part in spec.split(","):
+            width, height = part.lower().split("x")
+            layout.append((int(width), int(height)))
+        return cls(layout, seed)
+
+    def _render_desktop(self):
+        """生成整个虚拟桌面：渐变壁纸，每个显示器上若干带标题栏和文字行的窗口"""
+        self.origin_x = min(m["left"] for m in self._monitors)
+        self.origin_y = min(m["top"] for m in self._monitors)
+        total_width = max(m["left"] + m["width"] for m in self._monitors) - self.origin_x
+        total_height = max(m["top"] + m["height"] for m in self._monitors) - self.origin_y
+        desktop = np.zeros((total_height, total_width, 4), dtype=np.uint8)
+        rng = np.random.default_rng(self.seed)
+
+        for monitor in self._monitors:
+            x0 = monitor["left"] - self.origin_x
+            y0 = monitor["top"] - self.origin_y
+            width, height = monitor["width"], monitor["height"]
+            screen = desktop[y0:y0 + height, x0:x0 + width]
+
+            # 渐变壁纸
+            screen[:, :, 0] = np.linspace(90, 200, width, dtype=np.uint8)[None, :]
+            screen[:, :, 1] = np.linspace(40, 140, height, dtype=np.uint8)[:, None]
+            screen[:, :, 2] = 30
+            screen[:, :, 3] = 255
+
+            # 若干窗口
+            for _ in range(int(rng.integers(3, 7))):
+                w = int(rng.integers(width // 5, width // 2))
+                h = int(rng.integers(height // 5, height // 2))
+                x = int(rng.integers(0, width - w))
+                y = int(rng.integers(0, height - h))
+                screen[y:y + h, x:x + w, :3] = 240
+                screen[y:y + 30, x:x + w, :3] = (215, 120, 0)
+                # 模拟文字行：长度随机的深色短横
+                for line_y in range(y + 45, y + h - 12, 18):
+                    line_len = int(rng.integers(w // 4, w - 20))
+                    screen[line_y:line_y + 8, x + 10:x + 10 + line_len:2, :3] = 40
+        return desktop
+
+    def monitors(self):
+        return [dict(m) for m in self._monitors]
+
+    def grab(self, left, top, width, height):
+        frame = np.empty((height, width, 4), dtype=np.uint8)
+        self.grab_into(left, top, width, height, frame)
+        return memoryview(frame).cast("B")
+
+    def grab_into(self, left, top, width, height, out):
+        # 与虚拟桌面求交，桌面之外的部分保持黑色
+        x0 = left - self.origin_x
+        y0 = top - self.origin_y
+        src_x0, src_y0 = max(x0, 0), max(y0, 0)
+        src_x1 = min(x0 + width, self._desktop.shape[1])
+        src_y1 = min(y0 + height, self._desktop.shape[0])
+        if src_x1 - src_x0 < width or src_y1 - src_y0 < height:
+            out[...] = 0
+        if src_x1 > src_x0 and src_y1 > src_y0:
+            out[src_y0 - y0:src_y1 - y0, src_x0 - x0:src_x1 - x0] = self._desktop[src_y0:src_y1, src_x0:src_x1]
+
+
+def create_backend(spec=None):
+    """根据描述创建截图后端："mss"，或 "synthetic[:1920x1080,2560x1440]"
+
+    未指定时读取环境变量SCREENSHOT_CAPTURE_BACKEND，默认为mss
+    """
+    if spec is None:
+        spec = os.environ.get("SCREENSHOT_CAPTURE_BACKEND", "mss")
+    name, _, layout = spec.partition(":")
+    if name == "mss":
+        return MssBackend()
+    if name == "synthetic":
+        return SyntheticBackend.from_spec(layout) if layout else SyntheticBackend()
+    raise ValueError(f"未知的截图后端: {spec}")
+
+
+class CaptureService:
+    """长期持有的截图服务，复用后端句柄
+
+    单个显示器内的区域直接返回后端的缓冲区，不再复制；跨越多个显示器的区域按显示器拆分，
+    在工作线程上并发抓取后拼接到同一块预分配缓冲区。抓取与rebuild、close互斥，
+    连拍和录屏线程抓取时屏幕拓扑变化也不会用到已经关闭的句柄
+    """
+
+    def __init__(self, backend=None, timing_history=100, tracer=None):
+        self.backend = backend if backend is not None else create_backend()
+        self.tracer = tracer if tracer is not None else default_tracer()  # 开启追踪时才打印每次抓取的耗时
+        self.monitors = []  # 每个显示器的 {"left", "top", "width", "height"}
+        self.desktop_rect = (0, 0, 0, 0)  # 虚拟桌面的 (左, 上, 宽, 高)
+        self._desktop_buffer = None  # 冻结画面使用的整个虚拟桌面缓冲区，第一次使用时分配
+        self._composite_buffer = None  # 跨屏区域拼接使用的缓冲区，第一次使用时分配
+        self._executor = None  # 每个显示器一个抓取线程
+        self.timings = deque(maxlen=timing_history)  # 最近若干次抓取的耗时记录
+        self._lock = threading.RLock()  # 抓取期间不能重新初始化或关闭后端
+        self._setup()
+
+    def _setup(self):
+        """按当前屏幕布局分配缓冲区和抓取线程"""
+        self.monitors = self.backend.monitors()
+        left = min(m["left"] for m in self.monitors)
+        top = min(m["top"] for m in self.monitors)
+        right = max(m["left"] + m["width"] for m in self.monitors)
+        bottom = max(m["top"] + m["height"] for m in self.monitors)
+        self.desktop_rect = (left, top, right - left, bottom - top)
+        self._desktop_buffer = None
+        self._composite_buffer = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.monitors)),
+                                            thread_name_prefix="capture")
+
+    def rebuild(self):
+        """重新初始化后端并按当前屏幕布局分配缓冲区，仅在屏幕拓扑变化时调用"""
+        start = time.perf_counter()
+        # 等待其他线程正在进行的抓取结束
+        with self._lock:
+            self.backend.reset()
+            self._setup()
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"截图服务已初始化: {self.backend.name} 后端, {len(self.monitors)} 个显示器, 耗时 {elapsed:.1f}ms")
+
+    def close(self):
+        """停止抓取线程并释放后端资源"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            self.backend.close()
+
+    def _within_monitor(self, left, top, width, height):
+        """区域是否完全位于某一个显示器内"""
+        for monitor in self.monitors:
+            if (left >= monitor["left"] and top >= monitor["top"] and
+                    left + width <= monitor["left"] + monitor["width"] and
+                    top + height <= monitor["top"] + monitor["height"]):
+                return True
+        return False
+
+    def grab(self, left, top, width, height):
+        """抓取指定的全局区域，返回CaptureFrame
+
+        单个显示器内的区域直接使用后端返回的缓冲区；跨屏区域复用拼接缓冲区，
+        只在下一次抓取前有效，需要长期保留时应先复制
+        """
+        with self._lock:
+            return self._grab(left, top, width, height)
+
+    def _grab(self, left, top, width, height):
+        if not self._within_monitor(left, top, width, height):
+            # 区域跨越多个显示器，并发抓取各部分后拼接
+            if self._composite_buffer is None:
+                self._composite_buffer = bytearray(self.desktop_rect[2] * self.desktop_rect[3] * 4)
+            if width * height * 4 > len(self._composite_buffer):
+                # 区域超出虚拟桌面，只能临时分配
+                data = bytearray(width * height * 4)
+            else:
+                data = memoryview(self._composite_buffer)[:width * height * 4]
+            self._grab_parts(left, top, width, height, data)
+            return CaptureFrame(data, left, top, width, height)
+
+        start = time.perf_counter()
+        raw = self.backend.grab(left, top, width, height)
+        grabbed = time.perf_counter()
+
+        self._record_timing((width, height), start, grabbed, grabbed)
+        return CaptureFrame(raw, left, top, width, height)
+
+    def grab_desktop(self):
+        """并发抓取所有显示器，拼接成整个虚拟桌面
+
+        桌面缓冲区与普通抓取的缓冲区相互独立，返回的帧在下一次grab_desktop前有效，
+        可以用crop()从中零复制地裁剪选区
+        """
+        with self._lock:
+            left, top, width, height = self.desktop_rect
+            if self._desktop_buffer is None:
+                self._desktop_buffer = bytearray(width * height * 4)
+            self._grab_parts(left, top, width, height, self._desktop_buffer)
+            return CaptureFrame(self._desktop_buffer, left, top, width, height)
+
+    def grab_into(self, left, top, width, height, out, log=False):
+        """把全局区域直接抓取到调用方提供的 (height, width, 4) uint8数组中
+
+        不经过服务内部的缓冲区，可以在GUI线程之外调用（如连拍线程写入环形缓冲区的槽位）
+        """
+        with self._lock:
+            self._grab_parts(left, top, width, height, out, log)
+
+    def _grab_parts(self, left, top, width, height, data, log=True):
+        """把区域按显示器拆分，每个显示器的部分在各自线程上直接抓取到data中的对应位置"""
+        if isinstance(data, np.ndarray):
+            out = data
+        else:
+            out = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 4)
+        parts = []
+        covered = 0
+        for monitor in self.monitors:
+            x0 = max(left, monitor["left"])
+            y0 = max(top, monitor["top"])
+            x1 = min(left + width, monitor["left"] + monitor["width"])
+            y1 = min(top + height, monitor["top"] + monitor["height"])
+            if x1 > x0 and y1 > y0:
+                parts.append((x0, y0, x1 - x0, y1 - y0))
+                covered += (x1 - x0) * (y1 - y0)
+        if covered < width * height:
+            # 显示器之间的空隙填充为黑色
+            out[...] = 0
+
+        def grab_part(part):
+            x, y, w, h = part
+            part_start = time.perf_counter()
+            self.backend.grab_into(x, y, w, h, out[y - top:y - top + h, x - left:x - left + w])
+            return (time.perf_counter() - part_start) * 1000
+
+        start = time.perf_counter()
+        if len(parts) == 1:
+            part_ms = [grab_part(parts[0])]
+        else:
+            part_ms = list(self._executor.map(grab_part, parts))
+        done = time.perf_counter()
+
+        # 并发抓取时总耗时应接近最慢的单个显示器
+        slowest = max(part_ms) if part_ms else 0.0
+        self._record_timing((width, height), start, start + slowest / 1000, done, len(parts), log)
+
+    def _record_timing(self, size, start, grabbed, done, parts=1, log=True):
+        """记录一次抓取的耗时，多显示器抓取时grab_ms为最慢的单个显示器耗时
+
+        耗时总是保存在timings中，可以用timing_summary查看；只有开启延迟追踪时才打印
+        """
+        timing = {
+            "size": size,
+            "parts": parts,
+            "grab_ms": (grabbed - start) * 1000,
+            "copy_ms": (done - grabbed) * 1000,
+            "total_ms": (done - start) * 1000,
+        }
+        self.timings.append(timing)
+        if log and self.tracer.enabled:
+            print(f"抓取耗时: {timing['total_ms']:.1f}ms (抓屏 {timing['grab_ms']:.1f}ms, "
+                  f"复制 {timing['copy_ms']:.1f}ms, {parts} 个显示器)")
+
+    def timing_summary(self):
+        """返回最近抓取耗时的平均值和最大值"""
+        if not self.timings:
+            return {"count": 0, "avg_ms": 0.0, "max_ms": 0.0}
+        totals = [t["total_ms"] for t in self.timings]
+        return {
+            "count": len(totals),
+            "avg_ms": sum(totals) / len(totals),
+            "max_ms": max(totals),
+        }
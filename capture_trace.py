@@ -0,0 +1,140 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# 截图流程的阶段，按发生顺序排列
+STAGES = (
+    "hotkey",              # 热键按下
+    "overlay_shown",       # 遮罩第一次绘制
+    "selection_released",  # 松开鼠标完成选区
+    "overlays_hidden",     # 实时抓取前遮罩已隐藏（冻结模式没有这一步）
+    "grab_done",           # 抓取或裁剪完成
+    "clipboard_set",       # 图片已放入剪贴板
+    "editor_shown",        # 编辑模式下编辑器已显示
+    "encode_done",         # 后台编码完成
+    "write_done",          # 后台写盘完成
+)
+
+
+class _NullTrace:
+    """关闭追踪时使用的空对象，调用的开销只有一次空方法调用"""
+
+    __slots__ = ()
+
+    def mark(self, stage):
+        pass
+
+    def finish(self):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class CaptureTrace:
+    """一次截图的各阶段时间戳，使用单调时钟，起点是热键按下
+
+    每个阶段记录与上一个阶段的间隔，同一阶段只记录第一次；finish时记录总耗时
+    """
+
+    __slots__ = ("tracer", "name", "start", "last", "marks", "finished")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.start = self.last = time.perf_counter_ns()
+        self.marks = {"hotkey": 0}
+        self.finished = False
+
+    def mark(self, stage):
+        if self.finished or stage in self.marks:
+            return
+        now = time.perf_counter_ns()
+        self.marks[stage] = now - self.start
+        self.tracer.record(self.name, stage, (now - self.last) / 1e6)
+        self.last = now
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.tracer.record(self.name, "total", (self.last - self.start) / 1e6)
+
+
+def percentile(sorted_values, q):
+    """最近秩法计算百分位数，sorted_values必须已排序且非空"""
+    index = max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+class CaptureTracer:
+    """按阶段保存最近的耗时样本，可以随时输出p50/p95/p99
+
+    关闭时begin返回NULL_TRACE，调用方不需要判断是否开启
+    """
+
+    def __init__(self, enabled=False, history=500):
+        self.enabled = enabled
+        self.history = history
+        self._samples = {}  # (流程名, 阶段) -> deque[毫秒]
+        self._lock = threading.Lock()
+
+    def begin(self, name="screenshot"):
+        """热键按下时调用，开始一次追踪"""
+        if not self.enabled:
+            return NULL_TRACE
+        return CaptureTrace(self, name)
+
+    def record(self, name, stage, ms):
+        with self._lock:
+            samples = self._samples.get((name, stage))
+            if samples is None:
+                samples = self._samples[(name, stage)] = deque(maxlen=self.history)
+            samples.append(ms)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        """返回 {流程名: {阶段: {count, p50, p95, p99, max}}}，阶段按流程顺序排列，总耗时在最后"""
+        with self._lock:
+            snapshot = {key: sorted(values) for key, values in self._samples.items() if values}
+        order = {stage: i for i, stage in enumerate(STAGES + ("total",))}
+        result = {}
+        for (name, stage), values in sorted(snapshot.items(), key=lambda item: (item[0][0], order.get(item[0][1], len(order)))):
+            result.setdefault(name, {})[stage] = {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": values[-1],
+            }
+        return result
+
+    def dump(self):
+        """打印各阶段耗时，每个阶段的耗时是距上一个阶段的间隔"""
+        summary = self.summary()
+        if not summary:
+            print("没有延迟数据" + ("" if self.enabled else "（延迟追踪未开启）"))
+            return
+        for name, stages in summary.items():
+            print(f"===== {name} 各阶段耗时 (ms) =====")
+            print(f"{'阶段':<20}{'次数':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+            for stage, stats in stages.items():
+                print(f"{stage:<20}{stats['count']:>6}{stats['p50']:>10.2f}{stats['p95']:>10.2f}"
+                      f"{stats['p99']:>10.2f}{stats['max']:>10.2f}")
+
+
+_default_tracer = None
+
+
+def default_tracer():
+    """返回进程内共享的追踪器，环境变量 SCREENSHOT_TRACE=1 时默认开启"""
+    global _default_tracer
+    if _default_tracer is None:
+        enabled = os.environ.get("SCREENSHOT_TRACE", "").lower() in ("1", "true", "yes", "on")
+        _default_tracer = CaptureTracer(enabled)
+    return _default_tracer
@@ -0,0 +1,115 @@
+from collections import deque
+
+RECORD_BYTES = 64  # 估算一条标注记录占用的内存（坐标和编号在数组中），文本另外按字符计算
+
+
+def record_bytes(record):
+    """粗略估算一条标注记录占用的内存"""
+    text = record[7]
+    return RECORD_BYTES + (4 * len(text) if text else 0)
+
+
+class AddShape:
+    """添加一个形状（绘制、马赛克、模糊、文本），保存它的记录"""
+
+    def __init__(self, index, record):
+        self.index = index
+        self.record = record
+
+    def undo(self, shapes):
+        shapes.pop(self.index)
+
+    def redo(self, shapes):
+        shapes.insert(self.index, self.record)
+
+    def size(self):
+        return record_bytes(self.record)
+
+
+class ChangeShape:
+    """修改一个形状的位置（移动、调整大小），保存前后的 (x1, y1, x2, y2)"""
+
+    def __init__(self, index, before, after):
+        self.index = index
+        self.before = before
+        self.after = after
+
+    def undo(self, shapes):
+        shapes.set_points(self.index, *self.before)
+
+    def redo(self, shapes):
+        shapes.set_points(self.index, *self.after)
+
+    def size(self):
+        return 64
+
+
+class ClearShapes:
+    """清除所有形状，保存被清除的记录"""
+
+    def __init__(self, records):
+        self.records = list(records)
+
+    def undo(self, shapes):
+        shapes.restore(self.records)
+
+    def redo(self, shapes):
+        shapes.clear()
+
+    def size(self):
+        return sum(record_bytes(record) for record in self.records)
+
+
+class EditHistory:
+    """基于命令的撤销/重做历史
+
+    每条命令只保存它改变的内容，撤销和重做的耗时只与这条命令有关，与历史长度无关；
+    命令估算的总内存超过max_bytes或条数超过max_commands时丢弃最早的命令
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, max_commands=1000):
+        self.max_bytes = max_bytes
+        self.max_commands = max_commands
+        self.bytes = 0
+        self._undo = deque()
+        self._redo = []
+
+    def push(self, command):
+        """记录一条已经执行的命令，清空重做栈"""
+        for old in self._redo:
+            self.bytes -= old.size()
+        self._redo.clear()
+        self._undo.append(command)
+        self.bytes += command.size()
+        # 至少保留最近的一条命令
+        while len(self._undo) > 1 and (self.bytes > self.max_bytes or len(self._undo) > self.max_commands):
+            self.bytes -= self._undo.popleft().size()
+
+    def undo(self, shapes):
+        """撤销最近的命令并返回它，没有可撤销的命令时返回None"""
+        if not self._undo:
+            return None
+        command = self._undo.pop()
+        command.undo(shapes)
+        self._redo.append(command)
+        return command
+
+    def redo(self, shapes):
+        """重做最近撤销的命令并返回它，没有可重做的命令时返回None"""
+        if not self._redo:
+            return None
+        command = self._redo.pop()
+        command.redo(shapes)
+        self._undo.append(command)
+        return command
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self.bytes = 0
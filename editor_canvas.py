@@ -0,0 +1,272 @@
+import math
+from collections import OrderedDict
+
+from PyQt5.QtCore import QPoint, QRect, QRectF, QSize, Qt
+from PyQt5.QtGui import QColor, QImage, QPainter, QRegion, QTransform
+from PyQt5.QtWidgets import QWidget
+
+
+class EditorCanvas(QWidget):
+    """可缩放、平移的图像画布，只绘制视口中可见的部分
+
+    缩放后的图像按TILE像素切成图块，图块的内容由draw_tile在图像坐标系中绘制并缓存，
+    缩放比例不变时平移只需要绘制新露出的图块；draw_under和draw_over每次重绘时在图块的
+    下方和上方绘制变化中的内容。回调的参数为 (painter, rect)，painter的坐标系是图像坐标，
+    rect是需要绘制的图像范围。鼠标位置用map_to_image转换为图像坐标
+
+    Ctrl+滚轮以鼠标位置为中心缩放，滚轮上下平移（Shift+滚轮左右平移），按住中键拖动平移
+    """
+
+    TILE = 256  # 图块边长（缩放后的像素）
+    MAX_TILES = 384  # 缓存的图块数，超过时丢弃最久未用的
+    MIN_ZOOM = 1 / 32
+    MAX_ZOOM = 16
+    ZOOM_STEP = 1.25  # 滚轮每格的缩放倍数
+    SCROLL_STEP = 80  # 滚轮每格平移的像素
+    BORDER_COLOR = QColor(0, 120, 215)
+    BACKGROUND_COLOR = QColor(43, 43, 43)  # 缩小后视口中图像以外的部分
+
+    def __init__(self, draw_tile, draw_under=None, draw_over=None, border=0, parent=None):
+        super().__init__(parent)
+        self._draw_tile = draw_tile
+        self._draw_under = draw_under
+        self._draw_over = draw_over
+        self.border = border
+        self.image_size = QSize()
+        self.zoom = 1.0
+        self.scroll_x = 0  # 视口左上角在缩放后图像中的位置
+        self.scroll_y = 0
+        self._tiles = OrderedDict()  # (列, 行) -> QImage，只保存当前缩放比例的图块
+        self._pan_pos = None  # 中键拖动时上一次的鼠标位置
+        self.tile_renders = 0  # 绘制过的图块数
+
+    def set_image_size(self, size, zoom=1.0):
+        """载入新图像时调用，缩放比例设为zoom，从图像左上角开始显示"""
+        self.image_size = QSize(size)
+        self.zoom = min(max(zoom, self.MIN_ZOOM), self.MAX_ZOOM)
+        self.scroll_x = self.scroll_y = 0
+        self.invalidate()
+
+    def set_view_size(self, size):
+        """设置视口（不含边框）的大小"""
+        border = 2 * self.border
+        self.setFixedSize(size.width() + border, size.height() + border)
+        self._clamp_scroll()
+        self.update()
+
+    def invalidate(self):
+        """图块的内容改变后调用，下次绘制时重新生成可见的图块"""
+        self._tiles.clear()
+        self.update()
+
+    def view_rect(self):
+        """视口在画布中的范围（去掉边框）"""
+        return self.rect().adjusted(self.border, self.border, -self.border, -self.border)
+
+    def scaled_size(self):
+        return QSize(math.ceil(self.image_size.width() * self.zoom),
+                     math.ceil(self.image_size.height() * self.zoom))
+
+    def origin(self):
+        """图像左上角在画布中的位置；缩放后比视口小的方向居中显示"""
+        view = self.view_rect()
+        scaled = self.scaled_size()
+        if scaled.width() > view.width():
+            x = view.left() - self.scroll_x
+        else:
+            x = view.left() + (view.width() - scaled.width()) // 2
+        if scaled.height() > view.height():
+            y = view.top() - self.scroll_y
+        else:
+            y = view.top() + (view.height() - scaled.height()) // 2
+        return x, y
+
+    def image_transform(self):
+        """从图像坐标到画布坐标的变换"""
+        x, y = self.origin()
+        return QTransform(self.zoom, 0, 0, self.zoom, x, y)
+
+    def map_to_image(self, pos):
+        """把画布中的位置转换为图像坐标"""
+        x, y = self.origin()
+        return QPoint(math.floor((pos.x() - x) / self.zoom), math.floor((pos.y() - y) / self.zoom))
+
+    def map_from_image(self, pos):
+        """把图像坐标转换为画布中的位置"""
+        x, y = self.origin()
+        return QPoint(x + round(pos.x() * self.zoom), y + round(pos.y() * self.zoom))
+
+    def map_rect_from_image(self, rect):
+        """图像中的矩形在画布中覆盖的范围"""
+        return self.image_transform().mapRect(QRectF(rect)).toAlignedRect()
+
+    def image_rect(self, rect):
+        """画布中的矩形覆盖的图像范围，限制在图像内"""
+        inverse, _ = self.image_transform().inverted()
+        return inverse.mapRect(QRectF(rect)).toAlignedRect().intersected(QRect(QPoint(0, 0), self.image_size))
+
+    def fit_zoom(self):
+        """完整显示图像的缩放比例，不放大"""
+        view = self.view_rect()
+        if self.image_size.isEmpty() or view.isEmpty():
+            return 1.0
+        return min(1.0, view.width() / self.image_size.width(), view.height() / self.image_size.height())
+
+    def set_zoom(self, zoom, anchor=None):
+        """设置缩放比例，anchor（画布坐标）处的图像内容位置不变，默认以视口中心为准"""
+        zoom = min(max(zoom, self.MIN_ZOOM), self.MAX_ZOOM)
+        if zoom == self.zoom:
+            return
+        view = self.view_rect()
+        if anchor is None:
+            anchor = view.center()
+        x, y = self.origin()
+        image_x = (anchor.x() - x) / self.zoom
+        image_y = (anchor.y() - y) / self.zoom
+        self.zoom = zoom
+        self.scroll_x = round(image_x * zoom - (anchor.x() - view.left()))
+        self.scroll_y = round(image_y * zoom - (anchor.y() - view.top()))
+        self._clamp_scroll()
+        self.invalidate()
+
+    def scroll_by(self, dx, dy):
+        """平移视口，缓存的图块直接复用"""
+        old = (self.scroll_x, self.scroll_y)
+        self.scroll_x += dx
+        self.scroll_y += dy
+        self._clamp_scroll()
+        if (self.scroll_x, self.scroll_y) != old:
+            self.update()
+
+    def _clamp_scroll(self):
+        view = self.view_rect()
+        scaled = self.scaled_size()
+        self.scroll_x = min(max(self.scroll_x, 0), max(0, scaled.width() - view.width()))
+        self.scroll_y = min(max(self.scroll_y, 0), max(0, scaled.height() - view.height()))
+
+    def is_panning(self):
+        return self._pan_pos is not None
+
+    def _render(self, columns, rows):
+        """一次绘制columns×rows范围内的图块并放入缓存
+
+        跨越多个图块的标注只需要绘制一次，绘制后再把结果切成图块
+        """
+        size = self.TILE
+        scaled = self.scaled_size()
+        left, top = columns[0] * size, rows[0] * size
+        width = min((columns[-1] + 1) * size, scaled.width()) - left
+        height = min((rows[-1] + 1) * size, scaled.height()) - top
+        image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        painter.setTransform(QTransform(self.zoom, 0, 0, self.zoom, -left, -top))
+        rect = QRectF(left / self.zoom, top / self.zoom, width / self.zoom, height / self.zoom)
+        self._draw_tile(painter, rect.toAlignedRect().intersected(QRect(QPoint(0, 0), self.image_size)))
+        painter.end()
+        for row in rows:
+            for column in columns:
+                tile = QRect(column * size - left, row * size - top, size, size).intersected(image.rect())
+                self._tiles[(column, row)] = image.copy(tile) if tile != image.rect() else image
+                self.tile_renders += 1
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        rect = event.rect()
+
+        # 边框
+        if self.border:
+            frame = QRegion(self.rect()) - QRegion(self.view_rect())
+            for part in (frame & QRegion(rect)).rects():
+                painter.fillRect(part, self.BORDER_COLOR)
+
+        view = self.view_rect()
+        if self.image_size.isEmpty():
+            painter.end()
+            return
+        x, y = self.origin()
+        scaled = self.scaled_size()
+        area = QRect(x, y, scaled.width(), scaled.height()).intersected(view)
+
+        # 缩小后图像比视口小时，图像以外的部分
+        outside = (QRegion(view) - QRegion(area)) & QRegion(rect)
+        for part in outside.rects():
+            painter.fillRect(part, self.BACKGROUND_COLOR)
+
+        dirty = area.intersected(rect)
+        if dirty.isEmpty():
+            painter.end()
+            return
+        # 缩放后最后一行和一列可能只被图像覆盖一部分，先填充背景
+        edge = (QRegion(x + scaled.width() - 1, y, 1, scaled.height()) |
+                QRegion(x, y + scaled.height() - 1, scaled.width(), 1)) & QRegion(dirty)
+        for part in edge.rects():
+            painter.fillRect(part, self.BACKGROUND_COLOR)
+        painter.setClipRect(dirty)
+        image_rect = self.image_rect(dirty)
+        transform = self.image_transform()
+
+        if self._draw_under is not None:
+            painter.setTransform(transform)
+            self._draw_under(painter, image_rect)
+            painter.resetTransform()
+
+        size = self.TILE
+        columns = range((dirty.left() - x) // size, (dirty.right() - x) // size + 1)
+        rows = range((dirty.top() - y) // size, (dirty.bottom() - y) // size + 1)
+        tiles = self._tiles
+        missing = [(column, row) for row in rows for column in columns if (column, row) not in tiles]
+        if missing:
+            # 缺少的图块（平移时通常是新露出的一行或一列）合在一起绘制
+            self._render(range(min(c for c, _ in missing), max(c for c, _ in missing) + 1),
+                         range(min(r for _, r in missing), max(r for _, r in missing) + 1))
+        for row in rows:
+            for column in columns:
+                tiles.move_to_end((column, row))
+                painter.drawImage(x + column * size, y + row * size, tiles[(column, row)])
+        while len(tiles) > self.MAX_TILES:
+            tiles.popitem(last=False)
+
+        if self._draw_over is not None:
+            painter.setTransform(transform)
+            self._draw_over(painter, image_rect)
+        painter.end()
+
+    def wheelEvent(self, event):
+        delta = event.angleDelta()
+        if event.modifiers() & Qt.ControlModifier:
+            self.set_zoom(self.zoom * self.ZOOM_STEP ** (delta.y() / 120), event.pos())
+        else:
+            pixels = event.pixelDelta()
+            if pixels.isNull():
+                pixels = delta * self.SCROLL_STEP / 120
+            dx, dy = -pixels.x(), -pixels.y()
+            if event.modifiers() & Qt.ShiftModifier:
+                dx, dy = dy, dx
+            self.scroll_by(dx, dy)
+        event.accept()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MiddleButton:
+            self._pan_pos = event.pos()
+            self.setCursor(Qt.ClosedHandCursor)
+            event.accept()
+            return
+        super().mousePressEvent(event)
+
+    def mouseMoveEvent(self, event):
+        if self._pan_pos is not None:
+            delta = event.pos() - self._pan_pos
+            self._pan_pos = event.pos()
+            self.scroll_by(-delta.x(), -delta.y())
+            event.accept()
+            return
+        super().mouseMoveEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.MiddleButton and self._pan_pos is not None:
+            self._pan_pos = None
+            self.setCursor(Qt.ArrowCursor)
+            event.accept()
+            return
+        super().mouseReleaseEvent(event)
@@ -0,0 +1,456 @@
+from collections import OrderedDict
+
+import numpy as np
+from PyQt5.QtCore import Qt, QPoint, QRect, QRectF
+from PyQt5.QtGui import QImage, QPainter
+
+
+def qimage_view(image, writable=True):
+    """返回32位QImage像素的numpy视图 (高, 宽, 4)，通道顺序为BGRA
+
+    视图直接引用QImage的内存，调用方需要保证image在使用视图期间存活且不被修改格式；
+    writable为False时返回只读视图，不会触发隐式共享的图像复制
+    """
+    if image.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32):
+        raise ValueError("只支持Format_RGB32和Format_ARGB32格式的图像")
+    ptr = image.bits() if writable else image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    return np.ndarray((image.height(), image.width(), 4), dtype=np.uint8, buffer=ptr,
+                      strides=(image.bytesPerLine(), 4, 1))
+
+
+def _argb32(image):
+    """返回与QImage.pixel()读取结果相同（非预乘）的32位图像，已经是该格式时不复制"""
+    if image.format() in (QImage.Format_RGB32, QImage.Format_ARGB32):
+        return image
+    return image.convertToFormat(QImage.Format_ARGB32)
+
+
+def _block_edges(start, stop, origin, size):
+    """返回 [start, stop) 被网格线切分后的块长度，以及第一块前缺少的长度
+
+    网格从origin开始每size一块，与范围边界相交的块只计算范围内的部分
+    """
+    offset = (start - origin) % size  # 第一块在范围外的部分
+    length = stop - start
+    count = -(-(length + offset) // size)
+    edges = np.clip(np.arange(count + 1) * size - offset, 0, length)
+    return np.diff(edges), offset
+
+
+def _block_sums(array, axis, offset, size, count, dtype):
+    """沿axis按块求和：每次取各块中相同位置的一行（列），size次切片累加完成
+
+    相当于在开头补offset行零后按size分块求和，每次切片都是整行，比reduceat快得多
+    """
+    shape = list(array.shape)
+    shape[axis] = count
+    sums = np.zeros(shape, dtype=dtype)
+    for k in range(size):
+        first = k - offset
+        skip = 0 if first >= 0 else 1
+        index = [slice(None)] * array.ndim
+        index[axis] = slice(first + skip * size, None, size)
+        rows = array[tuple(index)]
+        index[axis] = slice(skip, skip + rows.shape[axis])
+        sums[tuple(index)] += rows
+    return sums
+
+
+def pixelate_array(pixels, left, top, right, bottom, size, origin_x=None, origin_y=None):
+    """对 [left, right) x [top, bottom) 范围内的像素原地做马赛克
+
+    块网格从 (origin_x, origin_y) 开始（默认为区域左上角），与区域边界相交的块只统计区域内的像素；
+    每块的颜色是块内像素各通道的平均值（向下取整），alpha设为255
+    """
+    left, top = max(left, 0), max(top, 0)
+    right, bottom = min(right, pixels.shape[1]), min(bottom, pixels.shape[0])
+    if right <= left or bottom <= top or size <= 0:
+        return
+    origin_x = left if origin_x is None else origin_x
+    origin_y = top if origin_y is None else origin_y
+
+    region = pixels[top:bottom, left:right]
+    heights, row_offset = _block_edges(top, bottom, origin_y, size)
+    widths, col_offset = _block_edges(left, right, origin_x, size)
+
+    # 先按行块求和再按列块求和，中间结果只有 (行块数, 宽, 4)；每列最多size个像素，uint16不会溢出
+    row_dtype = np.uint16 if size * 255 <= np.iinfo(np.uint16).max else np.uint32
+    sums = _block_sums(region, 0, row_offset, size, len(heights), row_dtype)
+    sums = _block_sums(sums, 1, col_offset, size, len(widths), np.uint32)
+    counts = (heights[:, None] * widths[None, :])[:, :, None]
+    means = (sums // counts).astype(np.uint8)
+    means[:, :, 3] = 255
+
+    region[...] = np.repeat(np.repeat(means, heights, axis=0), widths, axis=1)
+
+
+def pixelate_image(image, left, top, right, bottom, size, origin_x=None, origin_y=None):
+    """返回做过马赛克的图像副本，参数含义同pixelate_array
+
+    读取的颜色与QImage.pixel()相同（非预乘），结果为Format_ARGB32
+    """
+    result = _argb32(image).copy()
+    pixelate_array(qimage_view(result), left, top, right, bottom, size, origin_x, origin_y)
+    return result
+
+
+def _box_blur_axis(data, radius, axis):
+    """沿axis做半径radius的均值滤波，窗口超出边界的部分不计入平均
+
+    窗口和由前缀和相减得到，耗时与半径无关；沿第0轴的前缀和逐行累加，比np.cumsum快很多
+    """
+    n = data.shape[axis]
+    radius = min(radius, n - 1)
+    if radius <= 0:
+        return data
+    if axis == 0:
+        prefix = np.empty((n + 1,) + data.shape[1:], dtype=np.float32)
+        prefix[0] = 0
+        for i in range(n):
+            np.add(prefix[i], data[i], out=prefix[i + 1])
+    else:
+        prefix = np.zeros(data.shape[:axis] + (n + 1,) + data.shape[axis + 1:], dtype=np.float32)
+        np.cumsum(data, axis=axis, out=prefix[(slice(None),) * axis + (slice(1, None),)])
+    prefix = np.moveaxis(prefix, axis, 0)
+    result = np.empty_like(data)
+    out = np.moveaxis(result, axis, 0)
+
+    # 窗口完全在范围内的部分一次相减；两端窗口被截断的部分也是前缀和的连续切片，各自一次处理
+    width = 2 * radius + 1
+    if n >= width:
+        np.subtract(prefix[width:], prefix[:n + 1 - width], out=out[radius:n - radius])
+    # 左端窗口从0开始，prefix[0]为0，窗口和就是右端的前缀和（右端超出范围时为prefix[n]）
+    left = min(radius, n)
+    inside = max(0, min(left, n - radius - 1))
+    out[:inside] = prefix[radius + 1:radius + 1 + inside]
+    out[inside:left] = prefix[n]
+    # 右端窗口在n处截断
+    start = max(n - radius, radius)
+    np.subtract(prefix[n], prefix[start - radius:n - radius], out=out[start:n])
+    index = np.arange(n)
+    high = np.minimum(index + radius + 1, n)
+    low = np.maximum(index - radius, 0)
+    out *= (1.0 / (high - low)).astype(np.float32).reshape((n,) + (1,) * (data.ndim - 1))
+    return result
+
+
+def gaussian_box_radii(sigma, passes=3):
+    """返回近似标准差为sigma的高斯模糊所需的各次均值滤波半径
+
+    每次的半径至少为1：sigma很小时理想半径会取整为0，打码后像素完全不变
+    """
+    if sigma <= 0:
+        return []
+    ideal = np.sqrt(12 * sigma * sigma / passes + 1)
+    lower = int(np.floor(ideal))
+    if lower % 2 == 0:
+        lower -= 1
+    upper = lower + 2
+    count = round((12 * sigma * sigma - passes * lower * lower - 4 * passes * lower - 3 * passes) / (-4 * lower - 4))
+    return [max(1, ((lower if i < count else upper) - 1) // 2) for i in range(passes)]
+
+
+def blur_array(pixels, left, top, right, bottom, radius, kernel="box"):
+    """对 [left, right) x [top, bottom) 范围内的像素原地做模糊，只使用范围内的像素
+
+    kernel为"box"时做一次半径为radius的均值滤波；为"gaussian"时用三次均值滤波近似
+    标准差为radius/2的高斯模糊。行列分开处理，耗时与半径无关；alpha设为255
+    """
+    left, top = max(left, 0), max(top, 0)
+    right, bottom = min(right, pixels.shape[1]), min(bottom, pixels.shape[0])
+    if right <= left or bottom <= top or radius <= 0:
+        return
+    if kernel == "box":
+        radii = [radius]
+    elif kernel == "gaussian":
+        radii = gaussian_box_radii(radius / 2)
+    else:
+        raise ValueError(f"未知的模糊类型: {kernel}")
+
+    region = pixels[top:bottom, left:right]
+    data = region[:, :, :3].astype(np.float32)
+    # 行方向和列方向可以交换顺序，先完成所有列方向再完成所有行方向
+    for r in radii:
+        data = _box_blur_axis(data, r, 0)
+    for r in radii:
+        data = _box_blur_axis(data, r, 1)
+    region[:, :, :3] = np.rint(data)
+    region[:, :, 3] = 255
+
+
+def blur_image(image, left, top, right, bottom, radius, kernel="box"):
+    """返回做过模糊的图像副本，参数含义同blur_array，结果为Format_ARGB32"""
+    result = _argb32(image).copy()
+    blur_array(qimage_view(result), left, top, right, bottom, radius, kernel)
+    return result
+
+
+def _array_image(array):
+    """把 (高, 宽, 4) 的BGRA数组包装为QImage，返回的图像引用数组内存"""
+    array = np.ascontiguousarray(array)
+    image = QImage(array.data, array.shape[1], array.shape[0], array.shape[1] * 4, QImage.Format_ARGB32)
+    image._array = array  # 保持数组存活
+    return image
+
+
+class MosaicPreview:
+    """拖动马赛克选区时的增量预览，结果与pixelate_array完全相同
+
+    网格以选区左上角为起点，完整块做过马赛克的像素按起点缓存，选区变大时只计算新进入的块，
+    变小时直接复用；只有右侧和下侧被选区截断的块每次重新计算，按块大小最近邻放大绘制。
+    每次移动的开销是一次不缩放的贴图加上新进入块的计算
+    """
+
+    def __init__(self, image, size):
+        self.image = _argb32(image)
+        self.pixels = qimage_view(self.image, writable=False)
+        self.size = size
+        self._origin = None
+        self._mosaic = None  # 以起点为原点的全分辨率马赛克像素，只有已计算的块有效
+        self._mosaic_image = None
+        self._rows = 0  # 已计算的完整块范围
+        self._cols = 0
+
+    def _block_means(self, top, left, rows, cols):
+        """计算从 (left, top) 开始 rows x cols 个完整块的平均值"""
+        size = self.size
+        region = self.pixels[top:top + rows * size, left:left + cols * size]
+        row_dtype = np.uint16 if size * 255 <= np.iinfo(np.uint16).max else np.uint32
+        sums = _block_sums(_block_sums(region, 0, 0, size, rows, row_dtype), 1, 0, size, cols, np.uint32)
+        means = (sums // (size * size)).astype(np.uint8)
+        means[:, :, 3] = 255
+        return means
+
+    def _fill(self, row0, row1, col0, col1):
+        if row1 > row0 and col1 > col0:
+            top, left = self._origin[1], self._origin[0]
+            size = self.size
+            means = self._block_means(top + row0 * size, left + col0 * size, row1 - row0, col1 - col0)
+            self._mosaic[row0 * size:row1 * size, col0 * size:col1 * size] = \
+                np.repeat(np.repeat(means, size, axis=0), size, axis=1)
+
+    def update(self, left, top, right, bottom):
+        """更新 [left, right) x [top, bottom) 的完整块缓存，返回完整块的行数和列数"""
+        size = self.size
+        if self._origin != (left, top):
+            self._origin = (left, top)
+            height, width = self.pixels.shape[:2]
+            self._mosaic = np.empty(((height - top) // size * size, (width - left) // size * size, 4), dtype=np.uint8)
+            self._mosaic_image = _array_image(self._mosaic)
+            self._rows = self._cols = 0
+        rows = (bottom - top) // size
+        cols = (right - left) // size
+        if rows > self._rows or cols > self._cols:
+            new_rows, new_cols = max(rows, self._rows), max(cols, self._cols)
+            # 已计算的范围是左上角的矩形，新进入的块是它右侧和下方的两条
+            self._fill(0, new_rows, self._cols, new_cols)
+            self._fill(self._rows, new_rows, 0, self._cols)
+            self._rows, self._cols = new_rows, new_cols
+        return rows, cols
+
+    def paint(self, painter, left, top, right, bottom):
+        """在painter上绘制 [left, right) x [top, bottom) 做马赛克后的样子"""
+        if right <= left or bottom <= top:
+            return
+        size = self.size
+        rows, cols = self.update(left, top, right, bottom)
+        extra_w = (right - left) - cols * size  # 右侧被截断的块宽度
+        extra_h = (bottom - top) - rows * size  # 下方被截断的块高度
+        x1, y1 = left + cols * size, top + rows * size
+
+        parts = []
+        if extra_w and rows:
+            strip = self.pixels[top:y1, x1:right].reshape(rows, size, extra_w, 4)
+            means = strip.sum(axis=(1, 2), dtype=np.uint32) // (size * extra_w)
+            parts.append((QRect(x1, top, extra_w, rows * size), means[:, None, :]))
+        if extra_h and cols:
+            strip = self.pixels[y1:bottom, left:x1].reshape(extra_h, cols, size, 4)
+            means = strip.sum(axis=(0, 2), dtype=np.uint32) // (extra_h * size)
+            parts.append((QRect(left, y1, cols * size, extra_h), means[None, :, :]))
+        if extra_w and extra_h:
+            means = self.pixels[y1:bottom, x1:right].sum(axis=(0, 1), dtype=np.uint32) // (extra_w * extra_h)
+            parts.append((QRect(x1, y1, extra_w, extra_h), means[None, None, :]))
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing, False)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, False)
+        if rows and cols:
+            painter.drawImage(QPoint(left, top), self._mosaic_image, QRect(0, 0, cols * size, rows * size))
+        for target, means in parts:
+            means = means.astype(np.uint8)
+            means[:, :, 3] = 255
+            painter.drawImage(target, _array_image(means))
+        painter.restore()
+
+
+class BlurPreview:
+    """拖动模糊选区时的近似预览
+
+    按选区面积选择2的幂的缩小倍数，使参与模糊的像素不超过max_pixels；每个倍数的缩小图
+    第一次用到时生成并缓存，之后每次移动只在缩小图上按缩小后的半径模糊选区再平滑放大，
+    耗时基本不随选区大小增长；松开鼠标时再做全分辨率的精确模糊
+    """
+
+    def __init__(self, image, radius, kernel="box", max_pixels=120000):
+        self.image = _argb32(image)
+        self.radius = radius
+        self.kernel = kernel
+        self.max_pixels = max_pixels
+        self._levels = {1: self.image}  # 缩小倍数 -> 缩小后的整张图像
+
+    def _level(self, factor):
+        level = self._levels.get(factor)
+        if level is None:
+            level = self.image.scaled(max(self.image.width() // factor, 1), max(self.image.height() // factor, 1),
+                                      Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            level = self._levels[factor] = _argb32(level)
+        return level
+
+    def paint(self, painter, left, top, right, bottom):
+        """在painter上绘制 [left, right) x [top, bottom) 模糊后的近似效果"""
+        width, height = right - left, bottom - top
+        if width <= 0 or height <= 0:
+            return
+        factor = 1
+        while width * height > self.max_pixels * factor * factor:
+            factor *= 2
+        level = self._level(factor)
+        # 缩小图上覆盖选区的最小整像素范围
+        x0, y0 = left // factor, top // factor
+        x1 = min(-(-right // factor), level.width())
+        y1 = min(-(-bottom // factor), level.height())
+        if x1 <= x0 or y1 <= y0:
+            return
+        small = level.copy(x0, y0, x1 - x0, y1 - y0)
+        blur_array(qimage_view(small), 0, 0, small.width(), small.height(),
+                   max(1, round(self.radius / factor)), self.kernel)
+
+        painter.save()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, factor > 1)
+        painter.drawImage(QRectF(left, top, width, height), small,
+                          QRectF(left / factor - x0, top / factor - y0, width / factor, height / factor))
+        painter.restore()
+
+
+class EffectCache:
+    """按字节数限制容量的LRU缓存，保存效果渲染出的图像块"""
+
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        image = self._items.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key, image):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.bytes -= old.sizeInBytes()
+        self._items[key] = image
+        self.bytes += image.sizeInBytes()
+        # 最近加入的一项总是保留，即使它本身超过容量
+        while self.bytes > self.max_bytes and len(self._items) > 1:
+            _, evicted = self._items.popitem(last=False)
+            self.bytes -= evicted.sizeInBytes()
+
+    def clear(self):
+        self._items.clear()
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+def mosaic_effect(rect, size):
+    """马赛克效果的描述，网格从rect左上角开始"""
+    return ("mosaic", (rect.x(), rect.y(), rect.width(), rect.height()), size)
+
+
+def blur_effect(rect, radius, kernel="box"):
+    """模糊效果的描述，只使用rect内的像素"""
+    return ("blur", (rect.x(), rect.y(), rect.width(), rect.height()), radius, kernel)
+
+
+class EffectLayer:
+    """从原始像素按顺序渲染马赛克和模糊，效果本身不修改原图
+
+    渲染结果是一组图像块，按顺序覆盖到原图上即可得到最终效果；后面的效果以前面效果
+    的结果为输入。每个图像块按 (效果, 块范围, 原图版本, 下方图像块) 缓存，马赛克按与网格
+    对齐的瓦片切分，缓存键只包含块大小和网格偏移，调整一个效果时只重新计算受影响的瓦片
+    """
+
+    def __init__(self, cache=None, tile=256):
+        self.cache = cache if cache is not None else EffectCache()
+        self.tile = tile
+        self.source = None
+        self.revision = 0
+
+    def set_source(self, image):
+        """设置原图，版本号递增，旧版本的缓存不再命中"""
+        self.source = _argb32(image)
+        self.revision += 1
+
+    def patches(self, effects):
+        """返回 [(目标范围, 图像块)]，按顺序绘制到原图坐标系即可"""
+        if self.source is None:
+            return []
+        bounds = self.source.rect()
+        done = []  # (目标范围, 图像块, 缓存键)
+        for effect in effects:
+            x, y, w, h = effect[1]
+            area = QRect(x, y, w, h).intersected(bounds)
+            if area.isEmpty():
+                continue
+            if effect[0] == "mosaic":
+                # 瓦片边长是块大小的整数倍，并且从网格起点对齐，分开计算与整体计算结果相同
+                step = effect[2] * max(1, self.tile // effect[2])
+                first_x = x + (area.left() - x) // step * step
+                first_y = y + (area.top() - y) // step * step
+                targets = [QRect(tx, ty, step, step).intersected(area)
+                           for ty in range(first_y, area.bottom() + 1, step)
+                           for tx in range(first_x, area.right() + 1, step)]
+            else:
+                targets = [area]
+            done.extend([self._patch(effect, target, done) for target in targets])
+        return [(target, image) for target, image, _ in done]
+
+    def _patch(self, effect, target, done):
+        under = [item for item in done if item[0].intersects(target)]
+        if effect[0] == "mosaic":
+            # 瓦片的像素只取决于块大小和网格相对块大小的偏移，与马赛克的整体范围无关，
+            # 调整大小时内部的瓦片仍然命中缓存
+            size = effect[2]
+            x, y = effect[1][:2]
+            spec = ("mosaic", size, x % size, y % size)
+        else:
+            spec = effect
+        key = (spec, (target.x(), target.y(), target.width(), target.height()),
+               self.revision, tuple(item[2] for item in under))
+        image = self.cache.get(key)
+        if image is None:
+            image = self.source.copy(target)
+            if under:
+                painter = QPainter(image)
+                painter.setCompositionMode(QPainter.CompositionMode_Source)
+                for rect, patch, _ in under:
+                    painter.drawImage(rect.topLeft() - target.topLeft(), patch)
+                painter.end()
+            pixels = qimage_view(image)
+            width, height = target.width(), target.height()
+            if effect[0] == "mosaic":
+                x, y = effect[1][:2]
+                pixelate_array(pixels, 0, 0, width, height, effect[2], x - target.x(), y - target.y())
+            else:
+                blur_array(pixels, 0, 0, width, height, effect[2], effect[3])
+            self.cache.put(key, image)
+        return target, image, key
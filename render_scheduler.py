@@ -0,0 +1,86 @@
+import time
+
+from PyQt5.QtCore import QObject, QTimer, Qt
+
+
+class RenderScheduler(QObject):
+    """把多次重绘请求合并为每个显示帧最多一次重绘
+
+    request只标记画面需要重绘：距上一帧不足一个帧间隔时等到下一帧再绘制，期间的请求合并为一次；
+    flush立即完成挂起的重绘，用于松开鼠标等需要马上看到最终结果的时候。
+    计数器记录请求数、实际绘制的帧数和被合并掉的请求数，以及每帧的绘制耗时
+    """
+
+    def __init__(self, render, fps=60, parent=None):
+        super().__init__(parent)
+        self._render = render
+        self.interval = 1.0 / fps  # 两帧之间的最小间隔（秒）
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.timeout.connect(self._run)
+        self._dirty = False
+        self._last_frame = None
+        self.reset_stats()
+
+    def set_fps(self, fps):
+        if fps > 0:
+            self.interval = 1.0 / fps
+
+    def request(self):
+        """标记需要重绘，返回False表示这次请求与挂起的重绘合并"""
+        self.requests += 1
+        if self._dirty:
+            return False
+        self._dirty = True
+        delay = 0.0
+        if self._last_frame is not None:
+            delay = self._last_frame + self.interval - time.perf_counter()
+        self._timer.start(max(0, int(delay * 1000 + 0.5)))
+        return True
+
+    def pending(self):
+        return self._dirty
+
+    def flush(self):
+        """有挂起的重绘时立即绘制"""
+        if self._dirty:
+            self._timer.stop()
+            self._run()
+
+    def cancel(self):
+        """丢弃挂起的重绘"""
+        self._timer.stop()
+        self._dirty = False
+
+    def _run(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        start = time.perf_counter()
+        self._last_frame = start
+        self._render()
+        elapsed = time.perf_counter() - start
+        self.frames += 1
+        self.render_time += elapsed
+        self.max_render_time = max(self.max_render_time, elapsed)
+
+    @property
+    def coalesced(self):
+        """被合并掉、没有单独绘制的请求数"""
+        return self.requests - self.frames - (1 if self._dirty else 0)
+
+    def reset_stats(self):
+        self.requests = 0
+        self.frames = 0
+        self.render_time = 0.0
+        self.max_render_time = 0.0
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "frames": self.frames,
+            "coalesced": self.coalesced,
+            "mean_frame_ms": self.render_time / self.frames * 1000 if self.frames else 0.0,
+            "max_frame_ms": self.max_render_time * 1000,
+        }
@@ -0,0 +1,155 @@
+import datetime
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QBuffer, QIODevice, QObject, pyqtSignal
+from PyQt5.QtGui import QPixmap
+from capture_trace import NULL_TRACE
+
+
+class SaveQueue(QObject):
+    """有界的后台保存队列，PNG编码和磁盘写入都在工作线程上进行
+
+    - 队列深度: 排队中和正在写入的任务总数不超过max_pending
+    - 背压: 队列已满时submit不阻塞调用方（GUI线程），立即返回False并发出failed信号；
+      指定timeout时最多等待timeout秒
+    - 关闭: shutdown不再接受新任务，并等待已提交的任务全部写完
+    完成和失败通过saved/failed信号通知，信号在对象所属线程（通常是GUI线程）中处理
+    """
+
+    saved = pyqtSignal(str)  # 文件路径
+    failed = pyqtSignal(str, str)  # 文件路径, 错误信息
+
+    def __init__(self, max_workers=2, max_pending=8, parent=None):
+        super().__init__(parent)
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="save")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._closed = False
+
+    def pending(self):
+        """返回排队中和正在写入的任务数"""
+        with self._lock:
+            return self._pending
+
+    def submit(self, image, path, image_format=None, quality=-1, timeout=0, trace=NULL_TRACE):
+        """提交保存任务，成功入队返回True
+
+        队列接管image的像素，调用方之后不应再修改它；传入QPixmap时会先在当前线程转换为QImage，
+        因为QPixmap不能在工作线程中使用。trace会记录编码和写盘完成的时间并结束追踪
+        """
+        if self._closed:
+            self.failed.emit(path, "保存队列已关闭")
+            return False
+        if isinstance(image, QPixmap):
+            image = image.toImage()
+        return self._submit(path, timeout, self._write, image, path, image_format, quality, trace)
+
+    def submit_call(self, path, fn, *args, timeout=0):
+        """提交一个写入path的任务，fn(*args)在工作线程上执行，与图片保存共用队列深度和信号
+
+        fn中不能使用QPixmap等只能在GUI线程中使用的对象
+        """
+        if self._closed:
+            self.failed.emit(path, "保存队列已关闭")
+            return False
+        return self._submit(path, timeout, self._call, path, fn, args)
+
+    def _submit(self, path, timeout, task, *args):
+        acquired = self._slots.acquire(timeout=timeout) if timeout else self._slots.acquire(blocking=False)
+        if not acquired:
+            self.failed.emit(path, "保存队列已满")
+            return False
+        # 在锁内检查关闭标记并提交，与shutdown互斥；失败时归还占用的槽位
+        error = None
+        with self._lock:
+            if self._closed:
+                error = "保存队列已关闭"
+            else:
+                self._pending += 1
+                try:
+                    self._executor.submit(task, *args)
+                except RuntimeError as e:
+                    self._pending -= 1
+                    error = str(e)
+        if error is not None:
+            self._slots.release()
+            self.failed.emit(path, error)
+            return False
+        return True
+
+    def _done(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _call(self, path, fn, args):
+        try:
+            fn(*args)
+            self.saved.emit(path)
+        except Exception as e:
+            self.failed.emit(path, str(e))
+        finally:
+            self._done()
+
+    def _write(self, image, path, image_format, quality, trace):
+        """在工作线程上编码并写入文件，编码和写盘分开进行以便分别计时"""
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            if image_format is None:
+                image_format = os.path.splitext(path)[1].lstrip(".").upper() or "PNG"
+            buffer = QBuffer()
+            buffer.open(QIODevice.WriteOnly)
+            if not image.save(buffer, image_format, quality):
+                raise OSError("编码失败")
+            trace.mark("encode_done")
+            with open(path, "wb") as f:
+                f.write(buffer.data().data())
+            trace.mark("write_done")
+            self.saved.emit(path)
+        except Exception as e:
+            self.failed.emit(path, str(e))
+        finally:
+            trace.finish()
+            self._done()
+
+    def shutdown(self, wait=True):
+        """停止接受新任务，wait为True时等待队列中的任务全部写完"""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait)
+
+
+_default_queue = None
+
+
+def default_save_queue():
+    """返回进程内共享的保存队列，截图程序和编辑器使用同一个队列"""
+    global _default_queue
+    if _default_queue is None:
+        _default_queue = SaveQueue()
+    return _default_queue
+
+
+_filename_lock = threading.Lock()
+_last_stamps = {}
+
+
+def output_filename(prefix, directory="output", ext="png"):
+    """生成 output/前缀_年月日_时分秒_毫秒.png 形式的文件名
+
+    同一毫秒内多次生成时追加序号，保证同一进程中的文件名不会互相覆盖
+    """
+    now = datetime.datetime.now()
+    stamp = now.strftime('%Y%m%d_%H%M%S') + f"_{now.microsecond // 1000:03d}"
+    with _filename_lock:
+        last_stamp, count = _last_stamps.get(prefix, (None, 0))
+        count = count + 1 if stamp == last_stamp else 0
+        _last_stamps[prefix] = (stamp, count)
+    if count:
+        stamp += f"_{count}"
+    return os.path.join(directory, f"{prefix}_{stamp}.{ext}")
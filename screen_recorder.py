@@ -0,0 +1,350 @@
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+from PIL import Image, GifImagePlugin
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class TileHasher:
+    """把帧切成固定大小的块，向量化地计算每块的哈希，用于判断帧是否重复以及变化区域
+
+    哈希是像素与随机奇数权重乘积之和（模2^64），忽略alpha通道；按若干块行分段计算，
+    中间缓冲区只有一段的大小，与录制区域的大小无关
+    """
+
+    BAND_PIXELS = 1 << 18  # 每段大约处理的像素数
+
+    def __init__(self, width, height, tile=16, seed=0x5EED):
+        self.width = width
+        self.height = height
+        self.tile = tile
+        self.rows = -(-height // tile)
+        self.cols = -(-width // tile)
+        rng = np.random.default_rng(seed)
+        weights = rng.integers(1, 2 ** 63, size=(tile, tile), dtype=np.uint64) | np.uint64(1)
+        self.band_rows = min(self.rows, max(1, self.BAND_PIXELS // (tile * tile * self.cols)))
+        self._weights = np.tile(weights, (self.band_rows, self.cols))
+        # 边缘不足一块的部分补零，缓冲区只分配一次
+        self._padded = np.zeros((self.band_rows * tile, self.cols * tile), dtype=np.uint64)
+        self._product = np.empty_like(self._padded)
+
+    def hash(self, frame):
+        """计算BGRA帧每块的哈希，返回 (rows, cols) 的uint64数组"""
+        pixels = frame.view(np.uint32).reshape(self.height, self.width)
+        tile = self.tile
+        hashes = np.empty((self.rows, self.cols), dtype=np.uint64)
+        for row in range(0, self.rows, self.band_rows):
+            count = min(self.band_rows, self.rows - row)
+            top = row * tile
+            bottom = min(top + count * tile, self.height)
+            padded = self._padded[:count * tile]
+            product = self._product[:count * tile]
+            np.bitwise_and(pixels[top:bottom], np.uint32(0x00FFFFFF), out=padded[:bottom - top, :self.width])
+            # 最后一段不足一块的行补零
+            padded[bottom - top:] = 0
+            np.multiply(padded, self._weights[:count * tile], out=product)
+            hashes[row:row + count] = product.reshape(count, tile, self.cols, tile).sum(axis=(1, 3), dtype=np.uint64)
+        return hashes
+
+    def changed_bbox(self, previous, current):
+        """返回变化块的外接矩形 (x, y, w, h)，两帧相同时返回None"""
+        changed = previous != current
+        if not changed.any():
+            return None
+        rows = np.flatnonzero(changed.any(axis=1))
+        cols = np.flatnonzero(changed.any(axis=0))
+        x = int(cols[0]) * self.tile
+        y = int(rows[0]) * self.tile
+        right = min((int(cols[-1]) + 1) * self.tile, self.width)
+        bottom = min((int(rows[-1]) + 1) * self.tile, self.height)
+        return x, y, right - x, bottom - y
+
+
+class ApngWriter:
+    """边录边写的APNG编码器，每帧只编码变化区域，帧数在关闭时回填到acTL块"""
+
+    def __init__(self, path, width, height, loop=0, level=6):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.level = level
+        self.frame_count = 0
+        self._sequence = 0
+        self._file = open(path, "wb")
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        self._actl_offset = self._file.tell()
+        self._loop = loop
+        self._write_chunk(b"acTL", struct.pack(">II", 0, loop))
+
+    def _write_chunk(self, chunk_type, data):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+    def _compress(self, rgb):
+        """所有行使用Up滤波后压缩"""
+        height, width = rgb.shape[:2]
+        rows = np.empty((height, width * 3 + 1), dtype=np.uint8)
+        rows[:, 0] = 2
+        rows[:, 1:] = rgb.reshape(height, width * 3)
+        rows[1:, 1:] -= rgb[:-1].reshape(height - 1, width * 3)
+        return zlib.compress(rows.tobytes(), self.level)
+
+    def add_frame(self, rgb, duration_ms, offset=(0, 0)):
+        """写入一帧，rgb为变化区域的像素，offset为其在画面中的位置；第一帧必须是整个画面"""
+        height, width = rgb.shape[:2]
+        delay = min(max(int(round(duration_ms)), 0), 65535)
+        self._write_chunk(b"fcTL", struct.pack(">IIIIIHHBB", self._sequence, width, height,
+                                               offset[0], offset[1], delay, 1000, 0, 0))
+        self._sequence += 1
+        data = self._compress(np.ascontiguousarray(rgb))
+        if self.frame_count == 0:
+            self._write_chunk(b"IDAT", data)
+        else:
+            self._write_chunk(b"fdAT", struct.pack(">I", self._sequence) + data)
+            self._sequence += 1
+        self.frame_count += 1
+
+    def close(self):
+        self._write_chunk(b"IEND", b"")
+        self._file.seek(self._actl_offset)
+        self._write_chunk(b"acTL", struct.pack(">II", self.frame_count, self._loop))
+        self._file.close()
+
+
+class GifWriter:
+    """边录边写的GIF编码器，每帧单独量化为256色并只编码变化区域"""
+
+    def __init__(self, path, width, height, loop=0):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.loop = loop
+        self.frame_count = 0
+        self._elapsed_ms = 0.0
+        self._written_cs = 0
+        self._file = open(path, "wb")
+
+    def add_frame(self, rgb, duration_ms, offset=(0, 0)):
+        image = Image.fromarray(np.ascontiguousarray(rgb), "RGB").quantize(256, method=Image.Quantize.FASTOCTREE)
+        if self.frame_count == 0:
+            header, _ = GifImagePlugin.getheader(image, info={"loop": self.loop})
+            for block in header:
+                self._file.write(block)
+        # GIF的时长单位是10毫秒，按累计时间取整避免长录制时误差累积
+        self._elapsed_ms += duration_ms
+        centiseconds = int(round(self._elapsed_ms / 10)) - self._written_cs
+        self._written_cs += centiseconds
+        for block in GifImagePlugin.getdata(image, offset, duration=centiseconds * 10, include_color_table=True):
+            self._file.write(block)
+        self.frame_count += 1
+
+    def close(self):
+        self._file.write(b";")
+        self._file.close()
+
+
+class WebpWriter:
+    """WebP编码器
+
+    Pillow不能逐帧写入动画WebP，先把帧流式写入临时APNG，关闭时由Pillow逐帧读取临时文件编码，
+    内存中始终只有一帧原始像素
+    """
+
+    def __init__(self, path, width, height, loop=0, lossless=True, quality=80):
+        self.path = path
+        self.loop = loop
+        self.lossless = lossless
+        self.quality = quality
+        self._durations = []
+        self._spool = ApngWriter(path + ".spool.png", width, height, level=1)
+
+    @property
+    def frame_count(self):
+        return self._spool.frame_count
+
+    def add_frame(self, rgb, duration_ms, offset=(0, 0)):
+        self._spool.add_frame(rgb, duration_ms, offset)
+        self._durations.append(max(int(round(duration_ms)), 1))
+
+    def close(self):
+        self._spool.close()
+        try:
+            with Image.open(self._spool.path) as image:
+                image.save(self.path, "WEBP", save_all=True, duration=self._durations,
+                           loop=self.loop, lossless=self.lossless, quality=self.quality)
+        finally:
+            os.remove(self._spool.path)
+
+
+RECORD_WRITERS = {
+    ".gif": GifWriter,
+    ".png": ApngWriter,
+    ".apng": ApngWriter,
+    ".webp": WebpWriter,
+}
+
+
+def create_writer(path, width, height):
+    """按扩展名选择编码器"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in RECORD_WRITERS:
+        raise ValueError(f"不支持的录制格式: {ext}")
+    return RECORD_WRITERS[ext](path, width, height)
+
+
+class ScreenRecorder(QObject):
+    """按固定帧率录制选定区域，丢弃与上一帧相同的帧，只把变化的帧和持续时间交给编码器
+
+    抓取线程负责定时抓取和分块哈希比较，编码线程负责写文件，两者之间的队列有上限，
+    所以内存占用与录制时长无关；编码跟不上时抓取线程会阻塞，表现为错过的定时
+    """
+
+    finished = pyqtSignal(dict)  # 文件写完后发出统计信息
+    failed = pyqtSignal(str)  # 错误信息
+
+    def __init__(self, capture_service, path, left, top, width, height, fps=10, tile=16, parent=None):
+        super().__init__(parent)
+        self.capture_service = capture_service
+        self.path = path
+        self.region = (left, top, width, height)
+        self.fps = fps
+        self.hasher = TileHasher(width, height, tile)
+        self.writer = None
+
+        self._stop_event = threading.Event()
+        self._frames = queue.Queue(maxsize=4)
+        self._capture_thread = None
+        self._encode_thread = None
+        self._error = None
+
+        # 统计
+        self.sampled = 0
+        self.duplicates = 0
+        self.encoded = 0
+        self.missed_deadlines = 0
+        self.hash_ms_total = 0.0
+        self.start_time = 0.0
+        self.stop_time = 0.0
+
+    def is_running(self):
+        return self._capture_thread is not None and self._capture_thread.is_alive()
+
+    def start(self):
+        """开始录制"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        width, height = self.region[2:]
+        self.writer = create_writer(self.path, width, height)
+        self.start_time = time.perf_counter()
+        self._stop_event.clear()
+        self._encode_thread = threading.Thread(target=self._encode, name="record-encode", daemon=True)
+        self._capture_thread = threading.Thread(target=self._run, name="record-capture", daemon=True)
+        self._encode_thread.start()
+        self._capture_thread.start()
+
+    def stop(self):
+        """停止抓取，剩余的帧继续在后台编码，写完后发出finished信号"""
+        self._stop_event.set()
+        if self._capture_thread is not None:
+            self._capture_thread.join()
+
+    def wait(self):
+        """等待编码线程写完文件"""
+        if self._encode_thread is not None:
+            self._encode_thread.join()
+
+    def _run(self):
+        """抓取线程：定时抓取，与上一帧比较分块哈希，只有变化时才输出上一个待定帧"""
+        left, top, width, height = self.region
+        interval = 1.0 / self.fps
+        frame = np.empty((height, width, 4), dtype=np.uint8)
+        previous = None
+        pending = None  # (rgb, offset, timestamp)，持续时间要等到下一次变化才知道
+        deadline = time.perf_counter()
+        try:
+            while not self._stop_event.is_set():
+                now = time.perf_counter()
+                if now < deadline:
+                    self._stop_event.wait(deadline - now)
+                    continue
+                if now - deadline >= interval:
+                    missed = int((now - deadline) / interval)
+                    self.missed_deadlines += missed
+                    deadline += missed * interval
+
+                self.capture_service.grab_into(left, top, width, height, frame)
+                timestamp = time.perf_counter()
+                hashes = self.hasher.hash(frame)
+                self.hash_ms_total += (time.perf_counter() - timestamp) * 1000
+                self.sampled += 1
+
+                bbox = (0, 0, width, height) if previous is None else self.hasher.changed_bbox(previous, hashes)
+                if bbox is None:
+                    self.duplicates += 1
+                else:
+                    if pending is not None:
+                        self._emit(pending, timestamp)
+                    x, y, w, h = bbox
+                    # BGRA转RGB，只保留变化区域
+                    pending = (frame[y:y + h, x:x + w, 2::-1].copy(), (x, y), timestamp)
+                previous = hashes
+                deadline += interval
+        except Exception as e:
+            self._error = f"录制抓取失败: {e}"
+        finally:
+            self.stop_time = time.perf_counter()
+            if pending is not None:
+                self._emit(pending, max(self.stop_time, pending[2] + interval))
+            self._frames.put(None)
+
+    def _emit(self, pending, end_time):
+        rgb, offset, timestamp = pending
+        self._frames.put((rgb, (end_time - timestamp) * 1000, offset))
+
+    def _encode(self):
+        """编码线程：出错后继续取出队列中的帧，避免抓取线程阻塞"""
+        while True:
+            item = self._frames.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                self.writer.add_frame(*item)
+                self.encoded += 1
+            except Exception as e:
+                self._error = f"录制编码失败: {e}"
+        try:
+            self.writer.close()
+        except Exception as e:
+            self._error = self._error or f"录制编码失败: {e}"
+        if self._error is not None:
+            self.failed.emit(self._error)
+        else:
+            self.finished.emit(self.stats())
+
+    def stats(self):
+        """返回录制统计：采样帧数、重复帧数、编码帧数、实际帧率等"""
+        end = self.stop_time if self.stop_time else time.perf_counter()
+        elapsed = max(end - self.start_time, 1e-6)
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {
+            "path": self.path,
+            "target_fps": self.fps,
+            "achieved_fps": self.sampled / elapsed,
+            "sampled": self.sampled,
+            "duplicates": self.duplicates,
+            "encoded": self.encoded,
+            "missed_deadlines": self.missed_deadlines,
+            "avg_hash_ms": self.hash_ms_total / self.sampled if self.sampled else 0.0,
+            "elapsed_s": elapsed,
+            "bytes": size,
+        }
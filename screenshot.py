@@ -1,17 +1,22 @@
 import sys
 import os
+import time
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
-import mss
 # import numpy as np
-from PIL import Image
 # import subprocess
 import win32con
 import win32gui
 import ctypes
 from ctypes import wintypes  # 确保 wintypes 可以正确导入
-from screenshot_editor import edit_screenshot
+from screenshot_editor import ScreenshotEditor, edit_screenshot, open_document
+from annotation_document import DOCUMENT_EXT
+from capture_service import CaptureService
+from save_queue import default_save_queue, output_filename
+from burst_capture import BurstCapture
+from screen_recorder import ScreenRecorder
+from capture_trace import NULL_TRACE, default_tracer
 def print_help():
     """打印帮助信息"""
     print("=== 多屏幕截图工具 ===")
@@ -21,11 +26,16 @@ def print_help():
     print("3. 松开鼠标按钮完成截图")
     print("4. 截图将自动保存到 output 文件夹中并复制到剪贴板")
     print("5. 按 ESC 键取消当前截图，程序继续在后台运行")
-    print("6. 鼠标移动到不同屏幕自动切换活动屏幕")
+    print("6. 鼠标移动到不同屏幕自动切换活动屏幕，选区可以跨越多个屏幕")
     print("7. 按 H 键显示此帮助信息")
     print("8. 按 C 键取消当前选择")
     print("9. 右键点击系统托盘图标可以退出程序")
     print("10. 按下 Ctrl+W 开始编辑截图，截图后可以添加矩形、文字和马赛克等")
+    print("11. 截图时按 A 键截取所有屏幕组成的整个桌面")
+    print("12. 按下 Ctrl+B 选择区域开始连拍，再次按下 Ctrl+B 停止，帧保存在 output/burst_* 文件夹中")
+    print("13. 按下 Ctrl+R 选择区域开始录屏，再次按下 Ctrl+R 停止，保存为 GIF（可改为 APNG/WebP）")
+    print("14. 编辑后的标注会另存为 .shotdoc 标注文档，可在托盘菜单中选择“打开标注文档”继续编辑")
+    print("15. 编辑时按住 Ctrl 滚动滚轮缩放，滚轮或按住中键拖动平移，Ctrl+0 适应窗口，Ctrl+1 原始大小")
     print("====================")
 
 class MouseTracker(QWidget):
@@ -83,9 +93,12 @@ class MouseTracker(QWidget):
                 break
 
 class ScreenOverlay(QWidget):
-    def __init__(self, screen_number, screen_geometry, is_active=True):
+    def __init__(self, screen_number, screen_geometry, is_active=True, background=None):
         super().__init__()
         self.screen_number = screen_number
+        self.screen_geometry = screen_geometry
+        # 冻结模式下热键按下时抓取的屏幕画面，作为遮罩背景
+        self.background = background
         self.setGeometry(screen_geometry)
         self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
         self.setAttribute(Qt.WA_TranslucentBackground)
@@ -112,7 +125,7 @@ class ScreenOverlay(QWidget):
         
         # 添加快捷键提示
         self.keys_label = QLabel(self)
-        self.keys_label.setText("ESC: 退出截图 | H: 帮助 | C: 取消选择")
+        self.keys_label.setText("ESC: 退出截图 | H: 帮助 | C: 取消选择 | A: 整个桌面")
         self.keys_label.setStyleSheet("color: #AAAAAA; background-color: rgba(0, 0, 0, 150); padding: 5px;")
         self.keys_label.move(screen_geometry.width() - 250, screen_geometry.height() - 30)
         self.keys_label.adjustSize()
@@ -150,29 +163,68 @@ class ScreenOverlay(QWidget):
         self.coords_label.setText(f"屏幕坐标: ({mouse_pos.x()}, {mouse_pos.y()}) | 全局坐标: ({global_x}, {global_y})")
         self.coords_label.adjustSize()
     
+    def background_source_rect(self, rect):
+        """把窗口坐标中的矩形换算为背景画面中的矩形（两者分辨率可能不同）"""
+        sx = self.background.width() / max(self.width(), 1)
+        sy = self.background.height() / max(self.height(), 1)
+        return QRectF(rect.x() * sx, rect.y() * sy, rect.width() * sx, rect.height() * sy)
+    
     def paintEvent(self, event):
+        if self.parent_app is not None:
+            self.parent_app.trace.mark("overlay_shown")
         painter = QPainter(self)
         
+        # 冻结模式下先绘制静态画面
+        if self.background is not None:
+            painter.drawImage(QRectF(self.rect()), self.background, QRectF(self.background.rect()))
+        
         # 绘制半透明背景
         painter.fillRect(self.rect(), QColor(0, 0, 0, 100))
             
-        # 如果正在绘制选择框
-        if self.drawing and not self.begin.isNull() and not self.end.isNull():
+        # 选区以全局坐标保存在父应用中，所有屏幕的遮罩各自绘制与本屏幕相交的部分
+        selected_rect = self.local_selection_rect()
+        if selected_rect is not None:
             # 绘制选定区域 (透明)
-            selected_rect = QRect(self.begin, self.end).normalized()
-            painter.fillRect(selected_rect, QColor(255, 255, 255, 0))
+            if self.background is not None:
+                # 选区内显示未变暗的画面
+                painter.drawImage(QRectF(selected_rect), self.background, self.background_source_rect(selected_rect))
+            else:
+                painter.fillRect(selected_rect, QColor(255, 255, 255, 0))
             
             # 绘制选定区域边框
             pen = QPen(QColor(255, 0, 0), 2)
             painter.setPen(pen)
             painter.drawRect(selected_rect)
             
-            # 显示尺寸信息
-            size_text = f"{selected_rect.width()} x {selected_rect.height()}"
-            text_x = selected_rect.x() + selected_rect.width() + 5
-            text_y = selected_rect.y() + 20
-            painter.setPen(QColor(255, 255, 255))
-            painter.drawText(text_x, text_y, size_text)
+            # 显示尺寸信息（只在开始拖动的屏幕上显示）
+            if self.drawing:
+                size_text = f"{selected_rect.width()} x {selected_rect.height()}"
+                text_x = selected_rect.x() + selected_rect.width() + 5
+                text_y = selected_rect.y() + 20
+                painter.setPen(QColor(255, 255, 255))
+                painter.drawText(text_x, text_y, size_text)
+    
+    def local_selection_rect(self):
+        """返回本屏幕坐标系下的选区，没有选区时返回None"""
+        if self.drawing:
+            if self.begin.isNull() or self.end.isNull():
+                return None
+            return QRect(self.begin, self.end).normalized()
+        if self.parent_app is not None and self.parent_app.selection_rect is not None:
+            # 其他屏幕上开始的选区，转换到本屏幕坐标
+            return self.parent_app.selection_rect.translated(-self.screen_geometry.topLeft())
+        return None
+    
+    def sync_selection(self):
+        """把本屏幕上的选区转换为全局坐标共享给所有遮罩"""
+        if self.parent_app is None:
+            self.update()
+            return
+        if self.begin.isNull() or self.end.isNull():
+            self.parent_app.set_selection(None)
+        else:
+            selected_rect = QRect(self.begin, self.end).normalized()
+            self.parent_app.set_selection(selected_rect.translated(self.screen_geometry.topLeft()))
     
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
@@ -180,18 +232,20 @@ class ScreenOverlay(QWidget):
             self.begin = event.pos()
             self.end = event.pos()
             self.drawing = True
-            self.update()
+            self.sync_selection()
             print(f"开始截图选区: 起点({event.pos().x()}, {event.pos().y()})")
     
     def mouseMoveEvent(self, event):
         # 更新鼠标坐标显示，无论是否在绘制
-        # 如果正在绘制，更新选区
+        # 如果正在绘制，更新选区；拖到其他屏幕时鼠标仍被本窗口捕获，坐标可以超出本屏幕
         if self.drawing:
             self.end = event.pos()
-            self.update()
+            self.sync_selection()
     
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton and self.drawing:
+            if self.parent_app is not None:
+                self.parent_app.trace.mark("selection_released")
             self.end = event.pos()
             self.drawing = False
             selected_rect = QRect(self.begin, self.end).normalized()
@@ -220,8 +274,18 @@ class ScreenOverlay(QWidget):
             self.drawing = False
             self.begin = QPoint()
             self.end = QPoint()
-            self.update()
+            self.sync_selection()
             print("已取消当前选择")
+        elif event.key() == Qt.Key_A:
+            # 截取所有屏幕组成的整个桌面
+            desktop_rect = QApplication.primaryScreen().virtualGeometry()
+            print(f"截取整个桌面: {desktop_rect.width()}x{desktop_rect.height()}")
+            if self.parent_app is not None:
+                self.parent_app.trace.mark("selection_released")
+            self.drawing = False
+            self.begin = desktop_rect.topLeft() - self.screen_geometry.topLeft()
+            self.end = desktop_rect.bottomRight() - self.screen_geometry.topLeft()
+            self.capture_screenshot()
     
     def capture_screenshot(self):
         selected_rect = QRect(self.begin, self.end).normalized()
@@ -243,6 +307,14 @@ class ScreenOverlay(QWidget):
             self.parent_app.capture_edit_screenshot(selected_rect, screen_info)
             self.parent_app.is_editing = False  # 重置编辑标记
             return
+        elif hasattr(self.parent_app, 'is_burst') and self.parent_app.is_burst:
+            self.parent_app.start_burst(selected_rect, screen_info)
+            self.parent_app.is_burst = False  # 重置连拍标记
+            return
+        elif hasattr(self.parent_app, 'is_recording') and self.parent_app.is_recording:
+            self.parent_app.start_recording(selected_rect, screen_info)
+            self.parent_app.is_recording = False  # 重置录屏标记
+            return
         
         # 原有的普通截图逻辑
         left = selected_rect.left() + screen_info.left()
@@ -250,47 +322,32 @@ class ScreenOverlay(QWidget):
         width = selected_rect.width()
         height = selected_rect.height()
         
-        # 隐藏所有窗口以便截图
-        for widget in QApplication.topLevelWidgets():
-            if isinstance(widget, ScreenOverlay):
-                widget.hide()
-        QApplication.processEvents()
+        # 冻结模式下直接从缓存画面裁剪，否则隐藏遮罩后实时抓取
+        frame = self.parent_app.grab_region(left, top, width, height)
         
-        # 使用mss进行截图
-        with mss.mss() as sct:
-            monitor = {
-                "left": left,
-                "top": top,
-                "width": width,
-                "height": height
-            }
-            screenshot = sct.grab(monitor)
-            
-            # 保存截图
-            img = Image.frombytes("RGB", screenshot.size, screenshot.rgb)
-            
-            # 确保输出目录存在
-            if not os.path.exists("output"):
-                os.makedirs("output")
-            
-            # 生成文件名
-            import datetime
-            timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"output/screenshot_{timestamp}.png"
-            img.save(filename)
-            
-            print(f"截图已保存: {filename}")
-            print(f"截图区域: 左上角({left}, {top}), 宽x高({width}x{height})")
-            
-            # 将截图复制到剪贴板
-            try:
-                # 转换为QPixmap然后放入剪贴板
-                q_img = QImage(filename)
-                pixmap = QPixmap.fromImage(q_img)
-                QApplication.clipboard().setPixmap(pixmap)
-                print("截图已复制到剪贴板")
-            except Exception as e:
-                print(f"复制到剪贴板失败: {e}")
+        # 直接在内存中包装截图数据，不经过文件
+        # 帧缓冲区会被下一次抓取复用，复制出一份独立的像素，剪贴板和保存队列共享这份数据
+        image = frame.to_qimage().copy()
+        print(f"截图区域: 左上角({left}, {top}), 宽x高({width}x{height})")
+        
+        # 将截图复制到剪贴板
+        try:
+            # 转换为QPixmap然后放入剪贴板
+            pixmap = QPixmap.fromImage(image)
+            QApplication.clipboard().setPixmap(pixmap)
+            self.parent_app.trace.mark("clipboard_set")
+            print("截图已复制到剪贴板")
+        except Exception as e:
+            print(f"复制到剪贴板失败: {e}")
+        
+        # 保存到文件是可选的附带操作，在后台线程编码和写入
+        if self.parent_app.save_to_disk:
+            # 生成文件名，同一秒内的多次截图不会互相覆盖
+            filename = output_filename("screenshot")
+            self.parent_app.save_queue.submit(image, filename, trace=self.parent_app.trace)
+            print(f"截图已提交后台保存: {filename}")
+        else:
+            self.parent_app.trace.finish()
         
         # 关闭所有窗口，返回后台等待状态
         print("截图完成，返回后台等待")
@@ -305,28 +362,15 @@ class ScreenOverlay(QWidget):
         # 确保在窗口关闭时断开信号连接并更新父应用状态
         if self.parent_app:
             try:
-                # 检查是否是在屏幕切换过程中被关闭的
-                is_switching_screens = False
-                
-                # 获取当前鼠标位置
-                cursor_pos = QCursor.pos()
-                
-                # 如果鼠标位置不在当前屏幕内，可能是在切换屏幕
-                for i, screen in enumerate(QApplication.screens()):
-                    if (screen.geometry().contains(cursor_pos) and
-                        i != self.screen_number and
-                        self.parent_app.active_screen_index != -1):
-                        is_switching_screens = True
-                        print(f"检测到屏幕切换：从屏幕 {self.screen_number+1} 到屏幕 {i+1}")
-                        break
-                
                 # 从overlays列表中删除自己
                 if self in self.parent_app.overlays:
                     self.parent_app.overlays.remove(self)
                     print(f"从overlays列表中移除窗口, 剩余: {len(self.parent_app.overlays)}")
+                if self.parent_app.current_overlay is self:
+                    self.parent_app.current_overlay = None
                 
-                # 仅在不是屏幕切换时才断开连接和重置状态
-                if not is_switching_screens:
+                # 所有屏幕的遮罩都关闭后才断开连接和重置状态
+                if not self.parent_app.overlays:
                     print(f"窗口完全关闭，断开信号连接")
                     # 断开信号连接
                     try:
@@ -339,9 +383,9 @@ class ScreenOverlay(QWidget):
                     print(f"重置ScreenCaptureApp状态: active_screen_index={self.parent_app.active_screen_index}->{-1}")
                     self.parent_app.active_screen_index = -1
                     self.parent_app.current_overlay = None
-                else:
-                    # 如果是屏幕切换，只在日志中记录，不执行断开连接操作
-                    print(f"屏幕切换过程中，保持信号连接状态")
+                    self.parent_app.selection_rect = None
+                    # 本次截图会话结束，释放冻结的画面
+                    self.parent_app.frozen_frame = None
                 
             except (TypeError, ValueError) as e:
                 # 如果连接不存在或移除失败，忽略错误
@@ -352,6 +396,9 @@ class ScreenOverlay(QWidget):
 # 定义全局热键ID
 HOTKEY_ID = 1
 EDIT_HOTKEY_ID = 3  # 用于编辑截图的热键ID
+BURST_HOTKEY_ID = 4  # 用于连拍的热键ID
+RECORD_HOTKEY_ID = 5  # 用于录屏的热键ID
+BURST_DRAIN_TIMEOUT = 10  # 退出时等待连拍剩余帧写盘的最长秒数
 
 # 为WM_HOTKEY消息设置窗口消息过滤器
 class WinEventFilter(QWidget):
@@ -364,15 +411,39 @@ class WinEventFilter(QWidget):
     def nativeEvent(self, eventType, message):
         msg = ctypes.wintypes.MSG.from_address(int(message))
         if msg.message == win32con.WM_HOTKEY:
+            if msg.wParam in (HOTKEY_ID, EDIT_HOTKEY_ID):
+                # 追踪从热键按下开始，关闭追踪时是空对象
+                self.parent.trace = self.parent.tracer.begin("edit" if msg.wParam == EDIT_HOTKEY_ID else "screenshot")
             if msg.wParam == HOTKEY_ID:
                 # 确保在开始新截图前重置状态
                 self.parent.reset_screenshot_state()
+                # 在显示遮罩之前抓取整个桌面
+                self.parent.freeze_desktop()
                 self.parent.start_screenshot()
                 return True, 0
             elif msg.wParam == EDIT_HOTKEY_ID:  # 新增的编辑热键处理
                 self.parent.reset_screenshot_state()
+                self.parent.freeze_desktop()
                 self.parent.start_edit_screenshot()
                 return True, 0
+            elif msg.wParam == BURST_HOTKEY_ID:
+                # 连拍进行中时再次按下热键停止连拍
+                if self.parent.burst is not None and self.parent.burst.is_running():
+                    self.parent.stop_burst()
+                else:
+                    self.parent.reset_screenshot_state()
+                    self.parent.freeze_desktop()
+                    self.parent.start_burst_screenshot()
+                return True, 0
+            elif msg.wParam == RECORD_HOTKEY_ID:
+                # 录屏进行中时再次按下热键停止录屏
+                if self.parent.recorder is not None and self.parent.recorder.is_running():
+                    self.parent.stop_recording()
+                else:
+                    self.parent.reset_screenshot_state()
+                    self.parent.freeze_desktop()
+                    self.parent.start_record_screenshot()
+                return True, 0
         return False, 0
 
 class ScreenCaptureApp(QWidget):
@@ -381,6 +452,10 @@ class ScreenCaptureApp(QWidget):
         self.setWindowTitle("屏幕截图工具")
         self.setWindowFlags(Qt.WindowStaysOnTopHint)
         
+        # 各阶段延迟追踪，设置环境变量 SCREENSHOT_TRACE=1 或在托盘菜单中开启
+        self.tracer = default_tracer()
+        self.trace = NULL_TRACE  # 当前截图的追踪
+        
         # 初始化UI
         self.init_ui()
         
@@ -401,9 +476,17 @@ class ScreenCaptureApp(QWidget):
         
         print(f"检测到 {len(self.screens)} 个显示器")
         
+        # 常驻截图服务，只在屏幕拓扑变化时重建
+        self.capture_service = CaptureService()
+        self.app.screenAdded.connect(self.on_screen_topology_changed)
+        self.app.screenRemoved.connect(self.on_screen_topology_changed)
+        for screen in self.screens:
+            screen.geometryChanged.connect(self.on_screen_topology_changed)
+        
         # 初始状态下没有活动屏幕
         self.active_screen_index = -1
         self.current_overlay = None
+        self.selection_rect = None  # 全局坐标下的选区，可以跨越多个屏幕
         
         # 创建事件过滤器
         self.event_filter = WinEventFilter(self)
@@ -418,7 +501,31 @@ class ScreenCaptureApp(QWidget):
         self.floating_window = None  # 添加浮动窗口引用
         
         self.is_editing = False  # 添加编辑模式标记
-        self.screenshot_editor = None  # 截图编辑器引用
+        
+        self.is_burst = False  # 连拍模式标记
+        self.burst = None  # 当前的连拍任务
+        self.burst_fps = 10  # 连拍目标帧率
+        self.burst_capacity = 64  # 连拍环形缓冲区的帧数
+        
+        self.is_recording = False  # 录屏模式标记
+        self.recorder = None  # 当前的录屏任务
+        self.record_fps = 10  # 录屏采样帧率
+        self.record_format = "gif"  # 录屏格式: gif / png (APNG) / webp
+        
+        self.save_to_disk = True  # 截图是否同时保存到output文件夹
+        
+        # 后台保存队列，PNG编码和写盘不占用GUI线程
+        self.save_queue = default_save_queue()
+        self.save_queue.saved.connect(self.on_image_saved)
+        self.save_queue.failed.connect(self.on_image_save_failed)
+        
+        # 常驻的截图编辑器，启动时创建并预热，每次编辑截图只载入新图像，不重建窗口和工具栏
+        self.screenshot_editor = ScreenshotEditor()
+        self.screenshot_editor.editingFinished.connect(self.on_screenshot_edited)
+        
+        # 冻结画面模式：热键按下时先抓取整个桌面，遮罩显示该画面，选区直接从内存裁剪
+        self.use_frozen_frame = True
+        self.frozen_frame = None  # 当前截图会话冻结的桌面画面
     
     def init_ui(self):
         # 创建系统托盘图标
@@ -433,6 +540,22 @@ class ScreenCaptureApp(QWidget):
         screenshot_action.triggered.connect(self.start_screenshot)
         tray_menu.addAction(screenshot_action)
         
+        # 重新打开之前保存的标注文档继续编辑
+        open_document_action = QAction("打开标注文档", self)
+        open_document_action.triggered.connect(self.open_annotation_document)
+        tray_menu.addAction(open_document_action)
+        
+        # 延迟追踪开关和统计输出
+        trace_action = QAction("记录延迟", self)
+        trace_action.setCheckable(True)
+        trace_action.setChecked(self.tracer.enabled)
+        trace_action.toggled.connect(self.set_tracing)
+        tray_menu.addAction(trace_action)
+        
+        trace_dump_action = QAction("输出延迟统计", self)
+        trace_dump_action.triggered.connect(self.tracer.dump)
+        tray_menu.addAction(trace_dump_action)
+        
         # 添加帮助动作
         help_action = QAction("帮助", self)
         help_action.triggered.connect(print_help)
@@ -464,6 +587,32 @@ class ScreenCaptureApp(QWidget):
         painter.end()
         return icon
     
+    def set_tracing(self, enabled):
+        """开启或关闭延迟追踪"""
+        self.tracer.enabled = enabled
+        print("延迟追踪已" + ("开启" if enabled else "关闭"))
+    
+    def on_image_saved(self, filename):
+        """后台保存完成"""
+        print(f"截图已保存: {filename}")
+    
+    def on_image_save_failed(self, filename, error):
+        """后台保存失败"""
+        print(f"保存截图失败: {filename} - {error}")
+    
+    def on_screen_topology_changed(self, *args):
+        """屏幕增减或分辨率、位置变化时重建截图服务"""
+        print("检测到屏幕布局变化，重建截图服务")
+        self.screens = QApplication.screens()
+        for screen in self.screens:
+            # 新增的屏幕也需要监听几何变化，先断开避免重复连接
+            try:
+                screen.geometryChanged.disconnect(self.on_screen_topology_changed)
+            except TypeError:
+                pass
+            screen.geometryChanged.connect(self.on_screen_topology_changed)
+        self.capture_service.rebuild()
+    
     def tray_icon_activated(self, reason):
         if reason == QSystemTrayIcon.DoubleClick:
             self.start_screenshot()
@@ -485,56 +634,46 @@ class ScreenCaptureApp(QWidget):
             print("注册全局热键Ctrl+W失败")
         else:
             print("已注册全局热键: Ctrl+W (用于浮动截图)")
+        
+        # 注册Ctrl+B全局热键
+        if not win32gui.RegisterHotKey(hwnd, BURST_HOTKEY_ID, win32con.MOD_CONTROL, ord('B')):
+            print("注册全局热键Ctrl+B失败")
+        else:
+            print("已注册全局热键: Ctrl+B (用于连拍)")
+        
+        # 注册Ctrl+R全局热键
+        if not win32gui.RegisterHotKey(hwnd, RECORD_HOTKEY_ID, win32con.MOD_CONTROL, ord('R')):
+            print("注册全局热键Ctrl+R失败")
+        else:
+            print("已注册全局热键: Ctrl+R (用于录屏)")
     
     def update_active_screen(self):
-        # 此方法仅在已经开始截图时使用，用于在截图过程中切换屏幕
+        # 此方法仅在已经开始截图时使用，每个屏幕都有遮罩，这里只切换接收键盘输入的活动遮罩
         if self.current_overlay is not None:
+            # 拖动选区时保持原来的遮罩，避免打断跨屏选择
+            if any(overlay.drawing for overlay in self.overlays):
+                return
             # 获取当前鼠标位置
             cursor_pos = QCursor.pos()
             # 查找鼠标所在的屏幕
-            for i, screen in enumerate(self.screens):
-                if screen.geometry().contains(cursor_pos):
-                    # 如果鼠标移动到了不同的屏幕，更新遮罩
-                    if i != self.active_screen_index:
-                        print(f"鼠标移动到屏幕 {i+1}, 切换活动屏幕 {self.active_screen_index+1}->{i+1}")
-                        
-                        # 先保存当前屏幕索引
-                        old_screen_index = self.active_screen_index
-                        
-                        # 更新屏幕索引，确保在关闭旧窗口前已更新
-                        self.active_screen_index = i
-                        
-                        # 关闭当前遮罩
-                        if self.current_overlay:
-                            print(f"关闭屏幕 {old_screen_index+1} 的遮罩")
-                            old_overlay = self.current_overlay
-                            self.current_overlay = None  # 先置空，避免引用问题
-                            old_overlay.close()
-                            # 不需要在这里移除，closeEvent会处理
-                        
-                        # 强制处理事件，确保旧窗口完全关闭
-                        QApplication.processEvents()
-                        
-                        # 为新的屏幕创建遮罩
-                        geometry = screen.geometry()
-                        print(f"创建屏幕 {i+1} 的新遮罩")
-                        self.current_overlay = ScreenOverlay(i, geometry, True)
-                        self.overlays.append(self.current_overlay)
-                        
-                        # 确保窗口显示并处于最前端
-                        self.current_overlay.showFullScreen()
-                        self.current_overlay.raise_()  # 提升窗口Z顺序到最前
-                        self.current_overlay.activateWindow()  # 提高窗口优先级
-                        
-                        # 强制重绘窗口
-                        self.current_overlay.update()
-                        
-                        # 强制处理一次事件
-                        QApplication.processEvents()
-                        
-                        print(f"激活屏幕 {i+1} 用于截图 - 鼠标位置: ({cursor_pos.x()}, {cursor_pos.y()})")
+            for overlay in self.overlays:
+                if overlay.screen_geometry.contains(cursor_pos):
+                    # 如果鼠标移动到了不同的屏幕，激活该屏幕的遮罩
+                    if overlay is not self.current_overlay:
+                        print(f"鼠标移动到屏幕 {overlay.screen_number+1}, 切换活动屏幕 {self.active_screen_index+1}->{overlay.screen_number+1}")
+                        self.active_screen_index = overlay.screen_number
+                        self.current_overlay = overlay
+                        overlay.raise_()
+                        overlay.activateWindow()
+                        print(f"激活屏幕 {overlay.screen_number+1} 用于截图 - 鼠标位置: ({cursor_pos.x()}, {cursor_pos.y()})")
                     break
     
+    def set_selection(self, rect):
+        """更新全局坐标下的选区并重绘所有屏幕的遮罩"""
+        self.selection_rect = rect
+        for overlay in self.overlays:
+            overlay.update()
+    
     def reset_screenshot_state(self):
         """重置所有截图相关状态，强制清理所有资源"""
         print("强制重置截图状态...")
@@ -567,14 +706,13 @@ class ScreenCaptureApp(QWidget):
             except Exception as e:
                 print(f"关闭浮动窗口时出错: {e}")
         
-        # 关闭截图编辑器（如果存在）
-        if hasattr(self, 'screenshot_editor') and self.screenshot_editor is not None:
+        # 隐藏截图编辑器（如果正在显示），编辑器常驻，下次截图时复用
+        if self.screenshot_editor.isVisible():
             try:
-                print("关闭遗留的截图编辑器")
+                print("隐藏遗留的截图编辑器")
                 self.screenshot_editor.close()
-                self.screenshot_editor = None
             except Exception as e:
-                print(f"关闭截图编辑器时出错: {e}")
+                print(f"隐藏截图编辑器时出错: {e}")
         
         # 重置浮动截图模式
         self.is_floating = False
@@ -582,12 +720,59 @@ class ScreenCaptureApp(QWidget):
         # 重置编辑模式
         self.is_editing = False
         
+        # 重置连拍模式（已经在进行的连拍不受影响）
+        self.is_burst = False
+        
+        # 重置录屏模式（已经在进行的录屏不受影响）
+        self.is_recording = False
+        
         # 重置状态变量
         self.active_screen_index = -1
         self.current_overlay = None
         self.overlays = []
+        self.selection_rect = None
+        self.frozen_frame = None
         print("截图状态已重置")
     
+    def freeze_desktop(self):
+        """冻结画面模式下，在显示遮罩之前抓取整个虚拟桌面"""
+        if not self.use_frozen_frame:
+            return
+        try:
+            self.frozen_frame = self.capture_service.grab_desktop()
+            print(f"已冻结桌面画面: {self.frozen_frame.width}x{self.frozen_frame.height}")
+        except Exception as e:
+            # 抓取失败时退回到实时抓取
+            print(f"冻结桌面画面失败: {e}")
+            self.frozen_frame = None
+    
+    def frozen_background(self, geometry):
+        """返回冻结画面中对应屏幕的部分，作为遮罩背景；未冻结时返回None"""
+        if self.frozen_frame is None:
+            return None
+        frame = self.frozen_frame.crop(geometry.left(), geometry.top(), geometry.width(), geometry.height())
+        return frame.to_qimage() if frame is not None else None
+    
+    def grab_region(self, left, top, width, height):
+        """抓取全局区域：冻结模式下从缓存画面零复制裁剪，否则隐藏遮罩后实时抓取"""
+        if self.frozen_frame is not None:
+            frame = self.frozen_frame.crop(left, top, width, height)
+            if frame is not None:
+                self.trace.mark("grab_done")
+                return frame
+        
+        # 隐藏所有窗口以便截图
+        for widget in QApplication.topLevelWidgets():
+            if isinstance(widget, ScreenOverlay):
+                widget.hide()
+        QApplication.processEvents()
+        self.trace.mark("overlays_hidden")
+        
+        # 使用常驻的截图服务进行截图
+        frame = self.capture_service.grab(left, top, width, height)
+        self.trace.mark("grab_done")
+        return frame
+    
     def start_screenshot(self):
         print("开始截图操作...")
         
@@ -603,47 +788,50 @@ class ScreenCaptureApp(QWidget):
         # 获取当前鼠标位置
         cursor_pos = QCursor.pos()
         
-        # 查找鼠标所在的屏幕
+        # 为每个屏幕创建遮罩，选区可以跨越多个屏幕
         for i, screen in enumerate(self.screens):
-            if screen.geometry().contains(cursor_pos):
+            geometry = screen.geometry()
+            print(f"创建屏幕 {i+1} 的遮罩: 位置({geometry.left()}, {geometry.top()}), 大小({geometry.width()}x{geometry.height()})")
+            overlay = ScreenOverlay(i, geometry, True, self.frozen_background(geometry))
+            self.overlays.append(overlay)
+            overlay.showFullScreen()
+            
+            # 鼠标所在的屏幕作为活动屏幕
+            if geometry.contains(cursor_pos):
                 self.active_screen_index = i
+                self.current_overlay = overlay
                 print(f"鼠标当前在屏幕 {i+1} 上，位置: ({cursor_pos.x()}, {cursor_pos.y()})")
+        
+        if self.current_overlay is not None:
+            # 确保活动窗口处于最前端
+            self.current_overlay.raise_()
+            self.current_overlay.activateWindow()
+            
+            # 强制重绘和处理事件
+            self.current_overlay.update()
+            QApplication.processEvents()
+            
+            print(f"当前活动窗口数量: {len(self.overlays)}")
+            
+            # 开始截图后，连接鼠标跟踪器信号以允许在不同屏幕间切换
+            try:
+                # 先尝试断开以防止重复连接
+                print("尝试断开已有的信号连接...")
+                # 正确的disconnect方法用法：
+                self.mouse_tracker.timer.timeout.disconnect(self.update_active_screen)
+            except TypeError:
+                print("没有已存在的信号连接")
+                pass  # 如果没有连接，忽略错误
                 
-                # 创建并显示遮罩
-                geometry = screen.geometry()
-                print(f"创建屏幕 {i+1} 的遮罩: 位置({geometry.left()}, {geometry.top()}), 大小({geometry.width()}x{geometry.height()})")
-                self.current_overlay = ScreenOverlay(i, geometry, True)
-                self.overlays.append(self.current_overlay)
-                
-                # 确保窗口显示并处于最前端
-                self.current_overlay.showFullScreen()
-                self.current_overlay.raise_()
-                self.current_overlay.activateWindow()
-                
-                # 强制重绘和处理事件
-                self.current_overlay.update()
-                QApplication.processEvents()
-                
-                print(f"当前活动窗口数量: {len(self.overlays)}")
-                
-                # 开始截图后，连接鼠标跟踪器信号以允许在不同屏幕间切换
-                try:
-                    # 先尝试断开以防止重复连接
-                    print("尝试断开已有的信号连接...")
-                    # 正确的disconnect方法用法：
-                    self.mouse_tracker.timer.timeout.disconnect(self.update_active_screen)
-                except TypeError:
-                    print("没有已存在的信号连接")
-                    pass  # 如果没有连接，忽略错误
-                    
-                # 连接信号
-                print("连接鼠标跟踪器与update_active_screen")
-                self.mouse_tracker.timer.timeout.connect(self.update_active_screen)
-                break
+            # 连接信号
+            print("连接鼠标跟踪器与update_active_screen")
+            self.mouse_tracker.timer.timeout.connect(self.update_active_screen)
         
         # 如果没有找到屏幕
         if self.current_overlay is None:
             print("未能找到鼠标所在的屏幕，截图操作取消")
+            for overlay in list(self.overlays):
+                overlay.close()
     
     def start_floating_screenshot(self):
         """开始浮动截图操作"""
@@ -659,71 +847,148 @@ class ScreenCaptureApp(QWidget):
         self.is_editing = True  # 标记为编辑模式
         self.start_screenshot()
 
+    def start_burst_screenshot(self):
+        """选择区域后开始连拍"""
+        print("开始连拍截图操作...")
+        self.is_burst = True  # 标记为连拍模式
+        self.start_screenshot()
+    
+    def start_burst(self, selected_rect, screen_info):
+        """关闭遮罩后按目标帧率连续抓取选定区域"""
+        left = selected_rect.left() + screen_info.left()
+        top = selected_rect.top() + screen_info.top()
+        width = selected_rect.width()
+        height = selected_rect.height()
+        
+        # 连拍抓取的是实时画面，先关闭所有遮罩
+        for widget in QApplication.topLevelWidgets():
+            if isinstance(widget, ScreenOverlay):
+                widget.close()
+        QApplication.processEvents()
+        
+        directory = os.path.splitext(output_filename("burst"))[0]
+        self.burst = BurstCapture(self.capture_service, self.save_queue, left, top, width, height,
+                                  fps=self.burst_fps, capacity=self.burst_capacity,
+                                  directory=directory, parent=self)
+        self.burst.finished.connect(self.on_burst_finished)
+        self.burst.start()
+        print(f"连拍开始: 区域({left}, {top}, {width}x{height}), 目标 {self.burst_fps} fps, "
+              f"缓冲 {self.burst.ring.capacity} 帧, 保存到 {directory}")
+        print("再次按下 Ctrl+B 停止连拍")
+    
+    def stop_burst(self):
+        """停止连拍，剩余的帧在后台继续写盘"""
+        if self.burst is None:
+            return
+        self.burst.stop()
+        stats = self.burst.stats()
+        print(f"连拍已停止: 抓取 {stats['captured']} 帧, 实际 {stats['achieved_fps']:.1f} fps, "
+              f"等待写盘 {self.burst.ring.unflushed()} 帧")
+    
+    def on_burst_finished(self, stats):
+        """连拍的所有帧都已交给保存队列"""
+        print(f"连拍完成: 目标 {stats['target_fps']} fps, 实际 {stats['achieved_fps']:.1f} fps, "
+              f"保存 {stats['flushed']} 帧, 丢弃 {stats['dropped']} 帧 "
+              f"(错过定时 {stats['missed_deadlines']}, 写盘前被覆盖 {stats['overwritten']}), "
+              f"平均抓取 {stats['avg_grab_ms']:.1f}ms")
+        self.burst = None
+    
+    def start_record_screenshot(self):
+        """选择区域后开始录屏"""
+        print("开始录屏截图操作...")
+        self.is_recording = True  # 标记为录屏模式
+        self.start_screenshot()
+    
+    def start_recording(self, selected_rect, screen_info):
+        """关闭遮罩后按采样帧率录制选定区域"""
+        left = selected_rect.left() + screen_info.left()
+        top = selected_rect.top() + screen_info.top()
+        width = selected_rect.width()
+        height = selected_rect.height()
+        
+        # 录制的是实时画面，先关闭所有遮罩
+        for widget in QApplication.topLevelWidgets():
+            if isinstance(widget, ScreenOverlay):
+                widget.close()
+        QApplication.processEvents()
+        
+        filename = output_filename("record", ext=self.record_format)
+        self.recorder = ScreenRecorder(self.capture_service, filename, left, top, width, height,
+                                       fps=self.record_fps, parent=self)
+        self.recorder.finished.connect(self.on_recording_finished)
+        self.recorder.failed.connect(self.on_recording_failed)
+        self.recorder.start()
+        print(f"录屏开始: 区域({left}, {top}, {width}x{height}), 采样 {self.record_fps} fps, 保存到 {filename}")
+        print("再次按下 Ctrl+R 停止录屏")
+    
+    def stop_recording(self):
+        """停止录屏，剩余的帧在后台继续编码"""
+        if self.recorder is None:
+            return
+        self.recorder.stop()
+        print("录屏已停止，正在写入文件...")
+    
+    def on_recording_finished(self, stats):
+        """录屏文件已写完"""
+        print(f"录屏完成: {stats['path']}, 时长 {stats['elapsed_s']:.1f}s, 采样 {stats['sampled']} 帧 "
+              f"(实际 {stats['achieved_fps']:.1f} fps), 重复帧 {stats['duplicates']}, "
+              f"编码 {stats['encoded']} 帧, 错过定时 {stats['missed_deadlines']}, "
+              f"文件大小 {stats['bytes'] / 1024:.1f}KB")
+        self.recorder = None
+    
+    def on_recording_failed(self, error):
+        print(error)
+        self.recorder = None
+    
     def capture_edit_screenshot(self, selected_rect, screen_info):
         """执行编辑截图操作"""
         try:
             print("开始执行编辑截图...")
-            # 隐藏所有窗口以便截图
-            for widget in QApplication.topLevelWidgets():
-                if isinstance(widget, ScreenOverlay):
-                    widget.hide()
-            QApplication.processEvents()
             
-            # 使用mss进行截图
-            with mss.mss() as sct:
-                # 计算截图区域
-                monitor = {
-                    "left": selected_rect.left() + screen_info.left(),
-                    "top": selected_rect.top() + screen_info.top(),
-                    "width": selected_rect.width(),
-                    "height": selected_rect.height()
-                }
+            # 计算截图区域
+            left = selected_rect.left() + screen_info.left()
+            top = selected_rect.top() + screen_info.top()
+            width = selected_rect.width()
+            height = selected_rect.height()
+            
+            print(f"截图区域: 左上角({left}, {top}), 宽x高({width}x{height})")
+            
+            try:
+                # 冻结模式下直接从缓存画面裁剪，否则隐藏遮罩后实时抓取
+                frame = self.grab_region(left, top, width, height)
                 
-                print(f"截图区域: 左上角({monitor['left']}, {monitor['top']}), 宽x高({monitor['width']}x{monitor['height']})")
+                # 确保截图数据有效
+                if frame.width <= 0 or frame.height <= 0:
+                    print(f"截图大小无效: {frame.width}x{frame.height}")
+                    return
                 
-                try:
-                    # 抓取屏幕
-                    screenshot = sct.grab(monitor)
-                    
-                    # 确保截图数据有效
-                    if screenshot.size[0] <= 0 or screenshot.size[1] <= 0:
-                        print(f"截图大小无效: {screenshot.size}")
-                        return
-                    
-                    print(f"成功抓取屏幕，图像大小: {screenshot.size[0]}x{screenshot.size[1]}")
-                    
-                    # 转换截图为PIL图像
-                    img = Image.frombytes("RGB", screenshot.size, screenshot.rgb)
-                    
-                    # 临时保存文件，确保图像数据正确
-                    if not os.path.exists("output"):
-                        os.makedirs("output")
-                    
-                    # 生成临时文件名
-                    import datetime
-                    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-                    temp_filename = f"output/edit_{timestamp}.png"
-                    img.save(temp_filename)
-                    print(f"临时文件已保存: {temp_filename}")
+                print(f"成功抓取屏幕，图像大小: {frame.width}x{frame.height}")
+                
+                # 直接从内存中的BGRA数据创建QPixmap，不经过临时文件
+                # 帧缓冲区会被下一次抓取复用，编辑器和保存队列共享一份独立的像素
+                image = frame.to_qimage().copy()
+                pixmap = QPixmap.fromImage(image)
+                
+                # 保存原始截图是可选的附带操作，在后台线程编码和写入
+                if self.save_to_disk:
+                    temp_filename = output_filename("edit")
+                    self.save_queue.submit(image, temp_filename)
+                    print(f"原始截图已提交后台保存: {temp_filename}")
+                
+                if not pixmap.isNull() and pixmap.width() > 0 and pixmap.height() > 0:
+                    print(f"创建有效的QPixmap: {pixmap.width()}x{pixmap.height()}")
                     
-                    # 使用保存的文件创建QPixmap
-                    pixmap = QPixmap(temp_filename)
+                    # 在常驻的编辑器中载入截图并显示，传递截图的原始位置
+                    screen_pos = QPoint(left, top)
+                    edit_screenshot(pixmap, screen_pos, self.screenshot_editor)
+                    self.trace.mark("editor_shown")
+                    self.trace.finish()
                     
-                    if not pixmap.isNull() and pixmap.width() > 0 and pixmap.height() > 0:
-                        print(f"创建有效的QPixmap: {pixmap.width()}x{pixmap.height()}")
-                        
-                        # 创建并显示编辑器，传递截图的原始位置
-                        screen_pos = QPoint(monitor['left'], monitor['top'])
-                        self.screenshot_editor = edit_screenshot(pixmap, screen_pos)
-                        
-                        # 连接编辑完成信号
-                        self.screenshot_editor.editingFinished.connect(self.on_screenshot_edited)
-                        
-                        print("启动截图编辑器")
-                    else:
-                        print(f"无法创建有效的QPixmap，大小: {pixmap.width()}x{pixmap.height()}")
-                except Exception as e:
-                    print(f"截图过程中出错: {e}")
+                    print("启动截图编辑器")
+                else:
+                    print(f"无法创建有效的QPixmap，大小: {pixmap.width()}x{pixmap.height()}")
+            except Exception as e:
+                print(f"截图过程中出错: {e}")
         except Exception as e:
             print(f"编辑截图操作失败: {e}")
         finally:
@@ -734,31 +999,39 @@ class ScreenCaptureApp(QWidget):
             
             print("编辑截图操作完成")
 
+    def open_annotation_document(self):
+        """选择一个标注文档，在编辑器中继续编辑"""
+        path, _ = QFileDialog.getOpenFileName(
+            None,
+            "打开标注文档",
+            os.path.abspath("output"),
+            f"标注文档 (*{DOCUMENT_EXT})"
+        )
+        if not path:
+            return
+        try:
+            open_document(path, editor=self.screenshot_editor)
+        except Exception as e:
+            print(f"打开标注文档失败: {e}")
+            return
+        print(f"已打开标注文档: {path}")
+
     def on_screenshot_edited(self, edited_pixmap):
         """当截图编辑完成时调用"""
         print("截图编辑完成")
         
-        # 保存编辑后的图片
-        if not os.path.exists("output"):
-            os.makedirs("output")
+        # 在后台线程保存编辑后的图片
+        filename = output_filename("edited")
+        self.save_queue.submit(edited_pixmap, filename)
         
-        # 生成文件名
-        import datetime
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"output/edited_{timestamp}.png"
-        edited_pixmap.save(filename)
-        
-        print(f"编辑后的截图已保存: {filename}")
+        print(f"编辑后的截图已提交后台保存: {filename}")
         
         # 将截图复制到剪贴板
         QApplication.clipboard().setPixmap(edited_pixmap)
         print("编辑后的截图已复制到剪贴板")
         
-        # 重置编辑模式
+        # 重置编辑模式，编辑器保留，下次截图时复用
         self.is_editing = False
-        
-        # 清除编辑器引用，确保下次重新创建
-        self.screenshot_editor = None
 
     def quit_app(self):
         print("退出程序")
@@ -767,9 +1040,42 @@ class ScreenCaptureApp(QWidget):
             hwnd = int(self.event_filter.winId())
             win32gui.UnregisterHotKey(hwnd, HOTKEY_ID)
             win32gui.UnregisterHotKey(hwnd, EDIT_HOTKEY_ID)  # 注销Ctrl+R热键
+            win32gui.UnregisterHotKey(hwnd, BURST_HOTKEY_ID)  # 注销Ctrl+B热键
+            win32gui.UnregisterHotKey(hwnd, RECORD_HOTKEY_ID)  # 注销Ctrl+R热键
         except:
             pass
         
+        # 停止连拍，把环形缓冲区中剩余的帧交给保存队列
+        burst = self.burst
+        if burst is not None:
+            burst.stop()
+            # 保存队列卡住时最多等待BURST_DRAIN_TIMEOUT秒，不能让程序无法退出
+            deadline = time.monotonic() + BURST_DRAIN_TIMEOUT
+            while burst.ring.unflushed() > 0 and time.monotonic() < deadline:
+                burst.flush()
+                time.sleep(0.01)
+            burst.flush()
+            if burst.ring.unflushed() > 0:
+                print(f"连拍还有 {burst.ring.unflushed()} 帧未写盘，放弃等待")
+        
+        # 停止录屏并等待文件写完
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.stop()
+            recorder.wait()
+        
+        # 等待后台保存队列写完所有截图
+        pending = self.save_queue.pending()
+        if pending:
+            print(f"等待 {pending} 个截图保存完成...")
+        self.save_queue.shutdown(wait=True)
+        
+        if self.tracer.enabled:
+            self.tracer.dump()
+        
+        # 释放截图句柄
+        self.capture_service.close()
+        
         # 关闭所有窗口
         for widget in QApplication.topLevelWidgets():
             widget.close()
@@ -5,6 +5,37 @@ import os
 import sys
 import math
 import datetime
+from save_queue import default_save_queue, output_filename
+from annotations import AnnotationStore
+from annotation_document import AnnotationDocument, DOCUMENT_EXT, document_index, write_document
+from edit_history import EditHistory, AddShape, ChangeShape, ClearShapes
+from spatial_index import GridIndex
+from image_effects import MosaicPreview, BlurPreview
+from annotation_renderer import AnnotationRenderer, draw_annotation, draw_shape
+from render_scheduler import RenderScheduler
+from editor_canvas import EditorCanvas
+
+class TextInputOverlay(QWidget):
+    """覆盖在画布上的透明层，只绘制正在输入的文本、预编辑文本和光标
+
+    文本变化或光标闪烁时只重绘变化的矩形，那部分底图直接取自画布缓存的图块
+    """
+    
+    def __init__(self, editor, parent):
+        super().__init__(parent)
+        self.editor = editor
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setAttribute(Qt.WA_NoSystemBackground)
+    
+    def paintEvent(self, event):
+        if not self.editor.is_text_input:
+            return
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setClipRegion(event.region() & QRegion(self.editor.canvas.view_rect()))
+        painter.setTransform(self.editor.canvas.image_transform())
+        self.editor.drawTextInput(painter)
+        painter.end()
 
 class ScreenshotEditor(QWidget):
     """用于编辑截图的窗口，提供各种编辑工具"""
@@ -12,15 +43,20 @@ class ScreenshotEditor(QWidget):
     # 定义一个信号，用于通知截图编辑完成
     editingFinished = pyqtSignal(QPixmap)
     
+    BORDER_WIDTH = 2  # 图像四周蓝色边框的宽度，边框由画布绘制，不属于图像
+    
     def __init__(self, pixmap=None, screen_pos=None):
         super().__init__()
         self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
         
-        # 保存原始图像和当前编辑的图像
-        self.original_pixmap = pixmap
+        # 保存原始图像，标注的坐标都是原始图像坐标；图像由load载入
+        self.original_pixmap = None
+        
+        # 显示在标注下面的底图，与原始图像共享像素，不复制
+        self.current_pixmap = None
         
-        # 编辑时添加蓝色边框
-        self.current_pixmap = self.addBorderToPixmap(pixmap) if pixmap else QPixmap(800, 600)
+        # 标注的显示和导出都由渲染器绘制；马赛克和模糊不修改图像，每次绘制时从原始像素渲染，结果有缓存
+        self.renderer = AnnotationRenderer()
         
         # 编辑状态
         self.is_drawing = False
@@ -33,15 +69,28 @@ class ScreenshotEditor(QWidget):
         self.pen_width = 2
         self.text_font = QFont("SimSun", 12)  # 使用宋体作为默认字体支持中文
         self.mosaic_size = 10  # 马赛克大小
+        self.blur_radius = 10  # 模糊半径
+        self.redaction_preview = None  # 拖动马赛克或模糊选区时的实时预览
         self.text_bold = False  # 是否使用粗体
         
         # 绘制的对象
-        self.shapes = []  # 存储所有绘制的形状
+        self.shapes = AnnotationStore()  # 存储所有绘制的形状，修改后需要调用invalidateComposite
+        self.composite_exclude = -1  # 画布图块中不包含的形状索引（正在移动或调整的形状）
+        self.composite_patches = None  # 画布图块使用的效果图像块，形状改变后重新获取
+        self.history = EditHistory()  # 撤销/重做历史
+        self.edit_before = None  # 移动或调整大小前的位置，结束时记入历史
+        self.shape_index = GridIndex()  # 形状外接矩形的空间索引，用于点击和光标检测
+        self.paint_index = GridIndex(256)  # 形状绘制范围的空间索引，画布只绘制与图块相交的形状
+        self.indexed_shapes = self.shapes  # 空间索引对应的形状存储，被整体替换时重建索引
         self.temp_text = ""  # 临时存储文本
+        self.document = None  # 从标注文档打开时对应的文档，再次保存时覆盖它
+        self.save_documents = True  # 保存、复制或关闭时同时保存标注文档，以后可以重新打开继续编辑
         
         # 文本输入相关属性
         self.is_text_input = False  # 是否在输入文本
         self.current_text = ""  # 当前正在输入的文本
+        self.preedit_text = ""  # 输入法正在组合、尚未确认的文本
+        self.text_input_rect = None  # 上次绘制的输入文本所占的矩形，文本变化时与新矩形一起重绘
         self.text_cursor_pos = 0  # 文本光标位置
         self.text_cursor_visible = True  # 文本光标是否可见
         self.text_cursor_timer = None  # 文本光标闪烁定时器
@@ -66,7 +115,18 @@ class ScreenshotEditor(QWidget):
         # 保存屏幕位置
         self.screen_pos = screen_pos
         
+        # 拖动时的重绘按显示帧合并，高回报率鼠标不会触发每秒几百次整图重绘
+        screen = QApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen else 0
+        self.render_scheduler = RenderScheduler(self.renderFrame, refresh_rate or 60, self)
+        self.pending_drag_pos = None  # 这一帧内最后一次拖动的鼠标位置，绘制时才应用
+        
+        # 窗口和工具栏只创建一次，之后每次截图通过load载入新图像
         self.initUI()
+        if pixmap is not None:
+            self.load(pixmap, screen_pos)
+        else:
+            self.prewarm()
     
     def initUI(self):
         # 创建布局
@@ -77,18 +137,16 @@ class ScreenshotEditor(QWidget):
         # 设置窗口和布局为透明背景
         self.setAttribute(Qt.WA_TranslucentBackground)
         
-        # 创建图像显示区域
-        self.image_label = QLabel()
-        self.image_label.setPixmap(self.current_pixmap)
-        self.image_label.setAlignment(Qt.AlignCenter)
-        self.image_label.setMouseTracking(True)
-        self.image_label.installEventFilter(self)
+        # 创建图像显示区域：可缩放、平移的画布，只绘制可见的部分，内容按图块缓存
+        self.canvas = EditorCanvas(self.drawTile, self.drawBelowTiles, self.drawAboveTiles, self.BORDER_WIDTH)
+        self.canvas.setMouseTracking(True)
+        self.canvas.installEventFilter(self)
         
-        # 设置图像标签的尺寸策略，确保图像不会被拉伸
-        self.image_label.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
-        self.image_label.setScaledContents(False)
-        # 设置图像标签的背景为透明
-        self.image_label.setStyleSheet("background-color: transparent;")
+        # 正在输入的文本和光标绘制在画布上方的透明层上，只重绘变化的部分
+        self.text_overlay = TextInputOverlay(self, self.canvas)
+        
+        # 画布的大小由视口决定，不随窗口拉伸
+        self.canvas.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
         
         # 创建一个容器部件，包含工具栏等控件
         self.controls_container = QWidget()
@@ -207,48 +265,125 @@ class ScreenshotEditor(QWidget):
         # 获取工具栏预期尺寸
         self.toolbar.adjustSize()
         toolbar_width = self.toolbar.sizeHint().width()
-        toolbar_height = self.toolbar.sizeHint().height()
-        if self.property_panel.isVisible():
-            toolbar_height += self.property_panel.height()
+        self.toolbar_height = self.toolbar.sizeHint().height()
         
         # 默认布局 - 工具栏在底部
-        main_layout.addWidget(self.image_label)
+        main_layout.addWidget(self.canvas)
         main_layout.addWidget(self.controls_container)
         
         self.setLayout(main_layout)
         
-        # 设置窗口大小
+        # 设置窗口大小，载入图像时再按图像大小调整
         min_width = max(600, toolbar_width + 20)  # 设置最小宽度，确保工具栏能完整显示
-        
-        if self.current_pixmap:
-            # 确保窗口宽度不小于最小宽度
-            window_width = max(self.current_pixmap.width(), min_width)
-            window_height = self.current_pixmap.height() + toolbar_height + 10
-            self.resize(window_width, window_height)
-        else:
-            self.resize(800, 650)
+        self.resize(800, 650)
             
         # 设置窗口最小尺寸
         self.setMinimumWidth(min_width)
         
         # 启用输入法
         self.setAttribute(Qt.WA_InputMethodEnabled, True)
+    
+    def prewarm(self):
+        """在显示之前完成样式表解析、布局计算和原生窗口创建，第一次载入截图时不再付出这些开销"""
+        for widget in [self] + self.findChildren(QWidget):
+            widget.ensurePolished()
+        self.layout().activate()
+        self.winId()
+    
+    def load(self, pixmap, screen_pos=None):
+        """载入新的截图并显示编辑器
+        
+        只重置编辑状态，窗口、工具栏和样式表都复用；画笔颜色、粗细和字体等设置保留上一次的选择
+        """
+        self.render_scheduler.cancel()
+        self.render_scheduler.reset_stats()
+        if self.text_cursor_timer and self.text_cursor_timer.isActive():
+            self.text_cursor_timer.stop()
+        
+        self.original_pixmap = pixmap
+        self.current_pixmap = pixmap
+        self.renderer.set_source(pixmap.toImage())
+        # 上一张截图的效果缓存不会再命中，编辑器一直保留，不清空会一直占用内存
+        self.renderer.effect_layer.cache.clear()
+        self.screen_pos = screen_pos
         
-        # 确保图像已添加边框
-        if self.original_pixmap and self.current_pixmap.width() == self.original_pixmap.width():
-            # 如果当前图像没有边框，添加边框
-            self.current_pixmap = self.addBorderToPixmap(self.original_pixmap)
+        # 编辑状态
+        self.is_drawing = False
+        self.current_tool = None
+        self.start_point = QPoint()
+        self.end_point = QPoint()
+        self.redaction_preview = None
+        self.pending_drag_pos = None
+        self.shapes = AnnotationStore()
+        self.invalidateComposite()
+        self.history.clear()
+        self.edit_before = None
+        self.shape_index.clear()
+        self.paint_index.clear()
+        self.indexed_shapes = self.shapes
+        self.temp_text = ""
+        self.document = None
+        self.is_text_input = False
+        self.current_text = ""
+        self.preedit_text = ""
+        self.text_input_rect = None
+        self.text_cursor_visible = True
+        self.is_moving_shape = False
+        self.moving_shape_index = -1
+        self.is_resizing = False
+        self.resize_shape_index = -1
+        self.resize_handle = -1
         
+        # 上一次编辑可能打开了属性面板，或者把工具栏移到了顶部，恢复默认布局
+        self.property_panel.hide()
+        self.property_panel_visible = False
+        main_layout = self.layout()
+        main_layout.removeWidget(self.canvas)
+        main_layout.removeWidget(self.controls_container)
+        main_layout.addWidget(self.canvas)
+        main_layout.addWidget(self.controls_container)
+        
+        self.resizeToPixmap()
         self.updateImageLabel()
+        # 先按新的画布尺寸和隐藏的属性面板重新计算布局，否则窗口不能缩小到比上一张截图小
+        main_layout.activate()
+        self.resize(max(self.canvas.width(), self.minimumWidth()), self.canvas.height() + self.toolbar_height + 10)
         
         # 移动窗口到指定位置，并调整位置确保工具栏完全可见
         if self.screen_pos:
             self.adjustWindowPosition()
         
         self.show()
+        self.raise_()
+        self.activateWindow()
         
         # 窗口显示后，确保工具栏完全可见
         QTimer.singleShot(100, self.ensureToolbarVisible)
+    
+    def resizeToPixmap(self):
+        """按图像大小设置画布的缩放比例和视口大小
+        
+        图像比屏幕的可用区域大时缩小到完整显示；长截图完整显示会太小，改为按较短的一边适应，
+        其余部分滚动查看
+        """
+        screen = QApplication.screenAt(self.screen_pos) if self.screen_pos else None
+        if not screen:
+            screen = QApplication.primaryScreen()
+        available = screen.availableGeometry()
+        border = 2 * self.BORDER_WIDTH
+        # 留出工具栏和属性面板的高度
+        max_width = max(available.width() - border, 200)
+        max_height = max(available.height() - border - self.toolbar_height - 60, 200)
+        width, height = self.current_pixmap.width(), self.current_pixmap.height()
+        fit_width, fit_height = max_width / width, max_height / height
+        fit = min(fit_width, fit_height)
+        if fit < max(fit_width, fit_height) / 2:
+            fit = max(fit_width, fit_height)
+        zoom = min(1.0, fit)
+        self.canvas.set_image_size(self.current_pixmap.size(), zoom)
+        self.canvas.set_view_size(QSize(min(math.ceil(width * zoom), max_width),
+                                        min(math.ceil(height * zoom), max_height)))
+        self.text_overlay.setGeometry(self.canvas.rect())
         
     def adjustWindowPosition(self):
         """根据屏幕位置调整窗口位置，确保工具栏完全可见"""
@@ -315,11 +450,11 @@ class ScreenshotEditor(QWidget):
         if window_pos.y() + window_height > screen_geometry.bottom():
             # 将工具栏移到顶部
             main_layout = self.layout()
-            main_layout.removeWidget(self.image_label)
+            main_layout.removeWidget(self.canvas)
             main_layout.removeWidget(self.controls_container)
             
             main_layout.addWidget(self.controls_container)
-            main_layout.addWidget(self.image_label)
+            main_layout.addWidget(self.canvas)
             
             print("工具栏移到顶部")
         
@@ -399,6 +534,8 @@ class ScreenshotEditor(QWidget):
         text_input_action = self.createToolButton("直接输入", "#FF9F1C", lambda: self.setTool("text_input"), "直接输入文本 - 在图像上直接键入文字")
         self.toolbar.addAction(text_input_action)
         self.toolbar.addAction(self.createToolButton("马赛克", "#2EC4B6", lambda: self.setTool("mosaic"), "马赛克工具 - 模糊选定区域"))
+        self.toolbar.addAction(self.createToolButton("方框模糊", "#5FA8D3", lambda: self.setTool("box_blur"), "方框模糊工具 - 均值模糊选定区域"))
+        self.toolbar.addAction(self.createToolButton("高斯模糊", "#8E7DBE", lambda: self.setTool("gaussian_blur"), "高斯模糊工具 - 高斯模糊选定区域"))
         
         # 添加分隔符
         self.toolbar.addSeparator()
@@ -419,6 +556,13 @@ class ScreenshotEditor(QWidget):
         undo_action.triggered.connect(self.undo)
         self.toolbar.addAction(undo_action)
         
+        # 重做，图标是撤销图标的镜像
+        redo_action = QAction("重做", self)
+        redo_action.setIcon(QIcon(undo_pixmap.transformed(QTransform().scale(-1, 1))))
+        redo_action.setToolTip("重做上一步撤销的操作")
+        redo_action.triggered.connect(self.redo)
+        self.toolbar.addAction(redo_action)
+        
         # 清除所有
         clear_action = QAction("清除", self)
         clear_pixmap = QPixmap(24, 24)
@@ -563,9 +707,17 @@ class ScreenshotEditor(QWidget):
                 # 返回键盘焦点到控件
                 self.setFocus()
     
+    def imagePos(self, pos):
+        """把画布中的位置转换为原始图像坐标（去掉边框、平移和缩放）"""
+        return self.canvas.map_to_image(pos)
+    
     def eventFilter(self, source, event):
         """事件过滤器，用于处理鼠标事件"""
-        if source == self.image_label:
+        # 中键拖动平移画布时不处理
+        if source == self.canvas and not self.canvas.is_panning() and event.type() in (
+                event.MouseButtonPress, event.MouseMove, event.MouseButtonRelease):
+            # 标注使用原始图像坐标
+            pos = self.imagePos(event.pos())
             # 处理鼠标按下事件
             if event.type() == event.MouseButtonPress and event.button() == Qt.LeftButton:
                 # 如果正在文本输入，处理文本点击
@@ -574,33 +726,36 @@ class ScreenshotEditor(QWidget):
                     if self.current_text:
                         self.finishTextInput()
                     
-                    self.start_point = event.pos()
+                    self.start_point = pos
                     self.current_text = ""  # 清空当前文本，准备新输入
-                    self.updateImageLabel()
+                    self.preedit_text = ""
+                    self.refreshTextInput()
                     return True
                 
                 # 检查是否点击了控制点（用于调整大小）
-                shape_index, handle_index = self.getHandleAtPosition(event.pos())
+                shape_index, handle_index = self.getHandleAtPosition(pos)
                 if shape_index >= 0 and handle_index >= 0:
                     print(f"开始调整形状大小 - 形状索引: {shape_index}, 控制点: {handle_index}")
                     # 开始调整大小
                     self.is_resizing = True
                     self.resize_shape_index = shape_index
                     self.resize_handle = handle_index
+                    self.beginShapeEdit(shape_index)
                     return True
                 
                 # 检查是否点击了已有形状
-                shape_index = self.getShapeAtPosition(event.pos())
+                shape_index = self.getShapeAtPosition(pos)
                 if shape_index >= 0:
                     # 开始移动形状，所有形状都可以移动
                     print(f"开始移动形状 - 形状索引: {shape_index}")
                     self.is_moving_shape = True
                     self.moving_shape_index = shape_index
-                    self.move_start_pos = event.pos()
+                    self.move_start_pos = pos
+                    self.beginShapeEdit(shape_index)
                     return True
                 else:
                     # 正常开始绘制
-                    self.startDrawing(event.pos())
+                    self.startDrawing(pos)
                     return True
                 
             # 处理鼠标移动事件
@@ -610,28 +765,22 @@ class ScreenshotEditor(QWidget):
                     return True
                 
                 # 更新鼠标指针样式
-                shape_index, handle_index = self.getHandleAtPosition(event.pos())
+                shape_index, handle_index = self.getHandleAtPosition(pos)
                 if shape_index >= 0 and handle_index >= 0:
                     if handle_index in [0, 3]:  # 左上角或右下角
-                        self.image_label.setCursor(Qt.SizeFDiagCursor)
+                        self.canvas.setCursor(Qt.SizeFDiagCursor)
                     else:  # 右上角或左下角
-                        self.image_label.setCursor(Qt.SizeBDiagCursor)
-                elif self.getShapeAtPosition(event.pos()) >= 0:
-                    self.image_label.setCursor(Qt.SizeAllCursor)
+                        self.canvas.setCursor(Qt.SizeBDiagCursor)
+                elif self.getShapeAtPosition(pos) >= 0:
+                    self.canvas.setCursor(Qt.SizeAllCursor)
                 else:
-                    self.image_label.setCursor(Qt.ArrowCursor)
+                    self.canvas.setCursor(Qt.ArrowCursor)
                 
-                # 处理调整大小
-                if self.is_resizing and self.resize_shape_index >= 0:
-                    self.resizeShape(event.pos())
-                    return True
-                # 处理移动形状
-                elif self.is_moving_shape and self.moving_shape_index >= 0:
-                    self.moveShape(event.pos())
-                    return True
-                # 处理绘制
-                elif self.is_drawing:
-                    self.drawing(event.pos())
+                # 调整大小、移动形状和绘制时只记录最新的鼠标位置，每个显示帧最多应用和重绘一次
+                if ((self.is_resizing and self.resize_shape_index >= 0) or
+                        (self.is_moving_shape and self.moving_shape_index >= 0) or self.is_drawing):
+                    self.pending_drag_pos = pos
+                    self.render_scheduler.request()
                     return True
             
             # 处理鼠标释放事件
@@ -640,6 +789,9 @@ class ScreenshotEditor(QWidget):
                 if self.is_text_input:
                     return True
                 
+                # 先应用还没有绘制的最后一次移动
+                self.finishDragFrames()
+                
                 if self.is_resizing:
                     # 完成调整大小
                     self.finishResizeShape()
@@ -650,11 +802,37 @@ class ScreenshotEditor(QWidget):
                     return True
                 elif self.is_drawing:
                     # 完成绘制
-                    self.endDrawing(event.pos())
+                    self.endDrawing(pos)
                     return True
         
         return super().eventFilter(source, event)
     
+    def renderFrame(self):
+        """重绘调度器的回调：应用这一帧内最后一次拖动的鼠标位置并重绘"""
+        pos = self.pending_drag_pos
+        self.pending_drag_pos = None
+        if pos is None:
+            self.updateImageLabel()
+        elif self.is_resizing and self.resize_shape_index >= 0:
+            self.resizeShape(pos)
+        elif self.is_moving_shape and self.moving_shape_index >= 0:
+            self.moveShape(pos)
+        elif self.is_drawing:
+            self.drawing(pos)
+        else:
+            self.updateImageLabel()
+        # 在这一帧内完成画布的绘制，重绘统计包括绘制的耗时
+        self.canvas.repaint()
+    
+    def finishDragFrames(self):
+        """拖动结束时完成挂起的重绘，并输出这次拖动的重绘统计"""
+        self.render_scheduler.flush()
+        stats = self.render_scheduler.stats()
+        if stats["requests"]:
+            print(f"拖动重绘: {stats['frames']} 帧, 合并 {stats['coalesced']} 次移动, "
+                  f"平均 {stats['mean_frame_ms']:.1f}ms, 最长 {stats['max_frame_ms']:.1f}ms")
+        self.render_scheduler.reset_stats()
+    
     def mousePressEvent(self, event):
         """处理鼠标按下事件"""
         # 移除了拖动窗口功能
@@ -682,21 +860,21 @@ class ScreenshotEditor(QWidget):
         self.start_point = pos
         self.end_point = pos
         
+        # 马赛克和模糊在拖动时实时预览，源图像只在按下时取一次
+        if self.current_tool == "mosaic":
+            self.redaction_preview = MosaicPreview(self.renderEffectsImage(), self.mosaic_size)
+        elif self.current_tool in ["box_blur", "gaussian_blur"]:
+            kernel = "box" if self.current_tool == "box_blur" else "gaussian"
+            self.redaction_preview = BlurPreview(self.renderEffectsImage(), self.blur_radius, kernel)
+        
         # 如果是文本工具，提示用户输入文本
         if self.current_tool == "text":
             text, ok = QInputDialog.getText(self, "输入文本", "请输入要添加的文本:", QLineEdit.Normal, "")
             if ok and text:
                 self.temp_text = text
                 # 直接添加文本形状，不需要拖动
-                shape = {
-                    "type": "text",
-                    "start": self.start_point,
-                    "end": self.start_point,
-                    "color": self.pen_color,
-                    "font": self.text_font,
-                    "text": self.temp_text
-                }
-                self.shapes.append(shape)
+                style = self.shapes.styles.intern(self.pen_color, font=self.text_font)
+                self.addShape("text", self.start_point, self.start_point, style, text=self.temp_text)
                 self.updateImageLabel()
                 self.is_drawing = False
         
@@ -733,301 +911,295 @@ class ScreenshotEditor(QWidget):
             return
         
         self.end_point = pos
+        self.redaction_preview = None
         
         # 如果起点和终点距离太小，不添加形状
         if (abs(self.start_point.x() - self.end_point.x()) < 5 and 
             abs(self.start_point.y() - self.end_point.y()) < 5):
             self.is_drawing = False
+            self.updateImageLabel()
             return
         
         # 添加当前绘制的形状
-        if self.current_tool == "rectangle":
-            shape = {
-                "type": "rectangle",
-                "start": self.start_point,
-                "end": self.end_point,
-                "color": self.pen_color,
-                "width": self.pen_width
-            }
-            self.shapes.append(shape)
-        
-        elif self.current_tool == "circle":
-            shape = {
-                "type": "circle",
-                "start": self.start_point,
-                "end": self.end_point,
-                "color": self.pen_color,
-                "width": self.pen_width
-            }
-            self.shapes.append(shape)
-        
-        elif self.current_tool == "arrow":
-            shape = {
-                "type": "arrow",
-                "start": self.start_point,
-                "end": self.end_point,
-                "color": self.pen_color,
-                "width": self.pen_width
-            }
-            self.shapes.append(shape)
+        styles = self.shapes.styles
+        if self.current_tool in ["rectangle", "circle", "arrow"]:
+            self.addShape(self.current_tool, self.start_point, self.end_point,
+                          styles.intern(self.pen_color, self.pen_width))
         
         elif self.current_tool == "mosaic":
-            shape = {
-                "type": "mosaic",
-                "start": self.start_point,
-                "end": self.end_point,
-                "size": self.mosaic_size
-            }
-            self.shapes.append(shape)
-            self.applyMosaic(shape)  # 马赛克效果需要立即应用到pixmap
+            self.addShape("mosaic", self.start_point, self.end_point, param=self.mosaic_size)
+        
+        elif self.current_tool in ["box_blur", "gaussian_blur"]:
+            kernel = "box" if self.current_tool == "box_blur" else "gaussian"
+            self.addShape("blur", self.start_point, self.end_point,
+                          styles.intern(kernel=kernel), param=self.blur_radius)
         
         self.is_drawing = False
         self.updateImageLabel()
     
     def updateImageLabel(self):
-        """更新图像显示"""
+        """更新图像显示，画布在下一次绘制时只重绘视口中可见的部分"""
         if not self.current_pixmap:
             return
+        self.updateCompositeExclude()
+        self.canvas.update()
+        # 整个画布都会重绘，输入的文本也随之重绘
+        self.text_input_rect = self.textInputRect() if self.is_text_input else None
+    
+    def textInputRect(self):
+        """正在输入的一行文本（包括预编辑文本和光标）所占的矩形"""
+        font_metrics = QFontMetrics(self.text_font)
+        x, y = self.start_point.x(), self.start_point.y()
+        text_width = font_metrics.width(self.current_text + self.preedit_text)
+        height = font_metrics.height()
+        # 字形可能略微超出前进宽度，左右各留一些余量
+        margin = height // 2 + 2
+        return QRect(x - margin, y - height - 2, text_width + 2 * margin, height + font_metrics.descent() + 6)
+    
+    def caretRect(self):
+        """光标所占的矩形"""
+        font_metrics = QFontMetrics(self.text_font)
+        cursor_x = self.start_point.x() + font_metrics.width(self.current_text + self.preedit_text)
+        cursor_y = self.start_point.y()
+        cursor_height = font_metrics.height()
+        return QRect(cursor_x - 2, cursor_y - cursor_height, 5, cursor_height + 5)
+    
+    def refreshTextInput(self):
+        """输入的文本变化后只重绘上次和这次文本所占的矩形"""
+        rect = self.textInputRect()
+        if self.text_input_rect is not None:
+            self.text_overlay.update(self.canvas.map_rect_from_image(self.text_input_rect))
+        self.text_overlay.update(self.canvas.map_rect_from_image(rect))
+        self.text_input_rect = rect
+    
+    def drawTextInput(self, painter):
+        """绘制正在输入的文本、预编辑文本和光标"""
+        if not self.start_point:
+            return
+        painter.setPen(QPen(self.pen_color))
+        painter.setFont(self.text_font)
+        font_metrics = painter.fontMetrics()
         
-        # 创建一个临时pixmap用于绘制
-        temp_pixmap = QPixmap(self.current_pixmap)
-        painter = QPainter(temp_pixmap)
-        
-        # 设置抗锯齿
-        painter.setRenderHint(QPainter.Antialiasing)
-        
-        # 绘制已保存的形状
-        for i, shape in enumerate(self.shapes):
-            # 正常绘制形状
-            self.drawShape(painter, shape)
-            
-            # 为可移动形状添加控制点（除马赛克外的所有形状）
-            if shape["type"] in ["rectangle", "circle", "text"]:
-                color = shape.get("color", QColor(255, 0, 0))
-                
-                # 绘制控制点
-                if shape["type"] in ["rectangle", "circle"]:
-                    rect = QRect(shape["start"], shape["end"]).normalized()
-                    self.drawControlPoints(painter, rect, color)
-                elif shape["type"] == "text" and "text" in shape:
-                    # 为文本添加控制点
-                    font_metrics = QFontMetrics(shape["font"])
-                    text_width = font_metrics.width(shape["text"])
-                    text_height = font_metrics.height()
-                    text_rect = QRect(shape["start"].x(), shape["start"].y() - text_height,
-                                    text_width, text_height)
-                    self.drawControlPoints(painter, text_rect, color)
-        
-        # 绘制当前正在绘制的临时形状
-        if self.is_drawing and self.current_tool:
-            shape = {
-                "type": self.current_tool,
-                "start": self.start_point,
-                "end": self.end_point,
-                "color": self.pen_color,
-                "width": self.pen_width
-            }
-            self.drawShape(painter, shape)
+        # 绘制已输入的文本
+        if self.current_text:
+            painter.drawText(self.start_point, self.current_text)
         
-        # 绘制正在输入的文本
-        if self.is_text_input:
+        # 绘制预编辑文本（如果有），使用蓝色
+        if self.preedit_text:
+            confirmed_text_width = font_metrics.width(self.current_text)
+            preedit_pos = QPoint(self.start_point.x() + confirmed_text_width, self.start_point.y())
+            painter.setPen(QPen(QColor(100, 100, 255)))
+            painter.drawText(preedit_pos, self.preedit_text)
             painter.setPen(QPen(self.pen_color))
-            painter.setFont(self.text_font)
-            
-            # 绘制已输入的文本
-            text_to_draw = self.current_text
-            if self.start_point and text_to_draw:  # 确保有效的起始点和文本
-                painter.drawText(self.start_point, text_to_draw)
-            
-            # 计算光标位置
-            if self.text_cursor_visible and self.start_point:
-                # 计算文本宽度
-                font_metrics = painter.fontMetrics()
-                text_width = font_metrics.width(text_to_draw)
-                
-                # 绘制光标
-                cursor_x = self.start_point.x() + text_width
-                cursor_y = self.start_point.y()
-                cursor_height = font_metrics.height()
-                
-                # 绘制垂直线作为光标
-                painter.drawLine(cursor_x, cursor_y - cursor_height + 2, cursor_x, cursor_y + 2)
-        
-        painter.end()
         
-        # 更新图像标签
-        self.image_label.setPixmap(temp_pixmap)
-        # 确保标签尺寸与pixmap一致，避免拉伸问题
-        self.image_label.setFixedSize(temp_pixmap.size())
+        # 绘制垂直线作为光标
+        if self.text_cursor_visible:
+            total_text_width = font_metrics.width(self.current_text + self.preedit_text)
+            cursor_x = self.start_point.x() + total_text_width
+            cursor_y = self.start_point.y()
+            cursor_height = font_metrics.height()
+            painter.drawLine(cursor_x, cursor_y - cursor_height + 2, cursor_x, cursor_y + 2)
     
-    def drawShape(self, painter, shape):
-        """根据形状类型绘制对应图形"""
-        shape_type = shape.get("type")
-        
-        # 确保shape包含所有必要的键
-        if not all(key in shape for key in ["start", "end"]):
-            return
-        
-        start = shape["start"]
-        end = shape["end"]
+    def activeShapeIndex(self):
+        """返回正在移动或调整大小的形状索引，没有时返回-1"""
+        if self.is_resizing:
+            return self.resize_shape_index
+        if self.is_moving_shape:
+            return self.moving_shape_index
+        return -1
+    
+    def updateCompositeExclude(self):
+        """开始或结束移动、调整形状后调用，图块中不包含的形状变了时重新生成图块"""
+        active = self.activeShapeIndex()
+        if active != self.composite_exclude:
+            self.composite_exclude = active
+            self.canvas.invalidate()
+    
+    def invalidateComposite(self):
+        """self.shapes改变后调用，画布缓存的图块在下次绘制时重新生成"""
+        self.composite_patches = None
+        self.canvas.invalidate()
+    
+    def isEffectShape(self, index):
+        return 0 <= index < len(self.shapes) and self.shapes.is_effect(index)
+    
+    def tilePatches(self):
+        """图块使用的效果图像块，形状改变之前一直复用"""
+        if self.composite_patches is None:
+            self.composite_patches = self.effectPatches()
+        return self.composite_patches
+    
+    def drawTile(self, painter, rect):
+        """画布回调：绘制一个图块，painter的坐标系是图像坐标，rect为图块在图像中的范围
         
-        if shape_type in ["rectangle", "circle", "arrow"]:
-            if "color" not in shape or "width" not in shape:
-                return
-            
-            color = shape["color"]
-            width = shape["width"]
-            
-            pen = QPen(color, width)
-            painter.setPen(pen)
-            
-            # 使用NoBrush确保矩形和圆形只绘制边框
-            painter.setBrush(Qt.NoBrush)
-            
-            if shape_type == "rectangle":
-                rect = QRect(start, end)
-                painter.drawRect(rect.normalized())
-            
-            elif shape_type == "circle":
-                rect = QRect(start, end)
-                painter.drawEllipse(rect.normalized())
-            
-            elif shape_type == "arrow":
-                self.drawArrow(painter, start, end, color, width)
+        图块包含底图、效果和除正在移动或调整的形状外的已提交形状，只绘制与图块相交的部分；
+        控制点紧跟在各自的形状之后绘制，后面的形状可以盖住前面形状的控制点
+        """
+        exclude = self.composite_exclude
+        painter.setRenderHint(QPainter.Antialiasing)
+        # 缩小时平滑缩放，放大时保留像素的锐利边缘
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, painter.transform().m11() < 1)
+        if not self.isEffectShape(exclude):
+            source = QRectF(rect.adjusted(-1, -1, 1, 1).intersected(self.current_pixmap.rect()))
+            painter.drawPixmap(source, self.current_pixmap, source)
+            patches = [(target, image) for target, image in self.tilePatches() if target.intersects(rect)]
+            if patches:
+                painter.save()
+                painter.setCompositionMode(QPainter.CompositionMode_Source)
+                for target, image in patches:
+                    painter.drawImage(target.topLeft(), image)
+                painter.restore()
+        for i in self.visibleShapes(rect):
+            if i != exclude:
+                draw_shape(painter, self.shapes, i)
+                self.drawShapeControlPoints(painter, i)
+    
+    def drawBelowTiles(self, painter, rect):
+        """画布回调：每次重绘时在图块下方绘制
+        
+        正在移动或调整的马赛克或模糊会影响其他效果，这时图块只包含透明背景上的标注，
+        底图和效果在这里每帧绘制（未变的效果图像块来自缓存）
+        """
+        if self.isEffectShape(self.composite_exclude):
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, painter.transform().m11() < 1)
+            painter.drawPixmap(QRectF(rect), self.current_pixmap, QRectF(rect))
+            self.drawEffects(painter)
+    
+    def drawAboveTiles(self, painter, rect):
+        """画布回调：每次重绘时在图块上方绘制正在移动或调整的形状和正在绘制的临时形状"""
+        painter.setRenderHint(QPainter.Antialiasing)
+        active = self.composite_exclude
+        if 0 <= active < len(self.shapes):
+            draw_shape(painter, self.shapes, active)
+            self.drawShapeControlPoints(painter, active)
         
-        elif shape_type == "text":
-            # 确保包含所有必要的键
-            if not all(key in shape for key in ["color", "font", "text"]):
-                return
-            
-            color = shape["color"]
-            font = shape["font"]
-            text = shape["text"]
-            painter.setPen(QPen(color))
-            painter.setFont(font)
-            painter.drawText(start, text)
-        
-        # 马赛克已经应用到pixmap上，不需要在这里绘制
-    
-    def drawArrow(self, painter, start, end, color, width):
-        """绘制箭头"""
-        # 绘制线段
-        painter.drawLine(start, end)
-        
-        # 计算箭头
-        arrow_size = max(15, width * 5)  # 箭头大小与线条粗细成比例
-        angle = 20  # 更尖锐的箭头角度（度）
-        
-        # 计算线段角度
-        line_length = ((end.x() - start.x())**2 + (end.y() - start.y())**2)**0.5
-        if line_length == 0:
+        if self.is_drawing and self.current_tool:
+            if self.redaction_preview is not None:
+                self.drawRedactionPreview(painter)
+            elif self.current_tool in ["rectangle", "circle", "arrow"]:
+                style = self.shapes.styles[self.shapes.styles.intern(self.pen_color, self.pen_width)]
+                draw_annotation(painter, self.current_tool, self.start_point.x(), self.start_point.y(),
+                                self.end_point.x(), self.end_point.y(), style)
+    
+    def drawShapeControlPoints(self, painter, index):
+        """为可移动形状绘制控制点"""
+        kind = self.shapes.kind(index)
+        if kind in ["rectangle", "circle", "text", "mosaic", "blur"]:
+            color = self.shapes.style(index).color
+            self.drawControlPoints(painter, self.shapeRect(index), color)
+    
+    def drawRedactionPreview(self, painter):
+        """绘制拖动中的马赛克或模糊选区，范围与松开鼠标后实际应用的一致"""
+        rect = self.safeRedactionRect(QRect(self.start_point, self.end_point).normalized(),
+                                      self.current_pixmap.size())
+        if rect.isEmpty():
             return
-        
-        # 计算单位向量
-        dx = (end.x() - start.x()) / line_length
-        dy = (end.y() - start.y()) / line_length
-        
-        # 计算箭头两边的点（使用正确的三角函数）
-        angle_rad = angle * 3.14159 / 180.0  # 转换为弧度
-        
-        # 计算箭头两翼的点
-        x1 = end.x() - arrow_size * (dx * math.cos(angle_rad) + dy * math.sin(angle_rad))
-        y1 = end.y() - arrow_size * (dy * math.cos(angle_rad) - dx * math.sin(angle_rad))
-        
-        x2 = end.x() - arrow_size * (dx * math.cos(angle_rad) - dy * math.sin(angle_rad))
-        y2 = end.y() - arrow_size * (dy * math.cos(angle_rad) + dx * math.sin(angle_rad))
-        
-        # 创建填充的箭头
-        points = [end, QPoint(int(x1), int(y1)), QPoint(int(x2), int(y2))]
-        
-        # 保存当前画笔和画刷
-        old_pen = painter.pen()
-        old_brush = painter.brush()
-        
-        # 设置填充色与线条颜色相同
-        painter.setBrush(QBrush(color))
-        
-        # 绘制填充的箭头
-        painter.drawPolygon(points)
-        
-        # 恢复原来的画笔和画刷
-        painter.setPen(old_pen)
-        painter.setBrush(old_brush)
+        if isinstance(self.redaction_preview, MosaicPreview):
+            # 与effectList相同，不包括right()和bottom()所在的行列
+            self.redaction_preview.paint(painter, rect.left(), rect.top(), rect.right(), rect.bottom())
+        else:
+            self.redaction_preview.paint(painter, rect.left(), rect.top(),
+                                         rect.left() + rect.width(), rect.top() + rect.height())
     
-    def applyMosaic(self, shape):
-        """应用马赛克效果到图像"""
-        # 获取选定区域
-        rect = QRect(shape["start"], shape["end"]).normalized()
-        size = shape["size"]
-        
-        # 创建一个临时QImage用于处理
-        image = self.current_pixmap.toImage()
-        
-        # 边框宽度（确保不对边框应用马赛克）
-        border_width = 2
-        
-        # 确保马赛克区域不超出图像边界并且不影响边框
-        safe_rect = rect.intersected(QRect(border_width, border_width, 
-                                        image.width() - 2 * border_width, 
-                                        image.height() - 2 * border_width))
-        
-        # 遍历选定区域的每个马赛克块
-        for x in range(safe_rect.left(), safe_rect.right(), size):
-            for y in range(safe_rect.top(), safe_rect.bottom(), size):
-                # 确保不超出图像边界
-                block_width = min(size, safe_rect.right() - x)
-                block_height = min(size, safe_rect.bottom() - y)
-                
-                if block_width <= 0 or block_height <= 0:
-                    continue
-                
-                # 计算块内平均颜色
-                r, g, b, count = 0, 0, 0, 0
-                for dx in range(block_width):
-                    for dy in range(block_height):
-                        px, py = x + dx, y + dy
-                        if safe_rect.contains(px, py):
-                            pixel = image.pixel(px, py)
-                            r += QColor(pixel).red()
-                            g += QColor(pixel).green()
-                            b += QColor(pixel).blue()
-                            count += 1
-                
-                if count > 0:
-                    avg_color = QColor(r // count, g // count, b // count)
-                    
-                    # 将块内所有像素设为平均颜色
-                    for dx in range(block_width):
-                        for dy in range(block_height):
-                            px, py = x + dx, y + dy
-                            if safe_rect.contains(px, py):
-                                image.setPixel(px, py, avg_color.rgb())
-        
-        # 更新当前pixmap
-        self.current_pixmap = QPixmap.fromImage(image)
+    def effectPatches(self):
+        """渲染所有效果，返回 [(范围, 图像块)]，未改动的部分直接取自缓存"""
+        return self.renderer.effect_patches(self.shapes)
+    
+    def drawEffects(self, painter):
+        """把马赛克和模糊绘制到painter上"""
+        self.renderer.draw_effects(painter, self.shapes)
+    
+    def renderEffectsImage(self):
+        """返回应用了马赛克和模糊的原始图像，用作拖动预览的源图像；没有效果时直接使用原始图像，不复制"""
+        image = self.renderer.source if self.renderer.source is not None else self.current_pixmap.toImage()
+        if not self.effectPatches():
+            return image
+        image = QImage(image)
+        painter = QPainter(image)
+        self.drawEffects(painter)
+        painter.end()
+        return image
+    
+    def safeRedactionRect(self, rect, image_size):
+        """返回rect在图像内的部分"""
+        return rect.intersected(QRect(QPoint(0, 0), image_size))
+    
+    def addShape(self, kind, start, end, style=0, param=0, text=None):
+        """添加一个形状并记入历史"""
+        index = self.shapes.append(kind, start, end, style, param, text)
+        self.history.push(AddShape(index, self.shapes.record(index)))
+        self.indexShape(index)
+        self.invalidateComposite()
+    
+    def beginShapeEdit(self, index):
+        """开始移动或调整大小时记录形状原来的位置"""
+        self.edit_before = self.shapes.points(index)
+        self.updateCompositeExclude()
+    
+    def endShapeEdit(self, index):
+        """移动或调整大小结束，位置有变化时记入历史"""
+        before, self.edit_before = self.edit_before, None
+        if before is None or not 0 <= index < len(self.shapes):
+            return
+        after = self.shapes.points(index)
+        if after != before:
+            self.history.push(ChangeShape(index, before, after))
     
     def undo(self):
         """撤销上一步操作"""
-        if self.shapes:
-            self.shapes.pop()
-            # 对于马赛克，需要重新加载原始图像并重新应用所有操作
-            if any(shape["type"] == "mosaic" for shape in self.shapes):
-                # 加载带边框的原始图像
-                self.current_pixmap = self.addBorderToPixmap(self.original_pixmap)
-                for shape in self.shapes:
-                    if shape["type"] == "mosaic":
-                        self.applyMosaic(shape)
+        # 马赛克和模糊不修改图像，只需恢复形状列表，效果的结果来自缓存
+        command = self.history.undo(self.shapes)
+        if command:
+            self.reindexCommand(command)
+            self.invalidateComposite()
             self.updateImageLabel()
             print("撤销上一步操作")
     
+    def redo(self):
+        """重做上一步撤销的操作"""
+        command = self.history.redo(self.shapes)
+        if command:
+            self.reindexCommand(command)
+            self.invalidateComposite()
+            self.updateImageLabel()
+            print("重做上一步操作")
+    
+    def reindexCommand(self, command):
+        """撤销或重做一条命令后增量更新空间索引"""
+        if isinstance(command, AddShape):
+            uid = command.record[-1]
+            if command.index < len(self.shapes) and self.shapes.uid(command.index) == uid:
+                self.indexShape(command.index)
+            else:
+                self.shape_index.remove(uid)
+                self.paint_index.remove(uid)
+        elif isinstance(command, ChangeShape):
+            self.indexShape(command.index)
+        else:
+            self.rebuildShapeIndex()
+    
     def clearAll(self):
         """清除所有绘制内容"""
-        self.shapes = []
-        # 重新加载带边框的原始图像
-        self.current_pixmap = self.addBorderToPixmap(self.original_pixmap)
+        if len(self.shapes):
+            self.history.push(ClearShapes(self.shapes.records()))
+        self.shapes.clear()
+        self.shape_index.clear()
+        self.paint_index.clear()
+        self.invalidateComposite()
         self.updateImageLabel()
         print("清除所有内容")
     
+    def renderEditedPixmap(self):
+        """把所有编辑内容绘制到原始图像上，用于保存、复制和完成编辑"""
+        # 与原始图像共享像素，绘制时才复制一次；没有标注时不复制
+        temp_pixmap = QPixmap(self.original_pixmap)
+        if len(self.shapes):
+            painter = QPainter(temp_pixmap)
+            painter.setRenderHint(QPainter.Antialiasing)
+            self.renderer.draw(painter, self.shapes)
+            painter.end()
+        return temp_pixmap
+    
     def saveImage(self):
         """保存编辑后的图像到文件,并隐藏编辑器"""
         # 确保完成所有文本输入
@@ -1036,17 +1208,7 @@ class ScreenshotEditor(QWidget):
         
         # 获取原始图像并应用编辑内容
         if self.original_pixmap:
-            # 创建一个临时的pixmap,使用原始图像(无边框)
-            temp_pixmap = QPixmap(self.original_pixmap)
-            painter = QPainter(temp_pixmap)
-            painter.setRenderHint(QPainter.Antialiasing)
-            
-            # 绘制所有形状
-            for shape in self.shapes:
-                # 需要调整形状的坐标，去掉边框偏移
-                self.drawShapeWithoutBorder(painter, shape)
-                
-            painter.end()
+            temp_pixmap = self.renderEditedPixmap()
             
             # 打开文件保存对话框
             timestamp = datetime.datetime.now().strftime('%Y-%m-%d-%H%M%S')
@@ -1059,9 +1221,11 @@ class ScreenshotEditor(QWidget):
             )
             
             if file_path:
-                # 保存图像
-                temp_pixmap.save(file_path)
-                print(f"图像已保存到: {file_path}")
+                # 在后台线程编码和写入，不阻塞编辑器
+                default_save_queue().submit(temp_pixmap, file_path)
+                print(f"图像正在后台保存到: {file_path}")
+                # 标注文档与复制、关闭时一样保存在output文件夹中，不写入用户选择的文件夹
+                self.autosaveDocument()
             
             # 发出信号,通知截图编辑完成
             self.editingFinished.emit(temp_pixmap)
@@ -1070,42 +1234,35 @@ class ScreenshotEditor(QWidget):
             self.hide()
             
             # 清空当前绘制内容,准备下次使用
-            self.shapes = []
-            # 重新加载带边框的原始图像，因为现在回到了编辑模式
-            self.current_pixmap = self.addBorderToPixmap(self.original_pixmap)
+            self.shapes.clear()
+            self.history.clear()
+            self.document = None
+            self.invalidateComposite()
             self.updateImageLabel()
             
     def copyToClipboard(self):
         """复制当前图像到剪贴板，包含所有编辑内容但不包含边框"""
+        # 如果正在输入文本，先完成文本输入，确保文本包含在复制的图像中
+        if self.is_text_input and self.current_text:
+            self.finishTextInput()
+        
         if self.original_pixmap:
-            # 创建一个临时的pixmap，使用原始图像(无边框)
-            temp_pixmap = QPixmap(self.original_pixmap)
-            painter = QPainter(temp_pixmap)
-            painter.setRenderHint(QPainter.Antialiasing)
-            
-            # 绘制所有形状
-            for shape in self.shapes:
-                # 需要调整形状的坐标，去掉边框偏移
-                self.drawShapeWithoutBorder(painter, shape)
-            
-            # 如果正在输入文本，完成文本输入
-            if self.is_text_input and self.current_text:
-                self.finishTextInput()
-                
-            painter.end()
+            temp_pixmap = self.renderEditedPixmap()
             
             # 将带有所有编辑内容的图像复制到剪贴板
             QApplication.clipboard().setPixmap(temp_pixmap)
             print("已复制带有标记的图像到剪贴板")
+            self.autosaveDocument()
             
             # 发出编辑完成信号但不复制到剪贴板
             self.editingFinished.emit(temp_pixmap)
             print("已隐藏编辑界面")
         
         # 清空当前绘制内容，准备下次使用
-        self.shapes = []
-        # 重新加载带边框的原始图像，因为现在回到了编辑模式
-        self.current_pixmap = self.addBorderToPixmap(self.original_pixmap)
+        self.shapes.clear()
+        self.history.clear()
+        self.document = None
+        self.invalidateComposite()
         self.updateImageLabel()
         
         # 隐藏窗口但不关闭
@@ -1119,140 +1276,151 @@ class ScreenshotEditor(QWidget):
         
         # 获取原始图像并应用编辑内容
         if self.original_pixmap:
-            # 创建一个临时的pixmap，使用原始图像(无边框)
-            temp_pixmap = QPixmap(self.original_pixmap)
-            painter = QPainter(temp_pixmap)
-            painter.setRenderHint(QPainter.Antialiasing)
-            
-            # 绘制所有形状
-            for shape in self.shapes:
-                # 需要调整形状的坐标，去掉边框偏移
-                self.drawShapeWithoutBorder(painter, shape)
-                
-            painter.end()
+            temp_pixmap = self.renderEditedPixmap()
+            self.autosaveDocument()
             
             # 发出编辑完成信号但不复制到剪贴板
             self.editingFinished.emit(temp_pixmap)
             print("已隐藏编辑界面")
         
         # 清空当前绘制内容，准备下次使用
-        self.shapes = []
-        # 重新加载带边框的原始图像，因为现在回到了编辑模式
-        self.current_pixmap = self.addBorderToPixmap(self.original_pixmap)
+        self.shapes.clear()
+        self.history.clear()
+        self.document = None
+        self.invalidateComposite()
         self.updateImageLabel()
         
         # 隐藏窗口但不关闭
         self.hide()
+    
+    def saveDocument(self, path=None):
+        """把原始图像、标注和效果参数保存为标注文档，在后台线程写入，返回文档路径"""
+        if not self.save_documents or not self.original_pixmap:
+            return None
+        if path is None:
+            path = self.document.path if self.document is not None else output_filename("edit", ext=DOCUMENT_EXT[1:])
+        # 索引只包含几个整数和样式，在这里同步生成；图像编码和写盘在保存队列中进行
+        index = document_index(self.shapes, self.original_pixmap.width(), self.original_pixmap.height())
+        if self.document is not None:
+            # 原始图像没有变化，直接复制文档中的PNG，不重新编码
+            default_save_queue().submit_call(path, self.document.write, path, index)
+        else:
+            default_save_queue().submit_call(path, write_document, path, index, self.original_pixmap.toImage())
+        print(f"标注文档正在后台保存到: {path}")
+        return path
+    
+    def autosaveDocument(self):
+        """复制或关闭时保存标注文档，没有标注的新截图不保存"""
+        if len(self.shapes) or self.document is not None:
+            self.saveDocument()
+    
+    def loadDocument(self, document):
+        """载入标注文档中的标注，文档的原始图像应已作为pixmap传给编辑器"""
+        self.document = document
+        self.shapes = document.store()
+        self.history.clear()
+        self.invalidateComposite()
+        self.updateImageLabel()
         
-    def drawShapeWithoutBorder(self, painter, shape):
-        """绘制形状到无边框图像上，需要调整坐标"""
-        shape_type = shape.get("type")
-        
-        # 确保shape包含所有必要的键
-        if not all(key in shape for key in ["start", "end"]):
-            return
-        
-        # 边框宽度
-        border_width = 2
-        
-        # 获取调整后的起点和终点（去掉边框的偏移）
-        start = QPoint(shape["start"].x() - border_width, shape["start"].y() - border_width)
-        end = QPoint(shape["end"].x() - border_width, shape["end"].y() - border_width)
-        
-        if shape_type in ["rectangle", "circle", "arrow"]:
-            if "color" not in shape or "width" not in shape:
-                return
-            
-            color = shape["color"]
-            width = shape["width"]
-            
-            pen = QPen(color, width)
-            painter.setPen(pen)
-            
-            # 使用NoBrush确保矩形和圆形只绘制边框
-            painter.setBrush(Qt.NoBrush)
-            
-            if shape_type == "rectangle":
-                rect = QRect(start, end)
-                painter.drawRect(rect.normalized())
-            
-            elif shape_type == "circle":
-                rect = QRect(start, end)
-                painter.drawEllipse(rect.normalized())
-            
-            elif shape_type == "arrow":
-                self.drawArrow(painter, start, end, color, width)
-        
-        elif shape_type == "text":
-            # 确保包含所有必要的键
-            if not all(key in shape for key in ["color", "font", "text"]):
-                return
-            
-            color = shape["color"]
-            font = shape["font"]
-            text = shape["text"]
-            painter.setPen(QPen(color))
-            painter.setFont(font)
-            painter.drawText(start, text)
-            
-        # 注意：马赛克效果需要特殊处理，因为已经应用到了pixmap上
-        # 在保存/复制时需要额外处理马赛克区域
-        elif shape_type == "mosaic":
-            # 马赛克已经应用到pixmap上，不需要在这里特别处理
-            # 因为我们是从原始图像重新开始的，所以需要重新应用马赛克
-            if "size" in shape:
-                # 创建一个调整后的马赛克形状（去掉边框偏移）
-                adjusted_shape = {
-                    "type": "mosaic",
-                    "start": start,
-                    "end": end,
-                    "size": shape["size"]
-                }
-                
-                # 获取选定区域
-                rect = QRect(start, end).normalized()
-                size = shape["size"]
-                
-                # 创建一个临时QImage用于处理
-                image = painter.device().toImage()
-                
-                # 遍历选定区域的每个马赛克块
-                for x in range(rect.left(), rect.right(), size):
-                    for y in range(rect.top(), rect.bottom(), size):
-                        # 确保不超出图像边界
-                        block_width = min(size, rect.right() - x)
-                        block_height = min(size, rect.bottom() - y)
-                        
-                        if block_width <= 0 or block_height <= 0:
-                            continue
-                        
-                        # 计算块内平均颜色
-                        r, g, b, count = 0, 0, 0, 0
-                        for dx in range(block_width):
-                            for dy in range(block_height):
-                                px, py = x + dx, y + dy
-                                if rect.contains(px, py) and px >= 0 and py >= 0 and px < image.width() and py < image.height():
-                                    pixel = image.pixel(px, py)
-                                    r += QColor(pixel).red()
-                                    g += QColor(pixel).green()
-                                    b += QColor(pixel).blue()
-                                    count += 1
-                        
-                        if count > 0:
-                            avg_color = QColor(r // count, g // count, b // count)
-                            
-                            # 填充马赛克块
-                            painter.fillRect(QRect(x, y, block_width, block_height), avg_color)
-
+    def shapeRect(self, index):
+        """返回形状的范围：文本为文字所占的矩形，其他形状为起点和终点确定的矩形"""
+        if self.shapes.kind(index) == "text":
+            # 字体度量在样式中共享，不必每次创建QFontMetrics
+            font_metrics = self.shapes.style(index).metrics
+            text = self.shapes.text(index) or ""
+            x, y = self.shapes.points(index)[:2]
+            return QRect(x, y - font_metrics.height(), font_metrics.width(text), font_metrics.height())
+        return self.shapes.rect(index)
+    
+    def shapeHitRect(self, index):
+        """返回形状可以被点中的外接矩形（包括控制点），不能点中的形状返回None"""
+        handle_size = 12
+        kind = self.shapes.kind(index)
+        if kind == "rectangle":
+            margin = max(self.shapes.style(index).width * 2, handle_size)
+            return self.shapes.rect(index).adjusted(-margin, -margin, margin, margin)
+        if kind == "circle":
+            rect = self.shapes.rect(index)
+            bounds = rect.adjusted(-handle_size, -handle_size, handle_size, handle_size)
+            rx, ry = rect.width() / 2, rect.height() / 2
+            if rx > 0 and ry > 0:
+                # 边框检测按归一化距离计算，扁椭圆的检测带可能超出外接矩形，按最大距离放大
+                scale = math.sqrt(1.0 + self.shapes.style(index).width * 2 / min(rx, ry))
+                dx, dy = math.ceil(rx * scale - rx) + 1, math.ceil(ry * scale - ry) + 1
+                bounds = bounds.united(rect.adjusted(-dx, -dy, dx, dy))
+            return bounds
+        if kind in ["mosaic", "blur"]:
+            return self.shapes.rect(index).adjusted(-handle_size, -handle_size, handle_size, handle_size)
+        if kind == "text":
+            return self.shapeRect(index)
+        return None
+    
+    def shapePaintRect(self, index):
+        """返回形状绘制时可能覆盖的范围（包括线宽、箭头、文字的下沿和控制点）"""
+        kind = self.shapes.kind(index)
+        width = self.shapes.style(index).width
+        if kind == "text":
+            margin = self.shapes.style(index).metrics.height() // 2 + 8
+            return self.shapeRect(index).adjusted(-margin, -margin, margin, margin)
+        if kind == "arrow":
+            margin = max(15, width * 5) + width + 2
+        else:
+            margin = width + 8
+        return self.shapes.rect(index).adjusted(-margin, -margin, margin, margin)
+    
+    def indexShape(self, index):
+        """把self.shapes中的第index个形状登记到空间索引，或在它移动后更新"""
+        uid = self.shapes.uid(index)
+        self.shape_index.insert(uid, self.shapeHitRect(index), index)
+        self.paint_index.insert(uid, self.shapePaintRect(index), index)
+    
+    def rebuildShapeIndex(self):
+        """self.shapes被整体替换后重建空间索引"""
+        self.shape_index.clear()
+        self.paint_index.clear()
+        self.indexed_shapes = self.shapes
+        for i in range(len(self.shapes)):
+            self.indexShape(i)
+    
+    def shapeCandidates(self, pos):
+        """返回外接矩形包含pos的形状索引，最上层的在前"""
+        if self.indexed_shapes is not self.shapes or len(self.shape_index) != len(self.shapes):
+            self.rebuildShapeIndex()
+        candidates = []
+        uids = self.shapes.uids
+        count = len(uids)
+        for index, key in self.shape_index.query(pos.x(), pos.y()):
+            if index >= count or uids[index] != key:
+                # 索引与形状列表不一致（列表被外部修改），重建后重新查询
+                self.rebuildShapeIndex()
+                return [index for index, _ in self.shape_index.query(pos.x(), pos.y())]
+            candidates.append(index)
+        return candidates
+    
+    def visibleShapes(self, rect):
+        """返回绘制范围与rect相交的形状索引，按绘制顺序"""
+        if self.indexed_shapes is not self.shapes or len(self.paint_index) != len(self.shapes):
+            self.rebuildShapeIndex()
+        visible = []
+        uids = self.shapes.uids
+        count = len(uids)
+        for index, key in self.paint_index.query_rect(rect):
+            if index >= count or uids[index] != key:
+                # 索引与形状列表不一致（列表被外部修改），重建后重新查询
+                self.rebuildShapeIndex()
+                return [index for index, _ in self.paint_index.query_rect(rect)]
+            visible.append(index)
+        return visible
+    
     def getShapeAtPosition(self, pos):
         """检查指定位置是否有形状，返回形状索引"""
-        # 从后向前检查，以便后绘制的形状优先
-        for i in range(len(self.shapes)-1, -1, -1):
-            shape = self.shapes[i]
-            if shape["type"] == "rectangle":
-                rect = QRect(shape["start"], shape["end"]).normalized()
+        # 只检查空间索引中外接矩形包含该位置的形状，后绘制的形状优先
+        for i in self.shapeCandidates(pos):
+            kind = self.shapes.kind(i)
+            if kind == "rectangle":
+                rect = self.shapes.rect(i)
                 # 检查是否在边框附近（边框宽度的2倍范围内）
-                border_width = shape.get("width", 2) * 2
+                border_width = self.shapes.style(i).width * 2
                 outer_rect = rect.adjusted(-border_width, -border_width, border_width, border_width)
                 inner_rect = rect.adjusted(border_width, border_width, -border_width, -border_width)
                 
@@ -1264,8 +1432,8 @@ class ScreenshotEditor(QWidget):
                     if rect.contains(pos):
                         return i
                 
-            elif shape["type"] == "circle":
-                rect = QRect(shape["start"], shape["end"]).normalized()
+            elif kind == "circle":
+                rect = self.shapes.rect(i)
                 center = rect.center()
                 rx = rect.width() / 2
                 ry = rect.height() / 2
@@ -1277,7 +1445,7 @@ class ScreenshotEditor(QWidget):
                     distance = dx*dx + dy*dy
                     
                     # 在椭圆边框附近（边框宽度的2倍范围内）
-                    border_width = shape.get("width", 2) * 2 / min(rx, ry)
+                    border_width = self.shapes.style(i).width * 2 / min(rx, ry)
                     if abs(distance - 1.0) < border_width:
                         return i
                     # 如果是小圆形，整个区域都可以点击
@@ -1285,15 +1453,14 @@ class ScreenshotEditor(QWidget):
                         if distance <= 1.0:
                             return i
             
-            elif shape["type"] == "text" and "text" in shape:
-                # 为文本创建一个小的检测区域
-                font_metrics = QFontMetrics(shape["font"])
-                text_width = font_metrics.width(shape["text"])
-                text_height = font_metrics.height()
-                text_rect = QRect(shape["start"].x(), shape["start"].y() - text_height,
-                                text_width, text_height)
-                if text_rect.contains(pos):
+            elif kind in ["mosaic", "blur"]:
+                # 马赛克和模糊整个区域都可以点击
+                if self.shapes.rect(i).contains(pos):
                     return i
+            
+            elif kind == "text":
+                # 文本的外接矩形就是检测区域
+                return i
         return -1
     
     def moveShape(self, pos):
@@ -1305,12 +1472,9 @@ class ScreenshotEditor(QWidget):
         delta_x = pos.x() - self.move_start_pos.x()
         delta_y = pos.y() - self.move_start_pos.y()
         
-        # 获取当前形状
-        shape = self.shapes[self.moving_shape_index]
-        
-        # 移动形状的起点和终点（适用于所有形状）
-        shape["start"] = QPoint(shape["start"].x() + delta_x, shape["start"].y() + delta_y)
-        shape["end"] = QPoint(shape["end"].x() + delta_x, shape["end"].y() + delta_y)
+        # 原地移动形状的起点和终点（适用于所有形状）
+        self.shapes.translate(self.moving_shape_index, delta_x, delta_y)
+        self.indexShape(self.moving_shape_index)
         
         # 更新移动起始位置
         self.move_start_pos = pos
@@ -1320,9 +1484,12 @@ class ScreenshotEditor(QWidget):
     
     def finishMoveShape(self):
         """完成形状移动"""
+        self.endShapeEdit(self.moving_shape_index)
         self.is_moving_shape = False
         self.moving_shape_index = -1
         self.move_start_pos = QPoint()
+        self.updateCompositeExclude()
+        self.invalidateComposite()
 
     def drawControlPoints(self, painter, rect, color):
         """绘制形状的控制点"""
@@ -1354,66 +1521,20 @@ class ScreenshotEditor(QWidget):
         # 如果有提交的文本，加入到当前文本中
         if commit_text:
             self.current_text += commit_text
-            self.updateImageLabel()
         
-        # 更新显示（包含预编辑文本的预览）
-        if preedit_text or commit_text:
+        # 更新显示（包含预编辑文本的预览），预编辑文本被清空时也要重绘
+        if preedit_text or commit_text or self.preedit_text:
             self.updateTextWithPreedit(preedit_text)
         
         # 接受事件
         event.accept()
 
     def updateTextWithPreedit(self, preedit_text):
-        """更新带有预编辑文本的显示"""
+        """更新带有预编辑文本的显示，只重绘文本所在的一行"""
         if not self.is_text_input:
             return
-        
-        # 临时pixmap用于绘制
-        temp_pixmap = QPixmap(self.current_pixmap)
-        painter = QPainter(temp_pixmap)
-        painter.setRenderHint(QPainter.Antialiasing)
-        
-        # 绘制已保存的形状
-        for shape in self.shapes:
-            self.drawShape(painter, shape)
-        
-        # 绘制当前文本和预编辑文本
-        painter.setPen(QPen(self.pen_color))
-        painter.setFont(self.text_font)
-        
-        # 绘制确认的文本
-        painter.drawText(self.start_point, self.current_text)
-        
-        # 绘制预编辑文本（如果有）
-        if preedit_text:
-            font_metrics = painter.fontMetrics()
-            confirmed_text_width = font_metrics.width(self.current_text)
-            
-            # 计算预编辑文本的位置
-            preedit_pos = QPoint(self.start_point.x() + confirmed_text_width, self.start_point.y())
-            
-            # 绘制预编辑文本，使用不同的颜色
-            painter.setPen(QPen(QColor(100, 100, 255)))  # 使用蓝色显示预编辑文本
-            painter.drawText(preedit_pos, preedit_text)
-            
-            # 恢复原笔颜色
-            painter.setPen(QPen(self.pen_color))
-        
-        # 绘制光标
-        if self.text_cursor_visible:
-            font_metrics = painter.fontMetrics()
-            total_text_width = font_metrics.width(self.current_text + preedit_text)
-            
-            cursor_x = self.start_point.x() + total_text_width
-            cursor_y = self.start_point.y()
-            cursor_height = font_metrics.height()
-            
-            painter.drawLine(cursor_x, cursor_y - cursor_height + 2, cursor_x, cursor_y + 2)
-        
-        painter.end()
-        
-        # 更新图像标签
-        self.image_label.setPixmap(temp_pixmap)
+        self.preedit_text = preedit_text
+        self.refreshTextInput()
 
     def showPropertyPanel(self, tool_type):
         """根据工具类型显示不同的属性面板"""
@@ -1547,6 +1668,29 @@ class ScreenshotEditor(QWidget):
             mosaic_widget.setLayout(mosaic_layout)
             self.property_layout.addWidget(mosaic_widget)
         
+        elif tool_type in ["box_blur", "gaussian_blur"]:
+            # 添加模糊半径滑块，半径不影响处理耗时
+            self.property_layout.addWidget(QLabel("模糊半径:"))
+            blur_slider = QSlider(Qt.Horizontal)
+            blur_slider.setMinimum(1)
+            blur_slider.setMaximum(100)
+            blur_slider.setValue(self.blur_radius)
+            blur_slider.setFixedWidth(150)
+            blur_slider.valueChanged.connect(self.setBlurRadius)
+            
+            # 显示当前半径
+            radius_label = QLabel(f"{self.blur_radius}px")
+            radius_label.setFixedWidth(40)
+            blur_slider.valueChanged.connect(lambda v: radius_label.setText(f"{v}px"))
+            
+            blur_layout = QHBoxLayout()
+            blur_layout.addWidget(blur_slider)
+            blur_layout.addWidget(radius_label)
+            
+            blur_widget = QWidget()
+            blur_widget.setLayout(blur_layout)
+            self.property_layout.addWidget(blur_widget)
+        
         # 添加弹性空间，使控件靠左对齐
         self.property_layout.addStretch()
         
@@ -1558,8 +1702,9 @@ class ScreenshotEditor(QWidget):
         min_width = 600  # 确保工具栏能完整显示的最小宽度
         if self.current_pixmap:
             # 确保宽度不小于最小宽度
-            window_width = max(self.current_pixmap.width(), min_width)
-            self.resize(window_width, self.current_pixmap.height() + 100)  # +100为工具栏和属性面板高度
+            window_width = max(self.canvas.width(), min_width)
+            # +100为工具栏和属性面板高度
+            self.resize(window_width, self.canvas.height() + 100)
 
     def setPenWidth(self, width):
         """设置边框粗细"""
@@ -1571,6 +1716,11 @@ class ScreenshotEditor(QWidget):
         self.mosaic_size = size
         print(f"设置马赛克大小: {size}")
 
+    def setBlurRadius(self, radius):
+        """设置模糊半径"""
+        self.blur_radius = radius
+        print(f"设置模糊半径: {radius}")
+
     def setFontSize(self, size):
         """设置字体大小"""
         if size:
@@ -1615,12 +1765,11 @@ class ScreenshotEditor(QWidget):
             return
         
         # 获取当前形状
-        shape = self.shapes[self.resize_shape_index]
-        if shape["type"] not in ["rectangle", "circle"]:
+        if self.shapes.kind(self.resize_shape_index) not in ["rectangle", "circle", "mosaic", "blur"]:
             return
         
         # 获取规范化的矩形（确保左上角是start，右下角是end）
-        rect = QRect(shape["start"], shape["end"]).normalized()
+        rect = self.shapes.rect(self.resize_shape_index)
         left = rect.left()
         top = rect.top()
         right = rect.right()
@@ -1658,52 +1807,22 @@ class ScreenshotEditor(QWidget):
                 new_rect.setBottom(new_rect.top() + min_size)
         
         # 更新形状的起点和终点
-        shape["start"] = new_rect.topLeft()
-        shape["end"] = new_rect.bottomRight()
+        self.shapes.set_points(self.resize_shape_index, new_rect.left(), new_rect.top(),
+                               new_rect.right(), new_rect.bottom())
+        self.indexShape(self.resize_shape_index)
         
         # 更新显示
         self.updateImageLabel()
 
     def finishResizeShape(self):
         """完成形状大小调整"""
+        self.endShapeEdit(self.resize_shape_index)
         self.is_resizing = False
         self.resize_shape_index = -1
         self.resize_handle = -1
-        self.image_label.setCursor(Qt.ArrowCursor)
-
-    def addBorderToPixmap(self, pixmap):
-        """为pixmap添加2px的蓝色边框"""
-        if not pixmap:
-            return QPixmap()
-            
-        # 创建一个比原图大4px的pixmap(左右上下各增加2px)
-        border_width = 2  # 边框宽度
-        width = pixmap.width() + border_width * 2
-        height = pixmap.height() + border_width * 2
-        
-        # 创建新的pixmap并填充透明背景
-        bordered_pixmap = QPixmap(width, height)
-        bordered_pixmap.fill(Qt.transparent)
-        
-        # 创建画家
-        painter = QPainter(bordered_pixmap)
-        painter.setRenderHint(QPainter.Antialiasing)
-        
-        # 绘制蓝色边框
-        border_color = QColor(0, 120, 215)  # 蓝色
-        painter.setPen(QPen(border_color, border_width))
-        
-        # 绘制边框矩形，确保边框完全在pixmap内部
-        border_rect = QRect(border_width//2, border_width//2, 
-                          width - border_width, height - border_width)
-        painter.drawRect(border_rect)
-        
-        # 在中心绘制原始图像
-        painter.drawPixmap(border_width, border_width, pixmap)
-        
-        painter.end()
-        
-        return bordered_pixmap
+        self.updateCompositeExclude()
+        self.invalidateComposite()
+        self.canvas.setCursor(Qt.ArrowCursor)
 
     def keyPressEvent(self, event):
         """处理键盘事件"""
@@ -1716,12 +1835,27 @@ class ScreenshotEditor(QWidget):
                 else:  # 如果没有文本，退出文本模式
                     self.is_text_input = False
                     self.current_text = ""
+                    self.preedit_text = ""
                     if self.text_cursor_timer and self.text_cursor_timer.isActive():
                         self.text_cursor_timer.stop()
                     self.current_tool = None  # 取消当前工具选择
                     self.updateImageLabel()
                 return  # 不关闭窗口，只退出文本模式
             self.close()
+        # Ctrl+加号/减号缩放，Ctrl+0完整显示，Ctrl+1原始大小
+        elif event.modifiers() & Qt.ControlModifier and event.key() in (Qt.Key_Plus, Qt.Key_Equal):
+            self.canvas.set_zoom(self.canvas.zoom * self.canvas.ZOOM_STEP)
+        elif event.modifiers() & Qt.ControlModifier and event.key() == Qt.Key_Minus:
+            self.canvas.set_zoom(self.canvas.zoom / self.canvas.ZOOM_STEP)
+        elif event.modifiers() & Qt.ControlModifier and event.key() == Qt.Key_0:
+            self.canvas.set_zoom(self.canvas.fit_zoom())
+        elif event.modifiers() & Qt.ControlModifier and event.key() == Qt.Key_1:
+            self.canvas.set_zoom(1.0)
+        # Ctrl+Z撤销，Ctrl+Y或Ctrl+Shift+Z重做
+        elif not self.is_text_input and event.matches(QKeySequence.Undo):
+            self.undo()
+        elif not self.is_text_input and event.matches(QKeySequence.Redo):
+            self.redo()
         # 回车完成输入
         elif self.is_text_input and (event.key() == Qt.Key_Return or event.key() == Qt.Key_Enter):
             self.finishTextInput()
@@ -1729,7 +1863,7 @@ class ScreenshotEditor(QWidget):
         elif self.is_text_input and event.key() == Qt.Key_Backspace:
             if self.current_text:
                 self.current_text = self.current_text[:-1]
-                self.updateImageLabel()
+                self.refreshTextInput()
         # 处理中文输入法组合键
         elif event.key() == Qt.Key_Shift or event.key() == Qt.Key_Control or event.key() == Qt.Key_Alt:
             # 忽略这些修饰键的独立按键事件
@@ -1744,25 +1878,20 @@ class ScreenshotEditor(QWidget):
         """切换文本光标的可见状态"""
         if self.is_text_input:
             self.text_cursor_visible = not self.text_cursor_visible
-            self.updateImageLabel()
+            # 只重绘光标所在的几个像素，底图不变
+            self.text_overlay.update(self.canvas.map_rect_from_image(self.caretRect()))
     
     def finishTextInput(self):
         """完成文本输入并保存"""
         if self.is_text_input and self.current_text and self.start_point:
             # 创建文本形状
-            shape = {
-                "type": "text",
-                "start": self.start_point,
-                "end": self.start_point,
-                "color": self.pen_color,
-                "font": self.text_font,
-                "text": self.current_text
-            }
-            self.shapes.append(shape)
+            style = self.shapes.styles.intern(self.pen_color, font=self.text_font)
+            self.addShape("text", self.start_point, self.start_point, style, text=self.current_text)
             print(f"添加文本: {self.current_text}")
         
             # 重置文本输入状态但保持工具选中
             self.current_text = ""
+            self.preedit_text = ""
             
             # 保持is_text_input为True，以便可以继续输入文本
             # 停止光标闪烁但准备重新开始
@@ -1780,17 +1909,17 @@ class ScreenshotEditor(QWidget):
         elif self.is_text_input:
             # 如果没有文本但正在文本输入模式，只重置当前文本
             self.current_text = ""
+            self.preedit_text = ""
             return False  # 返回False表示没有添加文本
             
     def getHandleAtPosition(self, pos):
         """检查指定位置是否有控制点，返回(形状索引, 控制点索引)"""
         handle_size = 12  # 增大控制点检测范围，使其更容易选中
         
-        # 从后向前检查，以便后绘制的形状优先
-        for i in range(len(self.shapes)-1, -1, -1):
-            shape = self.shapes[i]
-            if shape["type"] in ["rectangle", "circle"]:
-                rect = QRect(shape["start"], shape["end"]).normalized()
+        # 外接矩形已包含控制点范围，只检查候选形状，后绘制的形状优先
+        for i in self.shapeCandidates(pos):
+            if self.shapes.kind(i) in ["rectangle", "circle", "mosaic", "blur"]:
+                rect = self.shapes.rect(i)
                 
                 # 检查四个角落的控制点
                 # 左上角
@@ -1808,20 +1937,33 @@ class ScreenshotEditor(QWidget):
         
         return -1, -1
 
-def edit_screenshot(pixmap, screen_pos=None):
-    """创建并显示截图编辑器"""
-    editor = ScreenshotEditor(pixmap, screen_pos)
+def edit_screenshot(pixmap, screen_pos=None, editor=None):
+    """显示截图编辑器，editor为预先创建的编辑器时复用它，否则新建一个"""
+    if editor is None:
+        return ScreenshotEditor(pixmap, screen_pos)
+    editor.load(pixmap, screen_pos)
+    return editor
+
+def open_document(path, screen_pos=None, editor=None):
+    """打开标注文档，在编辑器中继续编辑之前的标注"""
+    document = AnnotationDocument.open(path)
+    editor = edit_screenshot(document.pixmap(), screen_pos, editor)
+    editor.loadDocument(document)
     return editor
 
 if __name__ == "__main__":
     # 测试代码
     app = QApplication(sys.argv)
     
-    # 创建一个测试用的空白图片
-    test_pixmap = QPixmap(800, 600)
-    test_pixmap.fill(Qt.white)
-    
-    # 创建编辑器
-    editor = edit_screenshot(test_pixmap)
+    if len(sys.argv) > 1:
+        # 打开命令行指定的标注文档
+        editor = open_document(sys.argv[1])
+    else:
+        # 创建一个测试用的空白图片
+        test_pixmap = QPixmap(800, 600)
+        test_pixmap.fill(Qt.white)
+        
+        # 创建编辑器
+        editor = edit_screenshot(test_pixmap)
     
     sys.exit(app.exec_()) 
\ No newline at end of file
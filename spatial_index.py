@@ -0,0 +1,79 @@
+class GridIndex:
+    """均匀网格空间索引，用于按位置查找标注
+
+    每个对象登记一个外接矩形和一个层次序号，外接矩形覆盖的每个网格单元都记录该对象；
+    查询一个点只需要检查它所在单元中的对象，结果按序号从大到小（最上层优先）返回
+    """
+
+    def __init__(self, cell=128):
+        self.cell = cell
+        self._cells = {}  # (列, 行) -> set[键]
+        self._items = {}  # 键 -> (外接矩形, 序号, 覆盖的单元)
+
+    def _cover(self, rect):
+        cell = self.cell
+        return [(cx, cy)
+                for cy in range(rect.top() // cell, rect.bottom() // cell + 1)
+                for cx in range(rect.left() // cell, rect.right() // cell + 1)]
+
+    def insert(self, key, rect, order):
+        """登记对象，rect为空时只记录序号，不会被查询到"""
+        if key in self._items:
+            self.remove(key)
+        cells = self._cover(rect) if rect is not None and not rect.isEmpty() else []
+        for cell in cells:
+            self._cells.setdefault(cell, set()).add(key)
+        self._items[key] = (rect, order, cells)
+
+    def update(self, key, rect):
+        """对象移动或改变大小后更新外接矩形，序号不变"""
+        item = self._items.get(key)
+        if item is not None:
+            self.insert(key, rect, item[1])
+
+    def remove(self, key):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        for cell in item[2]:
+            keys = self._cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self._cells[cell]
+
+    def bounds(self, key):
+        return self._items[key][0]
+
+    def query(self, x, y):
+        """返回外接矩形包含 (x, y) 的对象 [(序号, 键)]，最上层的在前"""
+        keys = self._cells.get((x // self.cell, y // self.cell))
+        if not keys:
+            return []
+        items = self._items
+        hits = [(items[key][1], key) for key in keys if items[key][0].contains(x, y)]
+        hits.sort(reverse=True)
+        return hits
+
+    def query_rect(self, rect):
+        """返回外接矩形与rect相交的对象 [(序号, 键)]，按序号从小到大（绘制顺序）"""
+        cell = self.cell
+        items = self._items
+        count = ((rect.right() // cell - rect.left() // cell + 1) *
+                 (rect.bottom() // cell - rect.top() // cell + 1))
+        if count > len(items):
+            # 范围覆盖的单元比对象还多时（缩小显示），直接检查所有对象
+            keys = [key for key, item in items.items() if item[2]]
+        else:
+            keys = set()
+            for cover in self._cover(rect):
+                keys.update(self._cells.get(cover, ()))
+        hits = [(items[key][1], key) for key in keys if items[key][0].intersects(rect)]
+        hits.sort()
+        return hits
+
+    def clear(self):
+        self._cells.clear()
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)